@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Post, Comment
+from . import jobs
+from .models import Post, Comment, ImageBlob, Job, Place, Tag
 
 @admin.register(Post)
 class PostAdmin(admin.ModelAdmin):
@@ -13,3 +14,30 @@ class CommentAdmin(admin.ModelAdmin):
     list_display = ('content', 'author', 'post', 'created_date')
     list_filter = ('created_date', 'author')
     search_fields = ('content', 'author__username', 'post__title')
+
+@admin.register(Tag)
+class TagAdmin(admin.ModelAdmin):
+    list_display = ('name', 'usage_count')
+    search_fields = ('name',)
+
+@admin.register(ImageBlob)
+class ImageBlobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'ref_count')
+    search_fields = ('name',)
+
+@admin.register(Place)
+class PlaceAdmin(admin.ModelAdmin):
+    list_display = ('name', 'country_code', 'population', 'latitude', 'longitude')
+    list_filter = ('country_code',)
+    search_fields = ('search_name',)
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('task', 'status', 'attempts', 'max_attempts', 'run_after', 'locked_by', 'created_date')
+    list_filter = ('status', 'task')
+    readonly_fields = ('locked_at', 'locked_by', 'last_error', 'finished_date')
+    actions = ['retry_jobs']
+
+    @admin.action(description='Retry selected jobs')
+    def retry_jobs(self, request, queryset):
+        self.message_user(request, f'Requeued {jobs.retry(queryset)} jobs')
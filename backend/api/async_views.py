@@ -0,0 +1,104 @@
+"""Async versions of the public read endpoints, for ASGI deployments.
+
+Enabled with ASYNC_READ_VIEWS (see api/urls.py). GET and HEAD are served
+by coroutines that fetch rows with the async ORM, so a slow client only
+holds an open connection, not a worker. Everything the serializers read
+is prefetched, which keeps serialization free of queries and safe to run
+on the event loop. Other methods on the same URLs are handed to the
+regular DRF views in a thread.
+
+Read requests are answered without authenticating, as every reader sees
+the same representation; an invalid token is not rejected here as it is
+by the DRF views.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from rest_framework.exceptions import APIException, NotFound
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from . import cache as response_cache, perf
+from .conditional import apost_validators
+from .models import Post
+from .pagination import PostCursorPagination
+from .serializers import PostSerializer, PostSummarySerializer
+from .views import PostDetailView, PostListView, filter_feed, get_fieldset, public_posts as sync_public_posts
+
+
+def json_response(data, status=200):
+    with perf.rendering():
+        body = JSONRenderer().render(data)
+    return HttpResponse(body, status=status, content_type='application/json')
+
+
+def error_response(exc):
+    detail = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    return json_response(detail, status=exc.status_code)
+
+
+def async_reads(sync_view):
+    """Serve GET and HEAD with the decorated coroutine and other methods with ``sync_view``"""
+    sync_view = sync_to_async(sync_view)
+
+    def decorator(func):
+        @wraps(func)
+        async def view(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return await sync_view(request, *args, **kwargs)
+            try:
+                return await func(Request(request), *args, **kwargs)
+            except APIException as exc:
+                return error_response(exc)
+        # The DRF views do their own CSRF checks
+        view.csrf_exempt = True
+        return view
+    return decorator
+
+
+async def render_feed(request, queryset, context=None):
+    """Conditional, cached feed page; mirrors PostListView.list()"""
+    cached, generation = response_cache.lookup_feed(request)
+    if cached is not None:
+        return cached
+    fields, expand = get_fieldset(request)
+    paginator = PostCursorPagination()
+    # Every sort key is loaded up front: reading a deferred one would query on the event loop
+    ordering = paginator.get_ordering(request)
+    page = await paginator.apaginate_queryset(
+        PostSummarySerializer.prepare_queryset(queryset, fields, expand, ordering), request,
+    )
+    serializer = PostSummarySerializer(page, many=True, fields=fields, expand=expand, context=context or {})
+    data = paginator.get_paginated_response(serializer.data).data
+    return response_cache.store_feed(request, generation, data)
+
+
+@async_reads(sync_public_posts)
+async def public_posts(request):
+    return await render_feed(request, filter_feed(Post.objects.all(), request))
+
+
+@async_reads(PostListView.as_view())
+async def post_list(request):
+    return await render_feed(request, filter_feed(Post.objects.all(), request), context={'request': request})
+
+
+@async_reads(PostDetailView.as_view())
+async def post_detail(request, pk):
+    """Mirrors PostDetailView.retrieve()"""
+    validators = await apost_validators(request, pk)
+    if validators is None:
+        raise NotFound()
+    not_modified = validators.not_modified(request)
+    if not_modified is not None:
+        return not_modified
+    cached, version = response_cache.lookup_post(request, pk)
+    if cached is not None:
+        return validators.apply(cached)
+    try:
+        post = await Post.objects.for_feed().aget(pk=pk)
+    except Post.DoesNotExist:
+        raise NotFound()
+    data = PostSerializer(post, context={'request': request}).data
+    return validators.apply(response_cache.store_post(request, pk, version, data))
@@ -0,0 +1,131 @@
+"""JWT authentication without a user query on every request.
+
+``CachedJWTAuthentication`` resolves the ``user_id`` claim through two
+cache tiers: a small in-process LRU with a TTL of a few seconds, then the
+``default`` cache (shared between workers when it is configured to be).
+Saving or deleting a user drops both entries in this process and the
+``default`` cache entry. With a shared ``default`` cache (Redis, Memcached,
+database) other processes notice within AUTH_USER_LOCAL_TTL seconds; with
+the default per-process local-memory cache they only do once their own
+entry expires, up to AUTH_USER_CACHE_TTL seconds.
+
+With AUTH_STATELESS_USERS the user is built from the token claims alone,
+so authentication needs no cache or database at all. Changes to the
+account (including deactivation) then only apply to tokens issued
+afterwards.
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from . import metrics
+
+# Profile fields copied into tokens for stateless authentication
+USER_CLAIMS = ['username', 'email', 'first_name', 'last_name', 'is_staff', 'is_superuser']
+LOCAL_CACHE_SIZE = 1024
+
+_local_users = OrderedDict()
+_local_lock = threading.Lock()
+
+
+def _cache_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def get_cached_user(user_id):
+    """The cached user with this id, or ``None``"""
+    now = time.monotonic()
+    with _local_lock:
+        entry = _local_users.get(user_id)
+        if entry is not None and entry[0] > now:
+            _local_users.move_to_end(user_id)
+            metrics.cache_lookup('auth_user_local', hit=True)
+            # Each request gets its own copy to modify
+            return copy.copy(entry[1])
+    metrics.cache_lookup('auth_user_local', hit=False)
+    user = caches['default'].get(_cache_key(user_id))
+    metrics.cache_lookup('auth_user', hit=user is not None)
+    if user is not None:
+        _remember(user_id, user)
+    return user
+
+
+def cache_user(user):
+    caches['default'].set(_cache_key(user.pk), user, settings.AUTH_USER_CACHE_TTL)
+    _remember(user.pk, user)
+
+
+def forget_user(user_id):
+    with _local_lock:
+        _local_users.pop(user_id, None)
+    caches['default'].delete(_cache_key(user_id))
+
+
+def clear_local_users():
+    with _local_lock:
+        _local_users.clear()
+
+
+def _remember(user_id, user):
+    with _local_lock:
+        _local_users[user_id] = (time.monotonic() + settings.AUTH_USER_LOCAL_TTL, copy.copy(user))
+        _local_users.move_to_end(user_id)
+        while len(_local_users) > LOCAL_CACHE_SIZE:
+            _local_users.popitem(last=False)
+
+
+def tokens_for_user(user):
+    """A refresh token (and through it an access token) carrying USER_CLAIMS"""
+    refresh = RefreshToken.for_user(user)
+    for claim in USER_CLAIMS:
+        refresh[claim] = getattr(user, claim)
+    return refresh
+
+
+def user_from_claims(token):
+    """An unsaved-looking User built from token claims, or ``None`` for older tokens"""
+    if any(claim not in token for claim in USER_CLAIMS):
+        return None
+    user = User(
+        is_active=True,
+        **{api_settings.USER_ID_FIELD: token[api_settings.USER_ID_CLAIM]},
+        **{claim: token[claim] for claim in USER_CLAIMS},
+    )
+    # Behaves as a stored row for foreign keys; never save() it
+    user._state.adding = False
+    user._state.db = 'default'
+    return user
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        if settings.AUTH_STATELESS_USERS and api_settings.USER_ID_CLAIM in validated_token:
+            user = user_from_claims(validated_token)
+            if user is not None:
+                return user
+
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        user = get_cached_user(user_id) if user_id is not None else None
+        if user is None:
+            # Loads the user and runs the checks below
+            user = super().get_user(validated_token)
+            cache_user(user)
+            return user
+
+        if not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != get_md5_hash_password(user.password):
+                raise AuthenticationFailed(_("The user's password has been changed."), code='password_changed')
+        return user
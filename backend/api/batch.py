@@ -0,0 +1,57 @@
+"""Bulk inserts behind the /api/batch/ endpoints.
+
+``bulk_create()`` does not send model signals, so these functions do what
+the signals do for single saves: geocoding, tag links and usage counts,
+comment counters, search indexing and cache invalidation. Each runs in one
+transaction, so a batch is stored completely or not at all.
+"""
+from django.db import transaction
+
+from . import cache as response_cache, tasks
+from .models import Comment, Post, PostTag, Tag
+from .signals import invalidate
+
+
+def create_posts(author, items):
+    """Insert posts from validated PostCreateSerializer data; returns the posts"""
+    posts = []
+    # Posts from one import often share locations; geocode each once
+    places = {}
+    for data in items:
+        fields = {name: value for name, value in data.items() if name != 'tags'}
+        post = Post(author=author, **fields)
+        if post.location not in places:
+            post.geocode()
+            places[post.location] = (post.latitude, post.longitude, post.geohash)
+        post.latitude, post.longitude, post.geohash = places[post.location]
+        posts.append(post)
+
+    with transaction.atomic():
+        Post.objects.bulk_create(posts)
+        names = sorted({name for data in items for name in data.get('tags', [])})
+        tags = {tag.name: tag for tag in Tag.objects.resolve(names)}
+        PostTag.objects.bulk_create([
+            PostTag(post=post, tag=tags[name])
+            for post, data in zip(posts, items)
+            for name in data.get('tags', [])
+        ])
+        Tag.objects.refresh_usage([tag.pk for tag in tags.values()])
+        tasks.index_posts.enqueue([post.pk for post in posts])
+        invalidate(response_cache.invalidate_feed)
+    return posts
+
+
+def create_comments(author, items):
+    """Insert comments from validated BatchCommentSerializer data; returns the comments"""
+    comments = [
+        Comment(author=author, post_id=data['post'], content=data['content'])
+        for data in items
+    ]
+    post_ids = sorted({comment.post_id for comment in comments})
+    with transaction.atomic():
+        Comment.objects.bulk_create(comments)
+        Post.objects.filter(pk__in=post_ids).refresh_comment_stats()
+        for post_id in post_ids:
+            invalidate(response_cache.invalidate_post, post_id)
+        invalidate(response_cache.invalidate_feed_activity)
+    return comments
@@ -0,0 +1,200 @@
+"""Response cache for the post feeds and post detail.
+
+Rendered JSON bodies are stored in the ``feeds`` cache. Entries are
+validated against version tokens instead of being deleted:
+
+* ``feed:generation`` changes when posts are created or deleted, which
+  shifts every feed page.
+* ``feed:activity`` changes when a comment is added or deleted. Only
+  pages ordered by comment counters (``?sort=discussed``/``active``)
+  depend on it, since a comment can move any post across their pages.
+* ``post:version:<id>`` changes when a post or one of its comments
+  changes. A cached page remembers the versions of the posts it contains,
+  so an edit only invalidates the pages that include that post.
+
+Tokens are random rather than counters so a token evicted from the cache
+can never come back with a value an old entry was stored under. They start
+with the time they were made, which post detail uses as a Last-Modified
+(see api/conditional.py).
+
+Feed pages get their ETag (a hash of the body) and Last-Modified (when the
+entry was stored) from the cache entry, so revalidating an unchanged page
+costs cache lookups and no query.
+"""
+import hashlib
+import time
+import uuid
+
+from django.core.cache import caches
+from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+
+from . import metrics, perf
+from .conditional import Validators
+
+FEED_GENERATION_KEY = 'feed:generation'
+FEED_ACTIVITY_KEY = 'feed:activity'
+# PostCursorPagination orderings that follow comments_count/last_commented_at
+ACTIVITY_SORTS = ('discussed', 'active')
+HITS_KEY = 'stats:hits'
+MISSES_KEY = 'stats:misses'
+
+
+def get_cache():
+    return caches['feeds']
+
+
+def _new_token():
+    return f'{int(time.time())}-{uuid.uuid4().hex}'
+
+
+def token_time(token):
+    """When ``token`` was made, in seconds since the epoch; None for tokens made without a time"""
+    stamp, separator, _ = token.partition('-')
+    return int(stamp) if separator else None
+
+
+def _post_version_key(post_id):
+    return f'post:version:{post_id}'
+
+
+def _get_tokens(keys):
+    """Return the current token for each key, creating missing ones"""
+    cache = get_cache()
+    tokens = cache.get_many(keys)
+    missing = [key for key in keys if key not in tokens]
+    for key in missing:
+        cache.add(key, _new_token(), timeout=None)
+    if missing:
+        tokens.update(cache.get_many(missing))
+    return [tokens.get(key) for key in keys]
+
+
+def _request_hash(request):
+    return hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+
+
+def _count(key):
+    cache = get_cache()
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted between add() and incr(); the counter restarts
+        cache.set(key, 1, timeout=None)
+
+
+def _json_response(body):
+    return HttpResponse(body, content_type='application/json')
+
+
+def _cached_response(body):
+    _count(HITS_KEY)
+    response = _json_response(body)
+    response['X-Cache'] = 'HIT'
+    return response
+
+
+def _render(data):
+    with perf.rendering():
+        return JSONRenderer().render(data)
+
+
+def invalidate_feed():
+    get_cache().set(FEED_GENERATION_KEY, _new_token(), timeout=None)
+
+
+def invalidate_feed_activity():
+    get_cache().set(FEED_ACTIVITY_KEY, _new_token(), timeout=None)
+
+
+def post_version(post_id):
+    """The current version token of a post, see ``lookup_post``"""
+    version, = _get_tokens([_post_version_key(post_id)])
+    return version
+
+
+def invalidate_post(post_id):
+    get_cache().set(_post_version_key(post_id), _new_token(), timeout=None)
+
+
+def invalidate_posts(post_ids):
+    get_cache().set_many({_post_version_key(post_id): _new_token() for post_id in post_ids}, timeout=None)
+
+
+def _conditional(request, validators, response):
+    return validators.not_modified(request) or validators.apply(response)
+
+
+def lookup_feed(request):
+    """Look up a cached feed page for ``request``.
+
+    Returns ``(response, generation)``; ``response`` is ``None`` on a miss,
+    else the page or a 304. ``generation`` must be passed back to
+    ``store_feed`` so a page rendered while the feed changed is stored
+    under the old generation.
+    """
+    keys = [FEED_GENERATION_KEY]
+    if request.GET.get('sort') in ACTIVITY_SORTS:
+        keys.append(FEED_ACTIVITY_KEY)
+    generation = ':'.join(_get_tokens(keys))
+    entry = get_cache().get(f'feed:{generation}:{_request_hash(request)}')
+    if entry is not None:
+        body, post_ids, versions, etag, last_modified = entry
+        keys = [_post_version_key(post_id) for post_id in post_ids]
+        if _get_tokens(keys) == versions:
+            metrics.cache_lookup('feed', hit=True)
+            return _conditional(request, Validators(etag, last_modified), _cached_response(body)), generation
+    metrics.cache_lookup('feed', hit=False)
+    _count(MISSES_KEY)
+    return None, generation
+
+
+def store_feed(request, generation, data):
+    """Render a feed page, cache it with the versions of its posts and return it as a response"""
+    post_ids = [post['id'] for post in data['results']]
+    versions = _get_tokens([_post_version_key(post_id) for post_id in post_ids])
+    body = _render(data)
+    # The same page renders to the same body, so the ETag survives eviction
+    etag = '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+    last_modified = int(time.time())
+    get_cache().set(
+        f'feed:{generation}:{_request_hash(request)}', (body, post_ids, versions, etag, last_modified),
+    )
+    return _conditional(request, Validators(etag, last_modified), _json_response(body))
+
+
+def lookup_post(request, post_id):
+    """Look up a cached post detail; returns ``(response, version)`` like ``lookup_feed``"""
+    version = post_version(post_id)
+    body = get_cache().get(f'post:{post_id}:{version}:{_request_hash(request)}')
+    if body is not None:
+        metrics.cache_lookup('post', hit=True)
+        return _cached_response(body), version
+    metrics.cache_lookup('post', hit=False)
+    _count(MISSES_KEY)
+    return None, version
+
+
+def store_post(request, post_id, version, data):
+    """Render a post detail, cache it and return it as a response"""
+    body = _render(data)
+    get_cache().set(f'post:{post_id}:{version}:{_request_hash(request)}', body)
+    return _json_response(body)
+
+
+def cache_stats():
+    cache = get_cache()
+    counts = cache.get_many([HITS_KEY, MISSES_KEY])
+    hits = counts.get(HITS_KEY, 0)
+    misses = counts.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / total, 4) if total else None,
+    }
+
+
+def reset_stats():
+    get_cache().delete_many([HITS_KEY, MISSES_KEY])
@@ -0,0 +1,77 @@
+"""Conditional GET support (ETag / Last-Modified / 304) for post detail.
+
+Validators come from one small aggregate over the post row and the post's
+version token in the response cache (api/cache.py), so a client polling an
+unchanged post costs one indexed query and no serialization. The token
+changes with the post, its comments and the profiles of their authors,
+which the row alone does not show; ``If-None-Match`` takes precedence when
+a client sends both.
+
+Feed pages get theirs from the response cache instead (api/cache.py):
+an aggregate over the whole feed would cost a scan on every request.
+"""
+import hashlib
+from calendar import timegm
+
+from django.db.models import Count, Max, Sum
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+from .models import Post
+
+
+class Validators:
+    def __init__(self, etag, last_modified):
+        self.etag = etag
+        # Seconds since the epoch, as expected by get_conditional_response
+        self.last_modified = last_modified
+
+    def not_modified(self, request):
+        """Return a 304 response if the request's preconditions match, else ``None``"""
+        response = get_conditional_response(
+            request, etag=self.etag, last_modified=self.last_modified
+        )
+        return self.apply(response) if response is not None else None
+
+    def apply(self, response):
+        if 200 <= response.status_code < 300 or response.status_code == 304:
+            response['ETag'] = self.etag
+            if self.last_modified is not None:
+                response['Last-Modified'] = http_date(self.last_modified)
+        return response
+
+
+# Comment activity comes from the counter columns, so no join is needed
+STATE = {
+    'post_count': Count('id'),
+    'post_id_sum': Sum('id'),
+    'last_updated': Max('updated_date'),
+    'comment_count': Sum('comments_count'),
+    'last_commented': Max('last_commented_at'),
+}
+
+
+def _validators(request, state, pk):
+    # Imported here: api.cache builds on Validators
+    from . import cache as response_cache
+
+    version = response_cache.post_version(pk)
+    # The representation also depends on the query string and host
+    fingerprint = repr((sorted(state.items()), version, request.build_absolute_uri()))
+    etag = '"%s"' % hashlib.sha256(fingerprint.encode()).hexdigest()[:32]
+    changed = [timegm(value.utctimetuple()) for value in (state['last_updated'], state['last_commented']) if value]
+    changed.append(response_cache.token_time(version))
+    last_modified = max((value for value in changed if value is not None), default=None)
+    return Validators(etag, last_modified)
+
+
+def post_validators(request, pk):
+    """Validators for a single post, or ``None`` if it does not exist"""
+    state = Post.objects.filter(pk=pk).order_by().aggregate(**STATE)
+    return _validators(request, state, pk) if state['post_count'] else None
+
+
+async def apost_validators(request, pk):
+    """Async version of ``post_validators``"""
+    state = await Post.objects.filter(pk=pk).order_by().aaggregate(**STATE)
+    return _validators(request, state, pk) if state['post_count'] else None
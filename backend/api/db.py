@@ -0,0 +1,17 @@
+"""Per-connection database setup."""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """Apply SQLITE_PRAGMAS to each new SQLite connection"""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            # PRAGMA takes no parameters; only allow plain words and numbers
+            if not (isinstance(value, int) or str(value).isidentifier()):
+                raise ValueError(f'Invalid value for SQLite PRAGMA {name}: {value!r}')
+            cursor.execute(f'PRAGMA {name} = {value}')
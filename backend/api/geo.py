@@ -0,0 +1,116 @@
+"""Offline geocoding and geohash helpers for post locations.
+
+Locations are resolved against the Place gazetteer (loaded with
+``manage.py load_gazetteer``) and stored on the post as coordinates plus a
+geohash. Nearby queries prefilter with geohash prefix ranges, which are
+plain index range scans, and then rank candidates by exact distance.
+"""
+import math
+import unicodedata
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 9
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def encode_geohash(latitude, longitude, precision=GEOHASH_PRECISION):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        interval, coordinate = (lon_range, longitude) if even else (lat_range, latitude)
+        middle = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            interval[0] = middle
+        else:
+            interval[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+    return ''.join(chars)
+
+
+def cell_size(precision):
+    """Height and width in degrees of a geohash cell"""
+    lat_bits = 5 * precision // 2
+    lon_bits = 5 * precision - lat_bits
+    return 180.0 / 2 ** lat_bits, 360.0 / 2 ** lon_bits
+
+
+def covering_cells(latitude, longitude, radius_km, max_cells=32):
+    """Geohash prefixes whose cells together cover the circle's bounding box"""
+    lat_delta = radius_km / KM_PER_DEGREE
+    cos_lat = max(math.cos(math.radians(latitude)), 0.01)
+    lon_delta = min(radius_km / (KM_PER_DEGREE * cos_lat), 180.0)
+    south, north = max(latitude - lat_delta, -90.0), min(latitude + lat_delta, 90.0)
+    west, east = longitude - lon_delta, longitude + lon_delta
+
+    # Start from the finest precision whose cells are still taller than the
+    # radius, and coarsen near the poles where cells get narrow.
+    precision = 1
+    while precision < GEOHASH_PRECISION and cell_size(precision + 1)[0] >= lat_delta:
+        precision += 1
+    while True:
+        cells = _cells_in_box(south, north, west, east, precision)
+        if len(cells) <= max_cells or precision == 1:
+            return sorted(cells)
+        precision -= 1
+
+
+def _cells_in_box(south, north, west, east, precision):
+    height, width = cell_size(precision)
+    cells = set()
+    lat = south
+    while True:
+        lon = west
+        while True:
+            wrapped = (lon + 180.0) % 360.0 - 180.0
+            cells.add(encode_geohash(min(lat, 89.999999), wrapped, precision))
+            if lon >= east:
+                break
+            lon = min(lon + width, east)
+        if lat >= north:
+            break
+        lat = min(lat + height, north)
+    return cells
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance (haversine)"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def normalize_place_name(name):
+    """Lowercase ASCII form used for gazetteer lookups"""
+    name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode()
+    return ' '.join(name.lower().split())
+
+
+def resolve_location(location):
+    """Return the most populous Place matching a free-text location, or None.
+
+    ``"Porto, Portugal"`` is looked up by its first part; a trailing
+    two-letter part (``"Paris, FR"``) narrows the match to that country.
+    """
+    from .models import Place
+
+    parts = [part.strip() for part in location.split(',') if part.strip()]
+    if not parts:
+        return None
+    places = Place.objects.filter(search_name=normalize_place_name(parts[0]))
+    if len(parts) > 1 and len(parts[-1]) == 2:
+        places = places.filter(country_code=parts[-1].upper())
+    return places.order_by('-population').first()
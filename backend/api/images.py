@@ -0,0 +1,150 @@
+"""Resized derivatives of uploaded post images.
+
+Each original gets one file per preset in ``settings.IMAGE_VARIANTS`` and
+per format in ``settings.IMAGE_VARIANT_FORMATS``, with EXIF orientation
+applied and all metadata dropped. Files live under
+``variants/<preset key>/`` in the media storage; the key is a hash of the
+preset configuration, so changing a preset moves every variant to new
+URLs instead of serving stale sizes.
+"""
+import hashlib
+import json
+import os
+import posixpath
+import tempfile
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from PIL import Image, ImageOps
+
+# Pillow format names for the file extensions we produce
+PIL_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+
+
+def preset_key():
+    config = [settings.IMAGE_VARIANTS, settings.IMAGE_VARIANT_FORMATS, settings.IMAGE_VARIANT_QUALITY]
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:10]
+
+
+def variant_name(image_name, variant, fmt):
+    stem = posixpath.splitext(image_name)[0]
+    return f'variants/{preset_key()}/{stem}/{variant}.{fmt}'
+
+
+def _marker_name(image_name):
+    # Written last by generate_variants(), so its presence means all are done
+    last_variant = list(settings.IMAGE_VARIANTS)[-1]
+    return variant_name(image_name, last_variant, settings.IMAGE_VARIANT_FORMATS[-1])
+
+
+def variants_exist(image_name):
+    return default_storage.exists(_marker_name(image_name))
+
+
+def _resize(image, preset):
+    size = (preset['width'], preset['height'])
+    if preset.get('crop'):
+        return ImageOps.fit(image, size, Image.LANCZOS)
+    resized = image.copy()
+    resized.thumbnail(size, Image.LANCZOS)
+    return resized
+
+
+def _encode(image, fmt):
+    if fmt == 'jpeg' and image.mode != 'RGB':
+        # JPEG has no alpha channel; flatten onto white
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A') if 'A' in image.getbands() else None)
+        image = background
+    buffer = BytesIO()
+    # No exif/icc arguments: the output carries no metadata
+    image.save(buffer, PIL_FORMATS[fmt], quality=settings.IMAGE_VARIANT_QUALITY, optimize=True)
+    return buffer.getvalue()
+
+
+def _replace(name, data):
+    """Write ``name`` in the media storage through a temporary file renamed over it.
+
+    Concurrent writers each rename a complete file into place, and the name
+    never gets a suffix as with ``Storage.save()``, which would leave files
+    ``delete_variants()`` does not know about.
+    """
+    path = default_storage.path(name)
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    handle, temporary = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(handle, 'wb') as file:
+            file.write(data)
+        os.chmod(temporary, settings.FILE_UPLOAD_PERMISSIONS or 0o644)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def generate_variants(image_name):
+    """Write every variant of ``image_name``; returns the variant names"""
+    with default_storage.open(image_name, 'rb') as original:
+        image = Image.open(original)
+        image = ImageOps.exif_transpose(image)
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+
+    written = []
+    # The marker variant is written last, see _marker_name()
+    for variant, preset in settings.IMAGE_VARIANTS.items():
+        resized = _resize(image, preset)
+        for fmt in settings.IMAGE_VARIANT_FORMATS:
+            name = variant_name(image_name, variant, fmt)
+            _replace(name, _encode(resized, fmt))
+            written.append(name)
+    return written
+
+
+def ensure_variants(image_name):
+    if not variants_exist(image_name):
+        generate_variants(image_name)
+
+
+def delete_variants(image_name):
+    """Delete the variants of ``image_name`` made with the current presets"""
+    for variant in settings.IMAGE_VARIANTS:
+        for fmt in settings.IMAGE_VARIANT_FORMATS:
+            default_storage.delete(variant_name(image_name, variant, fmt))
+    try:
+        # The directory is empty now (FileSystemStorage deletes it with rmdir)
+        default_storage.delete(posixpath.dirname(variant_name(image_name, 'any', 'any')))
+    except OSError:
+        pass
+
+
+def variant_urls(post, request=None):
+    """Variant URLs and ``srcset`` strings for a post image, or None.
+
+    Variants that have not been generated yet point at the lazy endpoint,
+    which creates them on first request.
+    """
+    if not post.image:
+        return None
+    image_name = post.image.name
+    ready = variants_exist(image_name)
+
+    def url(variant, fmt):
+        if ready:
+            location = default_storage.url(variant_name(image_name, variant, fmt))
+        else:
+            location = reverse('post-image-variant', args=[post.pk, variant, fmt])
+        return request.build_absolute_uri(location) if request else location
+
+    sizes = {}
+    for variant, preset in settings.IMAGE_VARIANTS.items():
+        sizes[variant] = {'width': preset['width']}
+        for fmt in settings.IMAGE_VARIANT_FORMATS:
+            sizes[variant][fmt] = url(variant, fmt)
+    srcset = {
+        fmt: ', '.join(f"{sizes[variant][fmt]} {sizes[variant]['width']}w" for variant in sizes)
+        for fmt in settings.IMAGE_VARIANT_FORMATS
+    }
+    return {'sizes': sizes, 'srcset': srcset}
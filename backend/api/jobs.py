@@ -0,0 +1,194 @@
+"""A small database-backed job queue for work that should not slow down requests.
+
+Functions decorated with ``@task`` can be queued with ``func.enqueue(*args)``.
+Queued jobs are rows of the Job table: the row is written inside the
+caller's transaction, so a job only becomes visible to workers once the
+data it refers to has been committed. ``manage.py runworker`` claims due
+jobs, using ``SELECT ... FOR UPDATE SKIP LOCKED`` where the database has it
+and a compare-and-swap UPDATE otherwise (SQLite). Failed jobs are retried
+with exponential backoff and end up in the ``dead`` state after
+``max_attempts``; dead jobs can be retried from the admin.
+
+With ``JOBS_INLINE`` on (the default when DEBUG is on), jobs skip the table
+and run in-process once the transaction commits, so no worker is needed
+during development; delayed jobs wait on a timer thread.
+"""
+import logging
+import os
+import random
+import socket
+import threading
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+TASKS = {}
+
+
+def task(func=None, *, max_attempts=None):
+    """Register ``func`` as a task and give it an ``enqueue()`` method"""
+    def register(func):
+        name = f'{func.__module__}.{func.__qualname__}'
+        TASKS[name] = func
+        func.task_name = name
+
+        def enqueue_task(*args, delay=None):
+            return enqueue(name, *args, max_attempts=max_attempts, delay=delay)
+
+        func.enqueue = enqueue_task
+        return func
+    return register(func) if func is not None else register
+
+
+def enqueue(name, *args, max_attempts=None, delay=None):
+    """Queue task ``name`` with JSON-serializable ``args``; returns the Job, or None when run inline"""
+    if name not in TASKS:
+        raise KeyError(f'Unknown task {name!r}')
+    if settings.JOBS_INLINE:
+        if delay:
+            transaction.on_commit(lambda: _run_inline_later(name, args, delay))
+        else:
+            transaction.on_commit(lambda: _run_inline(name, args))
+        return None
+    return Job.objects.create(
+        task=name,
+        args=list(args),
+        max_attempts=max_attempts or settings.JOBS_MAX_ATTEMPTS,
+        run_after=timezone.now() + (delay or timedelta()),
+    )
+
+
+def _run_inline(name, args):
+    try:
+        TASKS[name](*args)
+    except Exception:
+        # The request that queued the job has already committed
+        logger.exception('Inline job %s%r failed', name, tuple(args))
+
+
+def _run_inline_later(name, args, delay):
+    def run():
+        try:
+            _run_inline(name, args)
+        finally:
+            connection.close()
+
+    timer = threading.Timer(delay.total_seconds(), run)
+    # Pending jobs do not keep the process alive; like all inline jobs they are lost on exit
+    timer.daemon = True
+    timer.start()
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+
+
+def claim(worker):
+    """Lock the next due job for ``worker`` and mark it running; None if there is none"""
+    now = timezone.now()
+    due = Job.objects.filter(status=Job.QUEUED, run_after__lte=now).order_by('run_after', 'id')
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            job = due.select_for_update(skip_locked=True).first()
+            if job is None:
+                return None
+            job.status = Job.RUNNING
+            job.attempts += 1
+            job.locked_at = now
+            job.locked_by = worker
+            job.save(update_fields=['status', 'attempts', 'locked_at', 'locked_by'])
+            return job
+
+    # No row locks (SQLite): whichever worker flips the status first owns the job
+    for job_id in due.values_list('id', flat=True)[:10]:
+        claimed = Job.objects.filter(pk=job_id, status=Job.QUEUED).update(
+            status=Job.RUNNING, attempts=F('attempts') + 1, locked_at=now, locked_by=worker,
+        )
+        if claimed:
+            return Job.objects.get(pk=job_id)
+    return None
+
+
+def backoff(attempts):
+    """Delay before retry number ``attempts``, doubling each time, with 10% jitter"""
+    seconds = min(settings.JOBS_BACKOFF_SECONDS * 2 ** (attempts - 1), settings.JOBS_BACKOFF_MAX_SECONDS)
+    return timedelta(seconds=seconds * random.uniform(1.0, 1.1))
+
+
+def run(job):
+    """Execute a claimed job and record the outcome; returns True on success"""
+    try:
+        func = TASKS[job.task]
+        func(*job.args)
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning('Job %s (%s) failed on attempt %s', job.pk, job.task, job.attempts, exc_info=True)
+        if job.attempts >= job.max_attempts:
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.DEAD, last_error=error, locked_at=None, finished_date=timezone.now(),
+            )
+        else:
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.QUEUED, last_error=error, locked_at=None,
+                run_after=timezone.now() + backoff(job.attempts),
+            )
+        return False
+    Job.objects.filter(pk=job.pk).update(status=Job.DONE, locked_at=None, finished_date=timezone.now())
+    return True
+
+
+def requeue_stale():
+    """Put back jobs whose worker died mid-run; returns how many were requeued.
+
+    Jobs that have used up their attempts are marked dead instead, so a job
+    that crashes its worker every time does not run forever.
+    """
+    now = timezone.now()
+    stale = Job.objects.filter(status=Job.RUNNING, locked_at__lt=now - timedelta(seconds=settings.JOBS_LOCK_TIMEOUT))
+    stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.DEAD, last_error='The worker running this job stopped responding.',
+        locked_at=None, locked_by='', finished_date=now,
+    )
+    return stale.update(status=Job.QUEUED, locked_at=None, locked_by='')
+
+
+def purge_finished():
+    """Delete completed jobs older than JOBS_RETENTION_DAYS"""
+    cutoff = timezone.now() - timedelta(days=settings.JOBS_RETENTION_DAYS)
+    return Job.objects.filter(status=Job.DONE, finished_date__lt=cutoff).delete()[0]
+
+
+def retry(queryset):
+    """Requeue dead (or any) jobs for immediate execution"""
+    return queryset.exclude(status=Job.RUNNING).update(
+        status=Job.QUEUED, attempts=0, run_after=timezone.now(), locked_at=None, locked_by='',
+        finished_date=None,
+    )
+
+
+def work(stop, burst=False):
+    """Claim and run jobs until ``stop`` is set (or, with ``burst``, until none are due).
+
+    Returns the number of jobs run.
+    """
+    name = worker_name()
+    count = 0
+    while not stop.is_set():
+        job = claim(name)
+        if job is None:
+            if burst:
+                break
+            stop.wait(settings.JOBS_POLL_INTERVAL)
+            continue
+        run(job)
+        count += 1
+    return count
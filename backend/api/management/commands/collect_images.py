@@ -0,0 +1,43 @@
+import os
+import posixpath
+
+from django.core.management.base import BaseCommand
+
+from api import tasks
+from api.models import ImageBlob, Post
+from api.storage import image_storage
+
+
+class Command(BaseCommand):
+    help = 'Recount image references and delete images that no post uses'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report images that would be deleted')
+
+    def handle(self, *args, **options):
+        ImageBlob.objects.refresh()
+        # Files without a row, e.g. stored by an upload whose post was never saved
+        known = set(ImageBlob.objects.values_list('name', flat=True))
+        ImageBlob.objects.refresh([name for name in self.stored_images() if name not in known])
+
+        unused = list(ImageBlob.objects.filter(ref_count=0).values_list('name', flat=True))
+        if options['dry_run']:
+            for name in unused:
+                self.stdout.write(name)
+            self.stdout.write(self.style.SUCCESS(f'Found {len(unused)} unused images'))
+            return
+        for name in unused:
+            # Too recent images are left to their collect_image job or the next sweep
+            tasks.collect_unused_image(name)
+        kept = ImageBlob.objects.filter(name__in=unused).count()
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {len(unused) - kept} unused images ({kept} too recent to delete)'
+        ))
+
+    def stored_images(self):
+        directory = Post._meta.get_field('image').upload_to.strip('/')
+        root = image_storage.path(directory)
+        for path, _, files in os.walk(root):
+            relative = os.path.relpath(path, image_storage.location).replace(os.sep, '/')
+            for name in files:
+                yield posixpath.join(relative, name)
@@ -0,0 +1,101 @@
+import tarfile
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.transfer import FORMAT_VERSION, RECORD_TYPES, Checkpoint, Progress, encode, to_record
+
+
+class Command(BaseCommand):
+    help = 'Stream users, posts and comments to an NDJSON file, optionally with post images in a tar archive'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='NDJSON file to write')
+        parser.add_argument('--images', metavar='TAR', help='Also pack post images into this tar archive')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows read per query')
+        parser.add_argument('--resume', action='store_true', help='Continue an interrupted export from its checkpoint')
+        parser.add_argument('--checkpoint', help='Checkpoint file (default: OUTPUT.checkpoint)')
+
+    def handle(self, *args, **options):
+        checkpoint = Checkpoint(options['checkpoint'] or f"{options['output']}.checkpoint")
+        state = None
+        if options['resume']:
+            state = checkpoint.load()
+            if state is None:
+                raise CommandError(f'No checkpoint at {checkpoint.path}')
+            if options['images'] and 'images_offset' not in state:
+                raise CommandError('The interrupted export did not include images')
+
+        self.chunk_size = options['chunk_size']
+        self.checkpoint = checkpoint
+        self.progress = Progress(self.stdout.write)
+        self.output = self.open(options['output'], state and state['offset'])
+        self.images = None
+        if options['images']:
+            images_file = self.open(options['images'], state and state['images_offset'])
+            # Mode 'w' appends members from the current position of the file
+            self.images = tarfile.open(fileobj=images_file, mode='w')
+
+        try:
+            if state is None:
+                self.output.write(encode({'type': 'meta', 'version': FORMAT_VERSION, 'exported_at': timezone.now()}))
+            kinds = list(RECORD_TYPES)
+            for kind in kinds[kinds.index(state['stage']) if state else 0:]:
+                last_id = state['last_id'] if state and state['stage'] == kind else 0
+                self.export(kind, last_id)
+        finally:
+            self.output.close()
+            if self.images is not None:
+                self.images.close()
+                self.images.fileobj.close()
+
+        checkpoint.clear()
+        self.progress.report('Exported ')
+
+    def open(self, path, offset):
+        if offset is None:
+            return open(path, 'wb')
+        # Drop whatever was written after the last checkpoint
+        stream = open(path, 'r+b')
+        stream.seek(offset)
+        stream.truncate()
+        return stream
+
+    def export(self, kind, last_id):
+        model, _ = RECORD_TYPES[kind]
+        queryset = model.objects.filter(pk__gt=last_id).order_by('pk')
+        if kind == 'post':
+            # Prefetched per chunk by iterator()
+            queryset = queryset.prefetch_related('tags')
+        pending = 0
+        for obj in queryset.iterator(chunk_size=self.chunk_size):
+            self.output.write(encode(to_record(kind, obj)))
+            if kind == 'post' and obj.image and self.images is not None:
+                self.pack(obj.image.name)
+            last_id = obj.pk
+            pending += 1
+            if pending == self.chunk_size:
+                self.save_checkpoint(kind, last_id)
+                self.progress.add(kind, pending)
+                pending = 0
+        self.save_checkpoint(kind, last_id)
+        self.progress.add(kind, pending)
+
+    def pack(self, name):
+        try:
+            with default_storage.open(name, 'rb') as source:
+                info = tarfile.TarInfo(name)
+                info.size = source.size
+                info.mtime = int(timezone.now().timestamp())
+                self.images.addfile(info, source)
+        except FileNotFoundError:
+            self.stderr.write(f'Image {name} is missing; skipped')
+
+    def save_checkpoint(self, kind, last_id):
+        self.output.flush()
+        state = {'stage': kind, 'last_id': last_id, 'offset': self.output.tell()}
+        if self.images is not None:
+            self.images.fileobj.flush()
+            state['images_offset'] = self.images.offset
+        self.checkpoint.save(**state)
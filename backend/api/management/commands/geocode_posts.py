@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from api import cache as response_cache
+from api.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Resolve post locations to coordinates using the loaded gazetteer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Re-geocode posts that already have coordinates')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(location='').only('id', 'location').order_by('pk')
+        if not options['all']:
+            posts = posts.filter(latitude__isnull=True)
+        resolved = total = 0
+        last_id = 0
+        # Batches by primary key: no read cursor stays open while rows are updated
+        while True:
+            batch = list(posts.filter(pk__gt=last_id)[:options['batch_size']])
+            if not batch:
+                break
+            last_id = batch[-1].pk
+            for post in batch:
+                post.geocode()
+            Post.objects.bulk_update(batch, ['latitude', 'longitude', 'geohash'])
+            for post in batch:
+                response_cache.invalidate_post(post.pk)
+            total += len(batch)
+            resolved += sum(post.latitude is not None for post in batch)
+        if total:
+            response_cache.invalidate_feed()
+        self.stdout.write(self.style.SUCCESS(f'Resolved {resolved} of {total} post locations'))
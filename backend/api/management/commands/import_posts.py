@@ -0,0 +1,138 @@
+import json
+import posixpath
+import tarfile
+
+from django.contrib.auth.models import User
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from api import cache as response_cache, search
+from api.models import Comment, ImageBlob, Post, PostTag, Tag
+from api.transfer import FORMAT_VERSION, RECORD_TYPES, Checkpoint, Progress, from_record
+
+
+class Command(BaseCommand):
+    help = 'Load users, posts and comments from an NDJSON export made by export_posts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='NDJSON file to read')
+        parser.add_argument('--images', metavar='TAR', help='Tar archive of post images written by export_posts')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Rows inserted per transaction')
+        parser.add_argument('--resume', action='store_true', help='Continue an interrupted import from its checkpoint')
+        parser.add_argument('--checkpoint', help='Checkpoint file (default: INPUT.checkpoint)')
+        parser.add_argument('--skip-index', action='store_true', help='Do not rebuild the search index afterwards')
+
+    def handle(self, *args, **options):
+        checkpoint = Checkpoint(options['checkpoint'] or f"{options['input']}.checkpoint")
+        state = checkpoint.load() if options['resume'] else None
+        if options['resume'] and state is None:
+            raise CommandError(f'No checkpoint at {checkpoint.path}')
+
+        self.progress = Progress(self.stdout.write)
+        if options['images']:
+            self.unpack(options['images'])
+
+        batch_size = options['batch_size']
+        try:
+            source = open(options['input'], 'rb')
+        except OSError as exc:
+            raise CommandError(str(exc))
+        with source:
+            if state is not None:
+                source.seek(state['offset'])
+            kind, batch = None, []
+            while True:
+                line_start = source.tell()
+                line = source.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if record.get('type') == 'meta':
+                    if record.get('version', 0) > FORMAT_VERSION:
+                        raise CommandError(f"Export format version {record['version']} is not supported")
+                    continue
+                if record.get('type') not in RECORD_TYPES:
+                    raise CommandError(f'Unknown record at byte {line_start}: {line[:80]!r}')
+                # Records of one type come together; flush when the type changes
+                # so users exist before their posts and posts before comments
+                if batch and (record['type'] != kind or len(batch) >= batch_size):
+                    self.flush(kind, batch)
+                    checkpoint.save(offset=line_start)
+                    batch = []
+                kind = record['type']
+                batch.append(record)
+            if batch:
+                self.flush(kind, batch)
+                checkpoint.save(offset=source.tell())
+
+        self.finish(skip_index=options['skip_index'])
+        checkpoint.clear()
+        self.progress.report('Imported ')
+
+    def flush(self, kind, records):
+        model, _ = RECORD_TYPES[kind]
+        objects, tag_lists = zip(*(from_record(record) for record in records))
+        # Rows that already exist (e.g. from an interrupted run) are skipped
+        with transaction.atomic():
+            if kind == 'post':
+                updated = [post.updated_date for post in objects]
+                existing = set(Post.objects.filter(pk__in=[post.pk for post in objects]).values_list('pk', flat=True))
+            model.objects.bulk_create(objects, ignore_conflicts=True)
+            if kind == 'post':
+                # Tags and dates only for the posts inserted here; skipped rows keep theirs
+                inserted = [
+                    (post, tags, updated_date) for post, tags, updated_date in zip(objects, tag_lists, updated)
+                    if post.pk not in existing
+                ]
+                if inserted:
+                    self.save_post_extras(*zip(*inserted))
+            elif kind == 'comment':
+                Post.objects.filter(pk__in={comment.post_id for comment in objects}).refresh_comment_stats()
+        self.progress.add(kind, len(objects))
+
+    def save_post_extras(self, posts, tag_lists, updated):
+        # bulk_create() stamps updated_date (auto_now); restore the exported value
+        for post, updated_date in zip(posts, updated):
+            post.updated_date = updated_date
+        Post.objects.bulk_update([post for post in posts if post.updated_date], ['updated_date'])
+        tag_lists = [Tag.parse(names) for names in tag_lists]
+        tags = {tag.name: tag.pk for tag in Tag.objects.resolve(sorted({n for names in tag_lists for n in names}))}
+        PostTag.objects.bulk_create(
+            [PostTag(post_id=post.pk, tag_id=tags[name]) for post, names in zip(posts, tag_lists) for name in names],
+            ignore_conflicts=True,
+        )
+        Tag.objects.refresh_usage(list(tags.values()))
+
+    def unpack(self, path):
+        try:
+            archive = tarfile.open(path)
+        except (OSError, tarfile.TarError) as exc:
+            raise CommandError(str(exc))
+        with archive:
+            for member in archive:
+                name = posixpath.normpath(member.name)
+                if not member.isfile() or name.startswith(('/', '..')):
+                    continue
+                if not default_storage.exists(name):
+                    default_storage.save(name, File(archive.extractfile(member), name=name))
+                self.progress.add('image')
+                # TarFile remembers every member it has read; keep memory flat
+                archive.members = []
+
+    def finish(self, skip_index):
+        # Explicit primary keys leave sequences behind on PostgreSQL
+        statements = connection.ops.sequence_reset_sql(no_style(), [User, Post, Comment, Tag, PostTag])
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+        if not skip_index and connection.vendor in search.BACKENDS:
+            self.stdout.write('Rebuilding the search index...')
+            search.get_backend().rebuild()
+        # Posts were bulk-created, without the signals that count image uses
+        ImageBlob.objects.refresh()
+        response_cache.invalidate_feed()
@@ -0,0 +1,69 @@
+import csv
+import io
+import sys
+import zipfile
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.geo import normalize_place_name
+from api.models import Place
+
+
+class Command(BaseCommand):
+    help = (
+        'Load a GeoNames cities dump (e.g. cities15000.txt or cities15000.zip from '
+        'https://download.geonames.org/export/dump/) into the offline gazetteer'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='GeoNames cities file (.txt or .zip)')
+        parser.add_argument('--min-population', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--replace', action='store_true', help='Delete existing places first')
+
+    def handle(self, *args, **options):
+        csv.field_size_limit(sys.maxsize)
+        loaded = 0
+        with self.open_dump(options['path']) as dump, transaction.atomic():
+            if options['replace']:
+                Place.objects.all().delete()
+            batch = []
+            for row in csv.reader(dump, delimiter='\t', quoting=csv.QUOTE_NONE):
+                # geonameid, name, asciiname, alternatenames, latitude, longitude,
+                # feature class, feature code, country code, ..., population (14)
+                if len(row) < 15:
+                    continue
+                population = int(row[14] or 0)
+                if population < options['min_population']:
+                    continue
+                batch.append(Place(
+                    geoname_id=int(row[0]),
+                    name=row[1][:200],
+                    search_name=normalize_place_name(row[2] or row[1])[:200],
+                    country_code=row[8][:2],
+                    latitude=float(row[4]),
+                    longitude=float(row[5]),
+                    population=population,
+                ))
+                if len(batch) >= options['batch_size']:
+                    loaded += self.save(batch)
+                    batch = []
+            loaded += self.save(batch)
+        self.stdout.write(self.style.SUCCESS(f'Loaded {loaded} places'))
+
+    def save(self, batch):
+        Place.objects.bulk_create(batch, ignore_conflicts=True)
+        return len(batch)
+
+    def open_dump(self, path):
+        try:
+            if path.endswith('.zip'):
+                archive = zipfile.ZipFile(path)
+                names = [name for name in archive.namelist() if name.endswith('.txt')]
+                if not names:
+                    raise CommandError(f'No .txt file in {path}')
+                return io.TextIOWrapper(archive.open(names[0]), encoding='utf-8')
+            return open(path, encoding='utf-8', newline='')
+        except OSError as exc:
+            raise CommandError(str(exc))
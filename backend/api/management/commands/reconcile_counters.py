@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Max
+
+from api.models import Comment, Post
+
+
+class Command(BaseCommand):
+    help = 'Repair drift in the denormalized post comment counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Only report posts whose counters drifted')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        checked = repaired = 0
+        last_id = 0
+        while True:
+            posts = list(
+                Post.objects.filter(pk__gt=last_id).order_by('pk')
+                .values_list('pk', 'comments_count', 'last_commented_at')[:batch_size]
+            )
+            if not posts:
+                break
+            last_id = posts[-1][0]
+            actual = {
+                row['post']: (row['total'], row['last'])
+                for row in Comment.objects.filter(post__in=[pk for pk, _, _ in posts])
+                .order_by().values('post').annotate(total=Count('pk'), last=Max('created_date'))
+            }
+            drifted = [
+                pk for pk, count, last in posts
+                if (count, last) != actual.get(pk, (0, None))
+            ]
+            checked += len(posts)
+            repaired += len(drifted)
+            if drifted and not options['dry_run']:
+                # Recomputed in the UPDATE itself so concurrent comments are not lost
+                Post.objects.filter(pk__in=drifted).refresh_comment_stats()
+
+        action = 'Found' if options['dry_run'] else 'Repaired'
+        self.stdout.write(self.style.SUCCESS(f'{action} {repaired} drifted of {checked} posts'))
@@ -0,0 +1,51 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from api.images import generate_variants, preset_key, variants_exist
+from api.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Generate resized image variants for every post image, e.g. after changing IMAGE_VARIANTS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--missing', action='store_true', help='Only generate variants that do not exist yet')
+        parser.add_argument('--purge', action='store_true', help='Delete variants made with other presets')
+
+    def handle(self, *args, **options):
+        names = (
+            Post.objects.exclude(image='').exclude(image__isnull=True)
+            .order_by().values_list('image', flat=True).distinct()
+        )
+        generated = failed = 0
+        for name in names.iterator():
+            if options['missing'] and variants_exist(name):
+                continue
+            try:
+                generate_variants(name)
+                generated += 1
+            except (OSError, ValueError) as exc:
+                failed += 1
+                self.stderr.write(f'{name}: {exc}')
+        self.stdout.write(self.style.SUCCESS(f'Generated variants for {generated} images ({failed} failed)'))
+
+        if options['purge']:
+            self.purge_stale()
+
+    def purge_stale(self):
+        if not default_storage.exists('variants'):
+            return
+        current = preset_key()
+        directories, _ = default_storage.listdir('variants')
+        for directory in directories:
+            if directory != current:
+                self.delete_tree(f'variants/{directory}')
+                self.stdout.write(f'Removed stale variants/{directory}')
+
+    def delete_tree(self, path):
+        directories, files = default_storage.listdir(path)
+        for name in files:
+            default_storage.delete(f'{path}/{name}')
+        for directory in directories:
+            self.delete_tree(f'{path}/{directory}')
+        default_storage.delete(path)
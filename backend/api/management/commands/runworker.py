@@ -0,0 +1,87 @@
+import multiprocessing
+import signal
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from api import jobs
+
+
+def run_worker(stop):
+    try:
+        jobs.work(stop)
+    finally:
+        connections.close_all()
+
+
+def run_worker_process(stop):
+    # Only the parent handles signals; it tells the children to stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    run_worker(stop)
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs queued in the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency', type=int, default=settings.WORKER_CONCURRENCY,
+            help='Number of worker threads or processes',
+        )
+        parser.add_argument(
+            '--processes', action='store_true',
+            help='Run workers as separate processes instead of threads (for CPU-bound tasks)',
+        )
+        parser.add_argument(
+            '--burst', action='store_true',
+            help='Run the jobs that are due in this process, then exit (e.g. from cron)',
+        )
+
+    def handle(self, *args, **options):
+        jobs.requeue_stale()
+        if options['burst']:
+            done = jobs.work(threading.Event(), burst=True)
+            self.stdout.write(self.style.SUCCESS(f'Ran {done} jobs'))
+            return
+
+        concurrency = max(options['concurrency'], 1)
+        if options['processes']:
+            # Forked children must not share the parent's database connections
+            connections.close_all()
+            context = multiprocessing.get_context('fork')
+            stop = context.Event()
+            workers = [context.Process(target=run_worker_process, args=(stop,)) for _ in range(concurrency)]
+        else:
+            stop = threading.Event()
+            workers = [threading.Thread(target=run_worker, args=(stop,)) for _ in range(concurrency)]
+
+        # The handler only flags the request; the loop below relays it, since
+        # setting `stop` from a handler could interrupt a wait on it
+        stopping = []
+        signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(signum))
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+
+        mode = 'processes' if options['processes'] else 'threads'
+        self.stdout.write(f'Starting {concurrency} worker {mode}')
+        for worker in workers:
+            worker.start()
+
+        # Housekeeping runs in the parent while the workers poll
+        last_housekeeping = time.monotonic()
+        while any(worker.is_alive() for worker in workers):
+            time.sleep(1)
+            if stopping and not stop.is_set():
+                self.stdout.write('Finishing running jobs...')
+                stop.set()
+            if not stop.is_set() and time.monotonic() - last_housekeeping >= 60:
+                jobs.requeue_stale()
+                jobs.purge_finished()
+                connections.close_all()
+                last_housekeeping = time.monotonic()
+        for worker in workers:
+            worker.join()
+        self.stdout.write(self.style.SUCCESS('Worker stopped'))
@@ -0,0 +1,172 @@
+"""Serving uploaded media (post images and their variants).
+
+A file is only served while the post it belongs to exists: originals are
+matched against ``Post.image`` and variants (``variants/<key>/<stem>/...``,
+see api/images.py) against the original they were made from. Files left
+behind by deleted posts, or that no post refers to, are 404.
+
+Responses carry an ETag and Last-Modified from the file's stat, so
+revalidation costs a 304, and ``Cache-Control`` for MEDIA_CACHE_SECONDS.
+Content-addressed images (api/storage.py) and their variants never change
+under their name and are cached for a year as ``immutable``.
+With MEDIA_ACCEL set, the transfer itself is handed to the front proxy:
+
+* ``X-Accel-Redirect`` (nginx): the response names the file under
+  MEDIA_ACCEL_PREFIX, an ``internal`` location aliased to MEDIA_ROOT.
+* ``X-Sendfile`` (Apache mod_xsendfile, lighttpd): the absolute path.
+
+The proxy then handles Range requests. Otherwise the file is sent as a
+``FileResponse``, which WSGI servers with ``wsgi.file_wrapper`` (gunicorn)
+transfer with ``sendfile()``; single byte ranges are answered with 206 and
+are sent with ``sendfile()`` as well.
+"""
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.core.validators import get_available_image_extensions
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_http_date_safe
+
+from .conditional import Validators
+from .models import Post
+from .storage import is_content_addressed
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+IMMUTABLE_SECONDS = 365 * 24 * 3600
+
+
+class FileRange:
+    """Part of an open file, read no further than ``length`` bytes from ``start``.
+
+    ``fileno()`` lets ``wsgi.file_wrapper`` use ``sendfile()``: it starts at
+    the file's current offset and stops at the response's Content-Length.
+    """
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def is_visible(name):
+    """Whether ``name`` is the image of an existing post, or one of its variants"""
+    if name.startswith('variants/'):
+        # variants/<preset key>/<image name without extension>/<variant>.<fmt>
+        stem = posixpath.dirname(name.split('/', 2)[-1])
+        # Exact names, which the image index serves; a prefix match it cannot
+        return Post.objects.filter(image__in=_original_names(stem)).exists()
+    return Post.objects.filter(image=name).exists()
+
+
+def _original_names(stem):
+    # Hashed names have a lowercase extension; older uploads kept the client's
+    extensions = get_available_image_extensions()
+    return [f'{stem}.{extension}' for extension in extensions + [ext.upper() for ext in extensions]]
+
+
+def parse_range(header, size):
+    """``(start, end)`` of a single byte range, None to send the whole file.
+
+    Raises ValueError for a range that lies outside the file.
+    """
+    match = RANGE.match(header.replace(' ', ''))
+    # Multiple ranges are not supported; sending everything is allowed
+    if match is None or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        # The last N bytes
+        if not int(last):
+            raise ValueError(header)
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        if last and int(last) < start:
+            # Invalid, so the header is ignored
+            return None
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size:
+        raise ValueError(header)
+    return start, end
+
+
+def _range_applies(request, validators):
+    # If-Range: only send a part of the file the client already has a copy of
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        return if_range == validators.etag
+    return parse_http_date_safe(if_range) == validators.last_modified
+
+
+def serve(request, name):
+    name = posixpath.normpath(name).lstrip('/')
+    try:
+        path = default_storage.path(name)
+        stat = os.stat(path)
+    except (SuspiciousFileOperation, FileNotFoundError, NotADirectoryError):
+        raise Http404
+    if not os.path.isfile(path) or not is_visible(name):
+        raise Http404
+
+    validators = Validators(f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"', int(stat.st_mtime))
+    response = validators.not_modified(request)
+    if response is None:
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        if settings.MEDIA_ACCEL == 'X-Accel-Redirect':
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX.rstrip('/') + '/' + quote(name)
+        elif settings.MEDIA_ACCEL == 'X-Sendfile':
+            response = HttpResponse(content_type=content_type)
+            response['X-Sendfile'] = path
+        else:
+            response = _file_response(request, path, stat.st_size, content_type, validators)
+    validators.apply(response)
+    if response.status_code in (200, 206, 304):
+        if is_content_addressed(name):
+            patch_cache_control(response, public=True, max_age=IMMUTABLE_SECONDS, immutable=True)
+        else:
+            patch_cache_control(response, public=True, max_age=settings.MEDIA_CACHE_SECONDS)
+    return response
+
+
+def _file_response(request, path, size, content_type, validators):
+    header = request.headers.get('Range')
+    try:
+        byte_range = parse_range(header, size) if header and _range_applies(request, validators) else None
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    file = open(path, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+    else:
+        start, end = byte_range
+        response = FileResponse(FileRange(file, start, end - start + 1), content_type=content_type, status=206)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end - start + 1
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -0,0 +1,64 @@
+"""Prometheus metrics, served at /metrics.
+
+Under gunicorn each worker keeps its metrics in memory-mapped files in
+PROMETHEUS_MULTIPROC_DIR (prometheus_client's multiprocess mode), and a
+scrape answered by any worker adds up the files of all of them.
+gunicorn.conf.py picks the directory and empties it when the server
+starts. Without that variable (runserver, tests, manage.py commands) the
+metrics cover the current process only.
+
+Cache hit ratios come from the hit and miss counters, e.g. in PromQL:
+
+    sum by (cache) (rate(cache_hits_total[5m]))
+      / (sum by (cache) (rate(cache_hits_total[5m])) + sum by (cache) (rate(cache_misses_total[5m])))
+"""
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest, multiprocess,
+)
+
+METHODS = {'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'}
+
+REQUESTS = Counter('http_requests_total', 'HTTP requests by view, method and status', ['view', 'method', 'status'])
+LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time to produce the response', ['view', 'method'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+DB_QUERIES = Histogram(
+    'http_request_db_queries', 'SQL queries per request', ['view'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89),
+)
+CACHE_HITS = Counter('cache_hits_total', 'Cache lookups answered from the cache', ['cache'])
+CACHE_MISSES = Counter('cache_misses_total', 'Cache lookups that missed', ['cache'])
+IMAGE_UPLOAD_BYTES = Histogram(
+    'image_upload_bytes', 'Size of uploaded post images',
+    buckets=[2 ** power for power in range(16, 26)],  # 64 KiB to 32 MiB
+)
+
+
+def view_label(request):
+    """The URL name of the matched pattern; unnamed patterns give the view's dotted path"""
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match is not None else 'unmatched'
+
+
+def observe_request(request, response, duration, queries):
+    view = view_label(request)
+    method = request.method if request.method in METHODS else 'other'
+    REQUESTS.labels(view, method, str(response.status_code)).inc()
+    LATENCY.labels(view, method).observe(duration)
+    DB_QUERIES.labels(view).observe(queries)
+
+
+def cache_lookup(cache, hit):
+    (CACHE_HITS if hit else CACHE_MISSES).labels(cache).inc()
+
+
+def export():
+    """The metrics in the Prometheus text format, and its content type"""
+    registry = REGISTRY
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
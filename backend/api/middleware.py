@@ -0,0 +1,108 @@
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.deprecation import MiddlewareMixin
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+from . import metrics, perf
+from .passwords import HashingBusy
+
+
+class AsyncWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """WhiteNoise that also runs natively under ASGI.
+
+    The stock middleware is sync-only, which makes Django run every
+    request behind it, async views included, through a worker thread.
+    Static files are served the same way; everything else passes
+    straight through to the async handler.
+    """
+    async_capable = True
+
+    def __init__(self, get_response=None, *args, **kwargs):
+        super().__init__(get_response, *args, **kwargs)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
+
+
+class PerformanceMiddleware:
+    """Time requests and count their queries; see api/perf.py and api/metrics.py"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        token = perf.current.set(self.sample())
+        try:
+            response = self.get_response(request)
+        finally:
+            recorder = perf.current.get()
+            perf.current.reset(token)
+        return self.finish(request, response, started, recorder)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        token = perf.current.set(self.sample())
+        try:
+            response = await self.get_response(request)
+        finally:
+            recorder = perf.current.get()
+            perf.current.reset(token)
+        return self.finish(request, response, started, recorder)
+
+    def sample(self):
+        return perf.Recorder(sampled=random.random() < settings.PERF_SAMPLE_RATE)
+
+    def process_template_response(self, request, response):
+        # Runs just before a DRF response is rendered
+        recorder = perf.current.get()
+        if recorder is not None and recorder.sampled:
+            started = time.perf_counter()
+
+            def rendered(response):
+                recorder.render_time += time.perf_counter() - started
+            response.add_post_render_callback(rendered)
+        return response
+
+    def finish(self, request, response, started, recorder):
+        total = time.perf_counter() - started
+        if recorder.sampled and settings.PERF_SERVER_TIMING:
+            response['Server-Timing'] = recorder.server_timing(total)
+        metrics.observe_request(request, response, total, recorder.query_count)
+        if total * 1000 >= settings.PERF_SLOW_REQUEST_MS:
+            perf.log_slow_request(request, response, total, recorder)
+        return response
+
+
+class HashingBusyMiddleware(MiddlewareMixin):
+    """503 with Retry-After for HashingBusy raised outside DRF, e.g. by the admin login"""
+
+    def process_exception(self, request, exception):
+        if isinstance(exception, HashingBusy):
+            response = HttpResponse(str(exception.detail), status=exception.status_code, content_type='text/plain')
+            response['Retry-After'] = str(exception.wait)
+            return response
+        return None
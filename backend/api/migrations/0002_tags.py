@@ -0,0 +1,91 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def parse_tag_strings(apps, schema_editor):
+    Post = apps.get_model('api', 'Post')
+    Tag = apps.get_model('api', 'Tag')
+    PostTag = apps.get_model('api', 'PostTag')
+
+    tag_ids = {}
+    links = []
+    for post_id, value in Post.objects.exclude(tag_list='').values_list('id', 'tag_list').iterator():
+        names = []
+        for name in value.split(','):
+            name = name.strip().lower()[:50]
+            if name and name not in names:
+                names.append(name)
+        for name in names:
+            if name not in tag_ids:
+                tag_ids[name] = Tag.objects.get_or_create(name=name)[0].pk
+            links.append(PostTag(post_id=post_id, tag_id=tag_ids[name]))
+    PostTag.objects.bulk_create(links, batch_size=500)
+
+    for tag in Tag.objects.all():
+        tag.usage_count = PostTag.objects.filter(tag=tag).count()
+        tag.save(update_fields=['usage_count'])
+
+
+def join_tag_names(apps, schema_editor):
+    Post = apps.get_model('api', 'Post')
+    PostTag = apps.get_model('api', 'PostTag')
+
+    names = {}
+    for post_id, name in PostTag.objects.order_by('pk').values_list('post_id', 'tag__name').iterator():
+        names.setdefault(post_id, []).append(name)
+    for post_id, post_names in names.items():
+        Post.objects.filter(pk=post_id).update(tag_list=', '.join(post_names)[:500])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('usage_count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['name'],
+                'indexes': [models.Index(fields=['-usage_count', 'name'], name='api_tag_usage_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PostTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='post_tags', to='api.post')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='post_tags', to='api.tag')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['tag', 'post'], name='api_posttag_tag_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='posttag',
+            constraint=models.UniqueConstraint(fields=('post', 'tag'), name='api_posttag_unique'),
+        ),
+        # Keep the old comma-separated column around under a temporary name
+        # while its contents are copied into the new tables.
+        migrations.RenameField(
+            model_name='post',
+            old_name='tags',
+            new_name='tag_list',
+        ),
+        migrations.RunPython(parse_tag_strings, join_tag_names),
+        migrations.RemoveField(
+            model_name='post',
+            name='tag_list',
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='tags',
+            field=models.ManyToManyField(blank=True, related_name='posts', through='api.PostTag', to='api.tag'),
+        ),
+    ]
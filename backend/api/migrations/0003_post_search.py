@@ -0,0 +1,48 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        'CREATE VIRTUAL TABLE IF NOT EXISTS api_post_search USING fts5('
+        "title, content, location, tags, tokenize='unicode61 remove_diacritics 2')"
+    )
+    schema_editor.execute(
+        'INSERT INTO api_post_search (rowid, title, content, location, tags) '
+        'SELECT p.id, p.title, p.content, p.location, '
+        "COALESCE((SELECT group_concat(t.name, ' ') FROM api_posttag pt "
+        "JOIN api_tag t ON t.id = pt.tag_id WHERE pt.post_id = p.id), '') "
+        'FROM api_post p'
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS api_post_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_tags'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostSearchEntry',
+            fields=[
+                ('post', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_entry', serialize=False, to='api.post')),
+                ('title', models.TextField()),
+                ('content', models.TextField()),
+                ('location', models.TextField()),
+                ('tags', models.TextField()),
+            ],
+            options={
+                'db_table': 'api_post_search',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 4.2.7 on 2026-10-18 17:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_post_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, max_length=12),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='latitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='longitude',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='Place',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('geoname_id', models.PositiveIntegerField(unique=True)),
+                ('name', models.CharField(max_length=200)),
+                ('search_name', models.CharField(max_length=200)),
+                ('country_code', models.CharField(blank=True, max_length=2)),
+                ('latitude', models.FloatField()),
+                ('longitude', models.FloatField()),
+                ('population', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['search_name', '-population'], name='api_place_search_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 4.2.7 on 2026-10-18 17:37
+
+from django.db import migrations, models
+import django.db.models.functions.comparison
+
+
+def fill_comment_stats(apps, schema_editor):
+    Post = apps.get_model('api', 'Post')
+    Comment = apps.get_model('api', 'Comment')
+    comments = Comment.objects.filter(post=models.OuterRef('pk')).order_by().values('post')
+    Post.objects.update(
+        comments_count=django.db.models.functions.comparison.Coalesce(
+            models.Subquery(comments.annotate(total=models.Count('pk')).values('total')), 0
+        ),
+        last_commented_at=models.Subquery(comments.annotate(last=models.Max('created_date')).values('last')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='last_commented_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(fill_comment_stats, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-comments_count', '-created_date', '-id'], name='api_post_discussed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(models.OrderBy(django.db.models.functions.comparison.Coalesce('last_commented_at', 'created_date'), descending=True), models.OrderBy(models.F('id'), descending=True), name='api_post_active_idx'),
+        ),
+    ]
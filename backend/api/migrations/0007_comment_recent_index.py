@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-18 17:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_comment_counters'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', '-created_date', '-id'], name='api_comment_post_recent_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-18 18:30
+
+import api.storage
+from django.db import migrations, models
+import django.db.models.functions.comparison
+
+
+def count_image_uses(apps, schema_editor):
+    # Existing images keep their names; only new uploads are content-addressed
+    Post = apps.get_model('api', 'Post')
+    ImageBlob = apps.get_model('api', 'ImageBlob')
+    names = Post.objects.exclude(image='').exclude(image__isnull=True).order_by().values_list('image', flat=True)
+    ImageBlob.objects.bulk_create([ImageBlob(name=name) for name in set(names)], batch_size=1000)
+    usage = Post.objects.filter(image=models.OuterRef('name')).order_by().values('image')
+    ImageBlob.objects.update(
+        ref_count=django.db.models.functions.comparison.Coalesce(
+            models.Subquery(usage.annotate(total=models.Count('pk')).values('total')), 0
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_post_image_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, db_index=True, null=True, storage=api.storage.ContentAddressedStorage(), upload_to='blog_images/'),
+        ),
+        migrations.RunPython(count_image_uses, migrations.RunPython.noop),
+    ]
@@ -1,31 +1,279 @@
+from django.conf import settings
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 from django.utils import timezone
 
+from .storage import image_storage
+
+class TagManager(models.Manager):
+    def resolve(self, names):
+        """Return Tag objects for ``names``, creating the missing ones"""
+        if not names:
+            return []
+        self.bulk_create([self.model(name=name) for name in names], ignore_conflicts=True)
+        return list(self.filter(name__in=names))
+
+    def refresh_usage(self, tag_ids):
+        """Recount how many posts use each of ``tag_ids``"""
+        usage = (
+            PostTag.objects.filter(tag=models.OuterRef('pk'))
+            .order_by().values('tag').annotate(total=models.Count('pk')).values('total')
+        )
+        self.filter(pk__in=tag_ids).update(usage_count=Coalesce(models.Subquery(usage), 0))
+
+
+class Tag(models.Model):
+    name = models.CharField(max_length=50, unique=True)
+    # Number of posts using the tag, kept up to date by Tag.objects.refresh_usage()
+    usage_count = models.PositiveIntegerField(default=0)
+
+    objects = TagManager()
+
+    def __str__(self):
+        return self.name
+
+    class Meta:
+        ordering = ['name']
+        indexes = [
+            models.Index(fields=['-usage_count', 'name'], name='api_tag_usage_idx'),
+        ]
+
+    @staticmethod
+    def parse(value):
+        """Normalize a comma-separated string (or list) of tag names"""
+        if isinstance(value, str):
+            value = value.split(',')
+        names = []
+        for name in value:
+            name = name.strip().lower()[:50]
+            if name and name not in names:
+                names.append(name)
+        return names
+
+
+# Sort key of the "recently active" feed, shared with its index
+LAST_ACTIVITY = Coalesce('last_commented_at', 'created_date')
+
+
+class PostQuerySet(models.QuerySet):
+    def for_feed(self):
+        """Load posts with their authors, latest comments and tags in a fixed number of queries"""
+        return self.select_related('author').with_recent_comments().prefetch_related('tags')
+
+    def with_recent_comments(self, limit=None):
+        """Prefetch the latest ``limit`` comments of each post into ``recent_comments``"""
+        if limit is None:
+            limit = settings.COMMENTS_EMBED_LIMIT
+        # A sliced prefetch is a single query (a window function per post)
+        comments = Comment.objects.select_related('author').order_by(*Comment.RECENT_FIRST)[:limit]
+        return self.prefetch_related(models.Prefetch('comments', queryset=comments, to_attr='recent_comments'))
+
+    def with_tag(self, name):
+        return self.filter(tags__name=name.strip().lower())
+
+    def with_activity(self):
+        """Annotate ``last_activity_at``: the latest comment, or the creation date"""
+        return self.annotate(last_activity_at=LAST_ACTIVITY)
+
+    def refresh_comment_stats(self):
+        """Recompute comments_count and last_commented_at from the comments table"""
+        comments = Comment.objects.filter(post=models.OuterRef('pk')).order_by().values('post')
+        return self.update(
+            comments_count=Coalesce(
+                models.Subquery(comments.annotate(total=models.Count('pk')).values('total')), 0
+            ),
+            last_commented_at=models.Subquery(
+                comments.annotate(last=models.Max('created_date')).values('last')
+            ),
+        )
+
+
 class Post(models.Model):
     title = models.CharField(max_length=200)
     content = models.TextField()
-    image = models.ImageField(upload_to='blog_images/', blank=True, null=True)
+    # Stored by content hash (api/storage.py); indexed for the visibility
+    # check of media requests (api/media.py) and ImageBlob reference counts
+    image = models.ImageField(upload_to='blog_images/', storage=image_storage, blank=True, null=True, db_index=True)
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     created_date = models.DateTimeField(default=timezone.now)
     updated_date = models.DateTimeField(auto_now=True)
     location = models.CharField(max_length=200, blank=True)
-    tags = models.CharField(max_length=500, blank=True)
+    tags = models.ManyToManyField(Tag, through='PostTag', related_name='posts', blank=True)
+    # Resolved from `location` through the Place gazetteer (see api.geo)
+    latitude = models.FloatField(null=True, blank=True)
+    longitude = models.FloatField(null=True, blank=True)
+    geohash = models.CharField(max_length=12, blank=True, db_index=True)
+    # Maintained by the Comment signals; `manage.py reconcile_counters` repairs drift
+    comments_count = models.PositiveIntegerField(default=0)
+    last_commented_at = models.DateTimeField(null=True, blank=True)
+
+    objects = PostQuerySet.as_manager()
     
     def __str__(self):
         return self.title
     
+    def geocode(self):
+        """Set coordinates and geohash from `location`; cleared when it cannot be resolved"""
+        from .geo import encode_geohash, resolve_location
+        place = resolve_location(self.location) if self.location else None
+        if place is None:
+            self.latitude = self.longitude = None
+            self.geohash = ''
+        else:
+            self.latitude, self.longitude = place.latitude, place.longitude
+            self.geohash = encode_geohash(place.latitude, place.longitude)
+    
+    def set_tags(self, names):
+        """Replace the post's tags with ``names`` and refresh their usage counts"""
+        tags = Tag.objects.resolve(Tag.parse(names))
+        wanted = {tag.pk for tag in tags}
+        current = set(self.post_tags.values_list('tag_id', flat=True))
+        # Deleting PostTag rows refreshes usage counts and ?tag= feeds through a signal
+        self.post_tags.filter(tag_id__in=current - wanted).delete()
+        PostTag.objects.bulk_create([PostTag(post=self, tag_id=tag_id) for tag_id in wanted - current])
+        Tag.objects.refresh_usage(wanted - current)
+        if wanted - current:
+            from . import cache as response_cache
+            from .signals import invalidate
+            # The post joins ?tag= feeds that may be cached without it
+            invalidate(response_cache.invalidate_feed)
+    
     class Meta:
         ordering = ['-created_date']
+        indexes = [
+            # Default feed (PostCursorPagination's 'recent' ordering) and author timelines
+            models.Index(fields=['-created_date', 'id'], name='api_post_recent_idx'),
+            models.Index(fields=['author', '-created_date', 'id'], name='api_post_author_recent_idx'),
+            # ?sort=discussed and ?sort=active feeds
+            models.Index(fields=['-comments_count', '-created_date', '-id'], name='api_post_discussed_idx'),
+            models.Index(LAST_ACTIVITY.desc(), models.F('id').desc(), name='api_post_active_idx'),
+        ]
+
+class ImageBlobManager(models.Manager):
+    def refresh(self, names=None):
+        """Recount how many posts use each image in ``names``, adding missing rows; all images when None"""
+        everything = names is None
+        if everything:
+            names = (
+                Post.objects.exclude(image='').exclude(image__isnull=True)
+                .order_by().values_list('image', flat=True).distinct()
+            )
+        names = [name for name in names if name]
+        self.bulk_create([self.model(name=name) for name in names], ignore_conflicts=True, batch_size=1000)
+        usage = (
+            Post.objects.filter(image=models.OuterRef('name'))
+            .order_by().values('image').annotate(total=models.Count('pk')).values('total')
+        )
+        blobs = self.all() if everything else self.filter(name__in=names)
+        blobs.update(ref_count=Coalesce(models.Subquery(usage), 0))
+
+
+class ImageBlob(models.Model):
+    """A stored post image (see api.storage); deleted with its file once ``ref_count`` drops to 0"""
+    name = models.CharField(max_length=255, unique=True)
+    # Number of posts using the image, kept up to date by ImageBlob.objects.refresh()
+    ref_count = models.PositiveIntegerField(default=0)
+
+    objects = ImageBlobManager()
+
+    def __str__(self):
+        return self.name
 
 class Comment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.TextField()
     created_date = models.DateTimeField(default=timezone.now)
+
+    RECENT_FIRST = ('-created_date', '-id')
     
     def __str__(self):
         return f'Comment by {self.author.username} on {self.post.title}'
     
     class Meta:
         ordering = ['created_date']
+        indexes = [
+            # Latest comments of a post, for embedding and the comments endpoint
+            models.Index(fields=['post', '-created_date', '-id'], name='api_comment_post_recent_idx'),
+        ]
+
+class PostTag(models.Model):
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='post_tags')
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='post_tags')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['post', 'tag'], name='api_posttag_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['tag', 'post'], name='api_posttag_tag_idx'),
+        ]
+
+class Place(models.Model):
+    """Gazetteer entry (a GeoNames city) used to geocode post locations offline"""
+    geoname_id = models.PositiveIntegerField(unique=True)
+    name = models.CharField(max_length=200)
+    search_name = models.CharField(max_length=200)
+    country_code = models.CharField(max_length=2, blank=True)
+    latitude = models.FloatField()
+    longitude = models.FloatField()
+    population = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f'{self.name}, {self.country_code}'
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['search_name', '-population'], name='api_place_search_idx'),
+        ]
+
+
+class PostSearchEntry(models.Model):
+    """Row of the SQLite FTS5 index (see api.search); the table is created by migration 0003"""
+    post = models.OneToOneField(
+        Post, primary_key=True, db_column='rowid', db_constraint=False,
+        on_delete=models.DO_NOTHING, related_name='search_entry',
+    )
+    title = models.TextField()
+    content = models.TextField()
+    location = models.TextField()
+    tags = models.TextField()
+
+    class Meta:
+        managed = False
+        db_table = 'api_post_search'
+
+
+class Job(models.Model):
+    """Background work item claimed and run by ``manage.py runworker`` (see api.jobs)"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    DEAD = 'dead'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (DEAD, 'Dead'),
+    ]
+
+    task = models.CharField(max_length=200)
+    args = models.JSONField(default=list, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created_date = models.DateTimeField(default=timezone.now)
+    finished_date = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f'{self.task}{tuple(self.args)} [{self.status}]'
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='api_job_claim_idx'),
+        ]
@@ -0,0 +1,170 @@
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import Cursor, CursorPagination, _reverse_ordering
+
+
+class KeysetCursorPagination(CursorPagination):
+    """Cursor pagination that keys on every ordering field.
+
+    The cursor holds every sort value of the last row seen and the next page
+    starts strictly after that row, so each page is an index range scan and
+    deep pages cost the same as the first one. DRF's stock cursor only keys
+    on the first ordering field and skips ties with OFFSET, which degrades
+    on orderings with many ties such as comment counts. Orderings must end
+    with the primary key.
+    """
+    page_size = getattr(settings, 'API_PAGE_SIZE', 20)
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'API_MAX_PAGE_SIZE', 100)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.get_page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """``paginate_queryset`` for async views, fetching the page with the async ORM"""
+        queryset = self.get_page_queryset(queryset, request, view)
+        if queryset is None:
+            return None
+        return self.set_page([obj async for obj in queryset])
+
+    def get_page_queryset(self, queryset, request, view=None):
+        """The rows of the requested page, or ``None`` when pagination is off"""
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.position_fields = [self._position_field(queryset, field.lstrip('-')) for field in self.ordering]
+
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+
+        ordering = _reverse_ordering(self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if self.position_values is not None:
+            queryset = queryset.filter(self.after(ordering, self.position_values))
+        # One extra row tells whether there is a following page
+        return queryset[:self.page_size + 1]
+
+    def set_page(self, results):
+        reverse = self.cursor is not None and self.cursor.reverse
+        position = self.cursor.position if self.cursor is not None else None
+        self.page = results[:self.page_size]
+        has_following = len(results) > len(self.page)
+        following = self._get_position_from_instance(results[-1], self.ordering) if has_following else None
+
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.next_position = position is not None, position
+            self.has_previous, self.previous_position = has_following, following
+        else:
+            self.has_next, self.next_position = has_following, following
+            self.has_previous, self.previous_position = position is not None, position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        position = self._get_position_from_instance(self.page[-1], self.ordering) if self.page else self.next_position
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        position = self._get_position_from_instance(self.page[0], self.ordering) if self.page else self.previous_position
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+    def _get_position_from_instance(self, instance, ordering):
+        # The ordering ends with the primary key, so positions are unique
+        return json.dumps([str(getattr(instance, field.lstrip('-'))) for field in ordering])
+
+    @staticmethod
+    def _position_field(queryset, name):
+        # Sort keys such as last_activity_at and search_rank are annotations
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        return queryset.model._meta.get_field(name)
+
+    def decode_cursor(self, request):
+        """The cursor, with its position converted to Python values in ``position_values``"""
+        cursor = super().decode_cursor(request)
+        self.position_values = None
+        if cursor is not None and cursor.position is not None:
+            try:
+                values = json.loads(cursor.position)
+            except ValueError:
+                values = None
+            if not isinstance(values, list) or len(values) != len(self.ordering):
+                raise NotFound(self.invalid_cursor_message)
+            try:
+                self.position_values = [
+                    field.to_python(value) for field, value in zip(self.position_fields, values)
+                ]
+            except (DjangoValidationError, TypeError):
+                raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    @staticmethod
+    def after(ordering, values):
+        """Rows that come after the row with sort ``values`` in ``ordering``"""
+        condition = Q()
+        earlier_equal = Q()
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= earlier_equal & Q(**{f'{name}__{lookup}': value})
+            earlier_equal &= Q(**{name: value})
+        # The redundant bound on the first field lets the database seek the
+        # index instead of scanning it from the start
+        first = ordering[0].lstrip('-')
+        bound = 'lte' if ordering[0].startswith('-') else 'gte'
+        return Q(**{f'{first}__{bound}': values[0]}) & condition
+
+
+class PostCursorPagination(KeysetCursorPagination):
+    """Post feeds, newest first; ``?sort=`` picks another indexed ordering"""
+    ordering = ('-created_date', 'id')
+    sort_query_param = 'sort'
+    sort_orderings = {
+        'recent': ('-created_date', 'id'),
+        'discussed': ('-comments_count', '-created_date', '-id'),
+        'active': ('-last_activity_at', '-id'),
+    }
+
+    def get_ordering(self, request, queryset=None, view=None):
+        if self.sort_query_param is None:
+            return self.ordering
+        sort = request.query_params.get(self.sort_query_param, 'recent')
+        try:
+            return self.sort_orderings[sort]
+        except KeyError:
+            raise ValidationError(
+                {self.sort_query_param: f"Unknown sort order; use one of {', '.join(self.sort_orderings)}."}
+            )
+
+    def get_page_queryset(self, queryset, request, view=None):
+        if self.sort_query_param and request.query_params.get(self.sort_query_param) == 'active':
+            queryset = queryset.with_activity()
+        return super().get_page_queryset(queryset, request, view)
+
+
+class SearchCursorPagination(PostCursorPagination):
+    """Cursor pagination over search results, best match first"""
+    ordering = ('-search_rank', 'id')
+    sort_query_param = None
+
+
+class CommentCursorPagination(KeysetCursorPagination):
+    """Comments of a post, newest first"""
+    ordering = ('-created_date', '-id')
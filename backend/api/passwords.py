@@ -0,0 +1,83 @@
+"""Password hashing with a bounded amount of CPU.
+
+A password hash (PBKDF2 with Django's default iterations) takes tens of
+milliseconds of CPU on purpose, so a burst of logins or registrations can
+keep every worker busy hashing. Each hash made here first leases one of
+PASSWORD_HASHING_SLOTS slots in the default cache and runs on the request
+thread while holding it. When every slot is taken the request fails
+straight away with 503 and Retry-After instead of queueing: from DRF
+views through its exception handler, from the admin login through
+``HashingBusyMiddleware``. With a shared default cache the slots are
+shared by all workers, which caps the cores spent on hashing for the
+whole deployment; with the local-memory cache the cap is per process.
+"""
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+# A slot left behind by a crashed worker frees itself after this many seconds
+SLOT_LEASE = 30
+
+
+class HashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Too many sign-ins in progress, try again shortly.'
+    default_code = 'hashing_busy'
+    # Sent as Retry-After by the DRF exception handler and HashingBusyMiddleware
+    wait = 1
+
+
+def _lease_slot():
+    cache = caches['default']
+    for slot in range(settings.PASSWORD_HASHING_SLOTS):
+        key = f'password_hashing_slot_{slot}'
+        # add() only succeeds if nobody holds the slot
+        if cache.add(key, 1, SLOT_LEASE):
+            return key
+    raise HashingBusy()
+
+
+def run(func, *args):
+    """Call ``func(*args)`` holding a hashing slot; raises HashingBusy when none is free"""
+    key = _lease_slot()
+    try:
+        return func(*args)
+    finally:
+        caches['default'].delete(key)
+
+
+def make_password(raw_password):
+    return run(hashers.make_password, raw_password)
+
+
+def check_password(raw_password, user):
+    """``user.check_password()`` through ``run()``, upgrading outdated hashes like Django does"""
+    outdated = []
+    matches = run(hashers.check_password, raw_password, user.password, outdated.append)
+    if matches and outdated:
+        user.password = make_password(raw_password)
+        user.save(update_fields=['password'])
+    return matches
+
+
+class BoundedHashingBackend(ModelBackend):
+    """ModelBackend with its password hashing done through ``run()``"""
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return None
+        try:
+            user = User._default_manager.get_by_natural_key(username)
+        except User.DoesNotExist:
+            # Hash anyway, so unknown usernames take as long as wrong passwords
+            make_password(password)
+            return None
+        if check_password(password, user) and self.user_can_authenticate(user):
+            return user
+        return None
@@ -0,0 +1,123 @@
+"""Per-request performance figures: total time, SQL queries and rendering.
+
+``PerformanceMiddleware`` (api/middleware.py) gives each request a
+``Recorder``, found through a context variable by the execute wrapper
+that every database connection gets when it opens. Context variables
+follow the request into ``sync_to_async`` threads, so queries made by
+async views count as well. Queries are only counted, except in the
+PERF_SAMPLE_RATE share of sampled requests, where they and the rendering
+are also timed.
+
+Sampled requests get a ``Server-Timing`` header (PERF_SERVER_TIMING).
+Requests slower than PERF_SLOW_REQUEST_MS are logged to ``api.perf`` as
+JSON, with their most expensive queries when the request was sampled.
+"""
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+TOP_QUERIES = 5
+# Logged SQL is cut to this many characters
+SQL_PREVIEW = 300
+
+current = ContextVar('perf_recorder', default=None)
+
+
+class Recorder:
+    def __init__(self, sampled):
+        self.sampled = sampled
+        self.query_count = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        # SQL -> [executions, seconds]; parameters are left out, so
+        # repeated queries (e.g. N+1) add up under one statement
+        self.queries = {}
+
+    def add_query(self, sql, duration):
+        self.query_count += 1
+        self.db_time += duration
+        entry = self.queries.setdefault(sql, [0, 0.0])
+        entry[0] += 1
+        entry[1] += duration
+
+    def top_queries(self):
+        ranked = sorted(self.queries.items(), key=lambda item: item[1][1], reverse=True)[:TOP_QUERIES]
+        return [
+            {'sql': sql[:SQL_PREVIEW], 'count': count, 'ms': round(seconds * 1000, 2)}
+            for sql, (count, seconds) in ranked
+        ]
+
+    def server_timing(self, total):
+        db, render = self.db_time * 1000, self.render_time * 1000
+        return ', '.join([
+            f'total;dur={total * 1000:.1f}',
+            f'db;dur={db:.1f};desc="{self.query_count} queries"',
+            f'render;dur={render:.1f}',
+            f'app;dur={max(total * 1000 - db - render, 0):.1f}',
+        ])
+
+
+def record_queries(execute, sql, params, many, context):
+    recorder = current.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    if not recorder.sampled:
+        recorder.query_count += 1
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        recorder.add_query(sql, time.perf_counter() - started)
+
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    # execute_wrappers outlives reconnects of the same connection object
+    if record_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_queries)
+
+
+@contextmanager
+def rendering():
+    """Count the time spent in the block as rendering (serialization) time"""
+    recorder = current.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if recorder is not None and recorder.sampled:
+            recorder.render_time += time.perf_counter() - started
+
+
+def response_size(response):
+    if response.streaming:
+        length = response.get('Content-Length')
+        return int(length) if length else None
+    return len(response.content)
+
+
+def log_slow_request(request, response, total, recorder):
+    entry = {
+        'method': request.method,
+        'path': request.get_full_path(),
+        'status': response.status_code,
+        'total_ms': round(total * 1000, 1),
+        'bytes': response_size(response),
+        'queries': recorder.query_count,
+        'sampled': recorder.sampled,
+    }
+    if recorder.sampled:
+        entry.update(
+            db_ms=round(recorder.db_time * 1000, 1),
+            render_ms=round(recorder.render_time * 1000, 1),
+            top_queries=recorder.top_queries(),
+        )
+    logger.warning('Slow request %s', json.dumps(entry), extra={'perf': entry})
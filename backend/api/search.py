@@ -0,0 +1,156 @@
+"""Full-text search over posts.
+
+The backend is picked from the database vendor. SQLite keeps an FTS5
+virtual table (``api_post_search``) in sync with posts; PostgreSQL builds
+a weighted ``tsvector`` on the fly and needs no extra table. Both return
+the queryset annotated with ``search_rank`` (higher is better) and
+``search_snippet``, whose matches are wrapped in HIGHLIGHT_START and
+HIGHLIGHT_STOP so the serializer can escape the text before marking it.
+"""
+import re
+
+from django.db import connection
+from django.db.models import BooleanField, FloatField, TextField
+from django.db.models.expressions import RawSQL
+
+# Control characters never appear in user text, so they are safe markers
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_STOP = '\x03'
+
+
+class SQLiteSearchBackend:
+    table = 'api_post_search'
+    # bm25 weights for the title, content, location and tags columns
+    weights = (10.0, 1.0, 2.0, 5.0)
+    snippet_tokens = 24
+
+    # Flattens a post and its tag names into one row of the index
+    document_sql = (
+        'SELECT p.id, p.title, p.content, p.location, '
+        "COALESCE((SELECT group_concat(t.name, ' ') FROM api_posttag pt "
+        'JOIN api_tag t ON t.id = pt.tag_id WHERE pt.post_id = p.id), \'\') '
+        'FROM api_post p'
+    )
+
+    def index(self, post_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [post_id])
+            cursor.execute(
+                f'INSERT INTO {self.table} (rowid, title, content, location, tags) '
+                f'{self.document_sql} WHERE p.id = %s',
+                [post_id],
+            )
+
+    def remove(self, post_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [post_id])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            cursor.execute(
+                f'INSERT INTO {self.table} (rowid, title, content, location, tags) {self.document_sql}'
+            )
+            cursor.execute(f'SELECT count(*) FROM {self.table}')
+            return cursor.fetchone()[0]
+
+    @staticmethod
+    def to_match_query(text):
+        """Quote each word so user input cannot use FTS5 query syntax.
+
+        Terms are ANDed and the last one matches as a prefix, which suits
+        search-as-you-type clients.
+        """
+        words = re.findall(r'\w+', text)
+        if not words:
+            return None
+        terms = ['"%s"' % word for word in words]
+        terms[-1] += '*'
+        return ' '.join(terms)
+
+    def search(self, queryset, text):
+        match = self.to_match_query(text)
+        if match is None:
+            return queryset.none()
+        weights = ', '.join(str(weight) for weight in self.weights)
+        return queryset.filter(
+            search_entry__isnull=False,
+        ).filter(
+            RawSQL(f'"{self.table}" MATCH %s', [match], output_field=BooleanField())
+        ).annotate(
+            search_rank=RawSQL(f'-bm25("{self.table}", {weights})', [], output_field=FloatField()),
+            search_snippet=RawSQL(
+                f"snippet(\"{self.table}\", -1, %s, %s, '…', {self.snippet_tokens})",
+                [HIGHLIGHT_START, HIGHLIGHT_STOP],
+                output_field=TextField(),
+            ),
+        )
+
+
+class PostgresSearchBackend:
+    """Ranks with a weighted tsvector; a GIN expression index can back it"""
+
+    def index(self, post_id):
+        pass
+
+    def remove(self, post_id):
+        pass
+
+    def rebuild(self):
+        from .models import Post
+        return Post.objects.count()
+
+    def search(self, queryset, text):
+        from django.contrib.postgres.aggregates import StringAgg
+        from django.contrib.postgres.search import (
+            SearchHeadline, SearchQuery, SearchRank, SearchVector,
+        )
+        from django.db.models import OuterRef, Subquery
+        from .models import PostTag
+
+        tag_names = (
+            PostTag.objects.filter(post=OuterRef('pk')).order_by().values('post')
+            .annotate(names=StringAgg('tag__name', ' ')).values('names')
+        )
+        vector = (
+            SearchVector('title', weight='A')
+            + SearchVector('search_tags', weight='A')
+            + SearchVector('location', weight='B')
+            + SearchVector('content', weight='C')
+        )
+        query = SearchQuery(text, search_type='websearch')
+        return queryset.annotate(
+            search_tags=Subquery(tag_names, output_field=TextField()),
+        ).annotate(
+            search_document=vector,
+        ).filter(
+            search_document=query,
+        ).annotate(
+            search_rank=SearchRank(vector, query),
+            search_snippet=SearchHeadline(
+                'content', query, start_sel=HIGHLIGHT_START, stop_sel=HIGHLIGHT_STOP, max_words=35,
+            ),
+        )
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_backend():
+    try:
+        return BACKENDS[connection.vendor]()
+    except KeyError:
+        raise NotImplementedError(f'Full-text search is not supported on {connection.vendor}')
+
+
+def index_post(post_id):
+    if connection.vendor in BACKENDS:
+        get_backend().index(post_id)
+
+
+def remove_post(post_id):
+    if connection.vendor in BACKENDS:
+        get_backend().remove(post_id)
@@ -1,6 +1,13 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth.models import User
-from .models import Post, Comment
+from django.db import transaction
+from django.db.models.functions import Substr
+from django.utils.html import escape
+from . import passwords
+from .images import variant_urls
+from .models import Post, Comment, Tag
+from .search import HIGHLIGHT_START, HIGHLIGHT_STOP
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -23,7 +30,13 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
     
     def create(self, validated_data):
         validated_data.pop('password_confirm')
-        user = User.objects.create_user(**validated_data)
+        password = validated_data.pop('password')
+        # What create_user() does, with the hashing on the bounded pool
+        user = User(**validated_data)
+        user.username = User.normalize_username(user.username)
+        user.email = User.objects.normalize_email(user.email)
+        user.password = passwords.make_password(password)
+        user.save()
         return user
 
 class CommentSerializer(serializers.ModelSerializer):
@@ -34,21 +47,220 @@ class CommentSerializer(serializers.ModelSerializer):
         fields = ['id', 'content', 'author', 'created_date']
         read_only_fields = ['author', 'created_date']
 
-class PostSerializer(serializers.ModelSerializer):
+class BatchCommentSerializer(CommentSerializer):
+    """A comment in a batch; ``post`` is checked for all items at once by the view"""
+    post = serializers.IntegerField(min_value=1)
+    
+    class Meta(CommentSerializer.Meta):
+        fields = CommentSerializer.Meta.fields + ['post']
+
+class TagSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Tag
+        fields = ['name', 'usage_count']
+
+class TagsField(serializers.Field):
+    """Tag names; accepts a comma-separated string or a list and renders a list"""
+    
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            return Tag.parse(data)
+        if isinstance(data, list) and all(isinstance(name, str) for name in data):
+            return Tag.parse(data)
+        raise serializers.ValidationError('Expected a comma-separated string or a list of tag names.')
+    
+    def to_representation(self, value):
+        return [tag.name for tag in value.all()]
+
+class TaggedPostMixin:
+    """Save the ``tags`` field through Post.set_tags()"""
+    
+    def create(self, validated_data):
+        tags = validated_data.pop('tags', None)
+        with transaction.atomic():
+            post = super().create(validated_data)
+            if tags is not None:
+                post.set_tags(tags)
+        return post
+    
+    def update(self, instance, validated_data):
+        tags = validated_data.pop('tags', None)
+        with transaction.atomic():
+            post = super().update(instance, validated_data)
+            if tags is not None:
+                post.set_tags(tags)
+        return post
+
+class ImageVariantsField(serializers.Field):
+    """Resized variants of the post image with ready-made srcset strings"""
+    
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+    
+    def to_representation(self, post):
+        return variant_urls(post, self.context.get('request'))
+
+class RecentCommentsField(serializers.Field):
+    """The post's latest COMMENTS_EMBED_LIMIT comments, newest first"""
+    
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+    
+    def to_representation(self, post):
+        # Prefetched by PostQuerySet.with_recent_comments(); queried otherwise
+        comments = getattr(post, 'recent_comments', None)
+        if comments is None:
+            comments = post.comments.select_related('author').order_by(
+                *Comment.RECENT_FIRST
+            )[:settings.COMMENTS_EMBED_LIMIT]
+        return CommentSerializer(comments, many=True, context=self.context).data
+
+class PostSerializer(TaggedPostMixin, serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
-    comments = CommentSerializer(many=True, read_only=True)
-    comments_count = serializers.SerializerMethodField()
+    comments = RecentCommentsField()
+    tags = TagsField(required=False)
+    image_variants = ImageVariantsField()
     
     class Meta:
         model = Post
-        fields = ['id', 'title', 'content', 'image', 'author', 'created_date', 
-                 'updated_date', 'location', 'tags', 'comments', 'comments_count']
-        read_only_fields = ['author', 'created_date', 'updated_date']
-    
-    def get_comments_count(self, obj):
-        return obj.comments.count()
+        fields = ['id', 'title', 'content', 'image', 'image_variants', 'author', 'created_date',
+                 'updated_date', 'location', 'latitude', 'longitude', 'tags', 'comments',
+                 'comments_count', 'last_commented_at']
+        read_only_fields = ['author', 'created_date', 'updated_date', 'latitude', 'longitude',
+                            'comments_count', 'last_commented_at']
 
-class PostCreateSerializer(serializers.ModelSerializer):
+class PostSummarySerializer(serializers.ModelSerializer):
+    """Compact post representation for list views.
+
+    Clients pick fields with ``?fields=`` and opt into nested comments with
+    ``?expand=comments``; ``prepare_queryset`` defers the columns that are
+    not requested so they are never read from the database.
+    """
+    author = UserSerializer(read_only=True)
+    excerpt = serializers.SerializerMethodField()
+    comments = RecentCommentsField()
+    tags = TagsField(read_only=True)
+    image_variants = ImageVariantsField()
+
+    # Post columns each field reads; excerpt is an annotation
+    field_columns = {
+        'id': ['id'],
+        'title': ['title'],
+        'excerpt': [],
+        'image': ['image'],
+        'image_variants': ['image'],
+        'author': ['author'],
+        'created_date': ['created_date'],
+        'location': ['location'],
+        'tags': [],
+        'comments_count': ['comments_count'],
+        'last_commented_at': ['last_commented_at'],
+        'comments': [],
+    }
+    # Post columns behind sort keys that are annotations (see PostCursorPagination)
+    ordering_columns = {
+        'last_activity_at': ['last_commented_at', 'created_date'],
+        'search_rank': [],
+    }
+    expandable_fields = ['comments']
+
+    class Meta:
+        model = Post
+        fields = ['id', 'title', 'excerpt', 'image', 'image_variants', 'author', 'created_date',
+                 'location', 'tags', 'comments_count', 'last_commented_at', 'comments']
+
+    def __init__(self, *args, fields=None, expand=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        selected = self.select_fields(fields, expand)
+        for name in set(self.fields) - selected:
+            self.fields.pop(name)
+
+    @classmethod
+    def select_fields(cls, fields=None, expand=()):
+        unknown = set(fields or []) - set(cls.Meta.fields)
+        unknown |= set(expand) - set(cls.expandable_fields)
+        if unknown:
+            raise serializers.ValidationError(
+                {'fields': f"Unknown field(s): {', '.join(sorted(unknown))}"}
+            )
+        selected = set(fields) if fields else set(cls.Meta.fields) - set(cls.expandable_fields)
+        selected.add('id')
+        selected.update(expand)
+        return selected
+
+    @classmethod
+    def prepare_queryset(cls, queryset, fields=None, expand=(), ordering=()):
+        """Restrict the query to the columns and relations the selected fields need.
+
+        The columns of the sort keys in ``ordering`` are loaded as well, since
+        the paginator reads them to build the cursor.
+        """
+        selected = cls.select_fields(fields, expand)
+        columns = set()
+        for name in (field.lstrip('-') for field in ordering):
+            columns.update(cls.ordering_columns.get(name, [name]))
+        for name in selected:
+            columns.update(cls.field_columns[name])
+        if 'author' in selected:
+            columns.update(f'author__{name}' for name in UserSerializer.Meta.fields)
+            queryset = queryset.select_related('author')
+        queryset = queryset.only(*columns)
+        if 'excerpt' in selected:
+            # One extra character tells us whether the content was cut
+            queryset = queryset.annotate(
+                excerpt_text=Substr('content', 1, settings.POST_EXCERPT_LENGTH + 1)
+            )
+        if 'tags' in selected:
+            queryset = queryset.prefetch_related('tags')
+        if 'comments' in selected:
+            queryset = queryset.with_recent_comments()
+        return queryset
+
+    def get_excerpt(self, obj):
+        text = obj.excerpt_text if hasattr(obj, 'excerpt_text') else obj.content
+        if len(text) > settings.POST_EXCERPT_LENGTH:
+            return text[:settings.POST_EXCERPT_LENGTH].rstrip() + '…'
+        return text
+
+class PostSearchResultSerializer(PostSummarySerializer):
+    """Post summary plus the search rank and an HTML snippet with <mark>ed matches"""
+    rank = serializers.FloatField(source='search_rank', read_only=True)
+    snippet = serializers.SerializerMethodField()
+
+    field_columns = {**PostSummarySerializer.field_columns, 'rank': [], 'snippet': []}
+
+    class Meta(PostSummarySerializer.Meta):
+        fields = PostSummarySerializer.Meta.fields + ['rank', 'snippet']
+
+    def get_snippet(self, obj):
+        return escape(obj.search_snippet).replace(
+            HIGHLIGHT_START, '<mark>'
+        ).replace(HIGHLIGHT_STOP, '</mark>')
+
+class PostNearbySerializer(PostSummarySerializer):
+    """Post summary with coordinates and the distance from the query point"""
+    distance_km = serializers.SerializerMethodField()
+
+    field_columns = {
+        **PostSummarySerializer.field_columns,
+        'latitude': ['latitude'],
+        'longitude': ['longitude'],
+        'distance_km': [],
+    }
+
+    class Meta(PostSummarySerializer.Meta):
+        fields = PostSummarySerializer.Meta.fields + ['latitude', 'longitude', 'distance_km']
+
+    def get_distance_km(self, obj):
+        return round(self.context['distances'][obj.pk], 3)
+
+class PostCreateSerializer(TaggedPostMixin, serializers.ModelSerializer):
+    tags = TagsField(required=False)
+    
     class Meta:
         model = Post
         fields = ['title', 'content', 'image', 'location', 'tags']
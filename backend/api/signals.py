@@ -0,0 +1,152 @@
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import post_init, post_save, post_delete, pre_save
+from django.dispatch import receiver
+
+from django.conf import settings
+from django.contrib.auth.models import User
+
+from . import cache as response_cache, metrics, search, tasks
+from .authentication import forget_user
+from .models import ImageBlob, Post, Comment, PostTag, Tag
+from .serializers import UserSerializer
+
+
+def invalidate(func, *args):
+    """Invalidate now and again on commit.
+
+    The second call drops entries a concurrent request may have cached from
+    data read before the surrounding transaction committed.
+    """
+    func(*args)
+    transaction.on_commit(lambda: func(*args))
+
+
+@receiver(pre_save, sender=Post)
+def geocode_post(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'location' in update_fields:
+        instance.geocode()
+
+
+@receiver(pre_save, sender=Post)
+def count_image_upload(sender, instance, **kwargs):
+    # An uncommitted file is a new upload, stored by this save
+    if instance.image and not instance.image._committed:
+        metrics.IMAGE_UPLOAD_BYTES.observe(instance.image.size)
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    if created:
+        invalidate(response_cache.invalidate_feed)
+    else:
+        invalidate(response_cache.invalidate_post, instance.pk)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    invalidate(response_cache.invalidate_feed)
+    invalidate(response_cache.invalidate_post, instance.pk)
+
+
+@receiver(post_save, sender=Post)
+def index_saved_post(sender, instance, **kwargs):
+    # Queued in the saving transaction and run when a worker picks it up, so
+    # tags saved in the same transaction are indexed; until then search lags
+    tasks.index_post.enqueue(instance.pk)
+
+
+def _image_name(instance):
+    # From __dict__, so a deferred image field is not loaded
+    image = instance.__dict__.get('image')
+    return getattr(image, 'name', image) or None
+
+
+@receiver(post_init, sender=Post)
+def remember_image(sender, instance, **kwargs):
+    instance._stored_image = _image_name(instance)
+
+
+@receiver(post_save, sender=Post)
+def count_image_use(sender, instance, created, **kwargs):
+    # post_init also sees the image a new post is created with
+    stored = None if created else instance._stored_image
+    image = _image_name(instance)
+    if stored != image:
+        ImageBlob.objects.refresh([name for name in (stored, image) if name])
+        if stored:
+            tasks.collect_image.enqueue(stored)
+        instance._stored_image = image
+
+
+@receiver(post_delete, sender=Post)
+def uncount_image_use(sender, instance, **kwargs):
+    if instance._stored_image:
+        ImageBlob.objects.refresh([instance._stored_image])
+        tasks.collect_image.enqueue(instance._stored_image)
+
+
+@receiver(post_save, sender=Post)
+def generate_image_variants(sender, instance, **kwargs):
+    if settings.IMAGE_VARIANTS_EAGER and instance.image:
+        tasks.generate_image_variants.enqueue(instance.image.name)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_deleted_post(sender, instance, **kwargs):
+    search.remove_post(instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_changed(sender, instance, **kwargs):
+    invalidate(response_cache.invalidate_post, instance.post_id)
+
+
+@receiver(post_save, sender=Comment)
+def count_new_comment(sender, instance, created, **kwargs):
+    if created:
+        commented_at = Value(instance.created_date)
+        Post.objects.filter(pk=instance.post_id).update(
+            comments_count=F('comments_count') + 1,
+            last_commented_at=Greatest(Coalesce('last_commented_at', commented_at), commented_at),
+        )
+        invalidate(response_cache.invalidate_feed_activity)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_deleted_comment(sender, instance, **kwargs):
+    latest = Comment.objects.filter(post=OuterRef('pk')).order_by('-created_date').values('created_date')[:1]
+    Post.objects.filter(pk=instance.post_id, comments_count__gt=0).update(
+        comments_count=F('comments_count') - 1,
+        last_commented_at=Subquery(latest),
+    )
+    invalidate(response_cache.invalidate_feed_activity)
+
+
+@receiver(post_delete, sender=PostTag)
+def post_tag_deleted(sender, instance, **kwargs):
+    Tag.objects.refresh_usage([instance.tag_id])
+    # The post leaves ?tag= feeds that may be cached with it
+    invalidate(response_cache.invalidate_feed)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def uncache_user(sender, instance, **kwargs):
+    # Authentication reads users from a cache (see api.authentication)
+    invalidate(forget_user, instance.pk)
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, created, update_fields=None, **kwargs):
+    # Cached feeds and post details embed the profiles of post and comment
+    # authors; logins only save last_login, which they do not show
+    if created or (update_fields is not None and not set(update_fields) & set(UserSerializer.Meta.fields)):
+        return
+    post_ids = set(Post.objects.filter(author=instance).values_list('pk', flat=True))
+    post_ids.update(Comment.objects.filter(author=instance).values_list('post_id', flat=True))
+    if post_ids:
+        invalidate(response_cache.invalidate_feed)
+        invalidate(response_cache.invalidate_posts, post_ids)
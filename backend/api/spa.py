@@ -0,0 +1,71 @@
+"""The React app's index.html ("shell"), served for every client-side route.
+
+The shell is the build's index.html (SPA_INDEX_FILE), or
+templates/index.html rendered once when there is no build. It is loaded
+once per process, when the server starts, and served from memory with an
+ETag. ``Cache-Control: no-cache`` makes browsers revalidate, so a new
+deploy is picked up at once while unchanged shells cost a 304.
+
+Everything else from the build (hashed JS and CSS, icons, the manifest)
+is served by WhiteNoise from WHITENOISE_ROOT; see settings.py.
+"""
+import hashlib
+import os
+import threading
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+_shell = None
+_lock = threading.Lock()
+
+
+class Shell:
+    def __init__(self, body, mtime=None):
+        self.body = body
+        self.etag = f'"{hashlib.md5(body).hexdigest()}"'
+        # Modification time of the build's index.html, None for the template
+        self.mtime = mtime
+
+
+def read_shell():
+    path = settings.SPA_INDEX_FILE
+    try:
+        with open(path, 'rb') as source:
+            return Shell(source.read(), os.path.getmtime(path))
+    except FileNotFoundError:
+        return Shell(render_to_string('index.html').encode())
+
+
+def get_shell():
+    global _shell
+    with _lock:
+        if _shell is None or (settings.DEBUG and _is_stale(_shell)):
+            _shell = read_shell()
+        return _shell
+
+
+def _is_stale(shell):
+    # Development only: follow `npm run build` without a restart
+    try:
+        return os.path.getmtime(settings.SPA_INDEX_FILE) != shell.mtime
+    except FileNotFoundError:
+        return shell.mtime is not None
+
+
+def clear_shell():
+    global _shell
+    with _lock:
+        _shell = None
+
+
+def shell_response(request):
+    shell = get_shell()
+    response = get_conditional_response(request, etag=shell.etag)
+    if response is None:
+        response = HttpResponse(shell.body, content_type='text/html; charset=utf-8')
+    response['ETag'] = shell.etag
+    patch_cache_control(response, no_cache=True)
+    return response
@@ -0,0 +1,83 @@
+"""Content-addressed storage for post images.
+
+Uploads are named after the SHA-256 of their content,
+``blog_images/ab/<digest>.jpg``, so the same photo uploaded to several
+posts is stored once. The hash is computed over ``content.chunks()``, so
+large uploads (spooled to disk by Django) are never read into memory.
+Names change whenever the content does, which lets api/media.py cache
+them, and the variants made from them, forever.
+
+Each stored file has an ImageBlob row counting the posts that use it
+(see api/signals.py). A file is deleted by ``collect_image`` once no post
+refers to it any more, retried once the grace period of a recently used
+image is over; ``manage.py collect_images`` recounts everything and
+sweeps what the job missed.
+"""
+import hashlib
+import os
+import posixpath
+import re
+import time
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, default_storage
+
+from .images import delete_variants
+
+HASHED_NAME = re.compile(r'/[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?(/|$)')
+
+
+def is_content_addressed(name):
+    """Whether ``name`` is a hashed image name, or a variant made from one"""
+    return HASHED_NAME.search(name) is not None
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage (in MEDIA_ROOT) that names files by content hash and stores each content once"""
+
+    def hashed_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        directory = posixpath.dirname(name)
+        extension = posixpath.splitext(name)[1].lower()
+        return posixpath.join(directory, digest[:2], digest + extension)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, content)
+        if self.exists(name):
+            # Already stored; touching it keeps collect_image() from
+            # deleting it before the new post refers to it
+            os.utime(self.path(name))
+            return name
+        # Two identical uploads racing here end up as two files, the
+        # second with a suffix; both remain valid and are collected apart
+        return super().save(name, content, max_length)
+
+
+image_storage = ContentAddressedStorage()
+
+
+def grace_remaining(name):
+    """Seconds until a stored image is past IMAGE_GC_GRACE_SECONDS since it was stored or reused, 0 if it is"""
+    try:
+        age = time.time() - os.path.getmtime(image_storage.path(name))
+    except FileNotFoundError:
+        return 0
+    return max(settings.IMAGE_GC_GRACE_SECONDS - age, 0)
+
+
+def delete_image(name):
+    """Delete a stored image and its variants, unless it is still within its grace period"""
+    if grace_remaining(name):
+        return False
+    delete_variants(name)
+    default_storage.delete(name)
+    return True
@@ -0,0 +1,50 @@
+"""Background tasks queued after posts are written (see api.jobs)"""
+import math
+from datetime import timedelta
+
+from django.db import transaction
+
+from . import images, search, storage
+from .jobs import task
+from .models import ImageBlob
+
+
+@task
+def index_post(post_id):
+    search.index_post(post_id)
+
+
+@task(max_attempts=3)
+def generate_image_variants(image_name):
+    images.ensure_variants(image_name)
+
+
+@task
+def index_posts(post_ids):
+    for post_id in post_ids:
+        search.index_post(post_id)
+
+
+def collect_unused_image(image_name):
+    """Delete an image, and its variants, if no post uses it any more.
+
+    Returns the seconds left of the grace period of an unused image that was
+    stored or reused too recently to delete, else 0.
+    """
+    with transaction.atomic():
+        ImageBlob.objects.refresh([image_name])
+        blob = ImageBlob.objects.select_for_update().filter(name=image_name, ref_count=0).first()
+        if blob is None:
+            return 0
+        if not storage.delete_image(image_name):
+            return storage.grace_remaining(image_name)
+        blob.delete()
+        return 0
+
+
+@task
+def collect_image(image_name):
+    """``collect_unused_image()``, queued again for when a recent image's grace period ends"""
+    remaining = collect_unused_image(image_name)
+    if remaining:
+        collect_image.enqueue(image_name, delay=timedelta(seconds=math.ceil(remaining)))
@@ -1,3 +1,2078 @@
-from django.test import TestCase
+import base64
+import hashlib
+import json
+import os
+import posixpath
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import re
+import threading
+from datetime import timedelta
+from unittest import mock, skipUnless
+from io import BytesIO, StringIO
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from benchmarks import api_load, seed as bench_seed
+
+from . import async_views, authentication, cache as response_cache, metrics, spa
+from .db import configure_sqlite
+from .middleware import AsyncWhiteNoiseMiddleware
+from .geo import distance_km, encode_geohash, resolve_location
+from . import jobs, tasks
+from .images import generate_variants, preset_key, variant_name
+from .models import Post, Comment, ImageBlob, Job, Place, PostTag, Tag
+from .pagination import PostCursorPagination
+from .serializers import PostNearbySerializer
+from .storage import image_storage
+from .throttling import TokenBucketThrottle
+
+
+def seed_posts(authors, posts_per_author, comments_per_post):
+    """Bulk-create a feed large enough to expose per-row queries"""
+    now = timezone.now()
+    posts = Post.objects.bulk_create([
+        Post(
+            title=f'Post {index} by {author.username}',
+            content='Travel story ' * 50,
+            author=author,
+            created_date=now - timedelta(minutes=index * len(authors) + offset),
+            location='Lisbon, Portugal',
+        )
+        for offset, author in enumerate(authors)
+        for index in range(posts_per_author)
+    ])
+    tags = Tag.objects.resolve(['coast', 'food'])
+    PostTag.objects.bulk_create([PostTag(post=post, tag=tag) for post in posts for tag in tags])
+    Tag.objects.refresh_usage([tag.pk for tag in tags])
+    Comment.objects.bulk_create([
+        Comment(post=post, author=authors[n % len(authors)], content=f'Comment {n}')
+        for post in posts
+        for n in range(comments_per_post)
+    ])
+    # bulk_create skips the signals that maintain the counters
+    Post.objects.filter(pk__in=[post.pk for post in posts]).refresh_comment_stats()
+    return posts
+
+
+# Queued work runs in-process on commit unless a test opts into the job table
+@override_settings(JOBS_INLINE=True)
+class APITestCase(TestCase):
+    def setUp(self):
+        caches['feeds'].clear()
+        # Rolled-back user ids are reused; drop users cached by earlier tests
+        caches['default'].clear()
+        authentication.clear_local_users()
+        self.client = APIClient()
+
+
+class QueryBudgetTests(APITestCase):
+    """Each feed endpoint must run a fixed number of queries regardless of size.
+
+    Feed budgets are the page and the prefetch of tags; post detail also
+    includes the aggregate query that computes its ETag.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.authors = [
+            User.objects.create_user(f'traveller{n}', f'traveller{n}@example.com', 'pass12345')
+            for n in range(5)
+        ]
+        cls.posts = seed_posts(cls.authors, posts_per_author=20, comments_per_post=8)
+
+    def test_public_posts_query_budget(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('public-posts'), {'page_size': 50})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['results']), 50)
+
+    def test_public_posts_expanded_query_budget(self):
+        # posts + tags + latest comments (with authors)
+        with self.assertNumQueries(3):
+            response = self.client.get(
+                reverse('public-posts'), {'page_size': 50, 'expand': 'comments'}
+            )
+        self.assertEqual(len(response.json()['results'][0]['comments']), settings.COMMENTS_EMBED_LIMIT)
+
+    def test_post_list_query_budget(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('post-list'), {'page_size': 50})
+        self.assertEqual(len(response.json()['results']), 50)
+
+    def test_post_list_next_page_query_budget(self):
+        first = self.client.get(reverse('post-list'), {'page_size': 50})
+        with self.assertNumQueries(2):
+            response = self.client.get(first.json()['next'])
+        self.assertEqual(len(response.json()['results']), 50)
+
+    def test_sparse_fields_load_the_sort_keys(self):
+        # The cursor is built from the sort keys, which must not be read lazily
+        for name in ['public-posts', 'post-list']:
+            for sort in PostCursorPagination.sort_orderings:
+                with self.subTest(name=name, sort=sort):
+                    caches['feeds'].clear()
+                    with self.assertNumQueries(1):
+                        response = self.client.get(reverse(name), {'sort': sort, 'fields': 'title', 'page_size': 10})
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(len(response.json()['results']), 10)
+                    self.assertIsNotNone(response.json()['next'])
+
+    def test_post_detail_query_budget(self):
+        post = self.posts[0]
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('post-detail', args=[post.pk]))
+        self.assertEqual(response.json()['comments_count'], 8)
+        self.assertEqual(len(response.json()['comments']), settings.COMMENTS_EMBED_LIMIT)
+
+    def test_query_count_does_not_grow_with_comments(self):
+        post = self.posts[0]
+        Comment.objects.bulk_create([
+            Comment(post=post, author=self.authors[1], content='More') for _ in range(40)
+        ])
+        Post.objects.filter(pk=post.pk).refresh_comment_stats()
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('post-detail', args=[post.pk]))
+        self.assertEqual(response.json()['comments_count'], 48)
+        self.assertEqual(len(response.json()['comments']), settings.COMMENTS_EMBED_LIMIT)
+
+
+class DatabaseSetupTests(TestCase):
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_sqlite_connections_are_tuned(self):
+        self.assertEqual(self.pragma('synchronous'), 1)  # NORMAL
+        self.assertEqual(self.pragma('busy_timeout'), settings.SQLITE_PRAGMAS['busy_timeout'])
+
+    def test_rejects_unsafe_pragma_values(self):
+        with self.settings(SQLITE_PRAGMAS={'journal_mode': 'wal; DROP TABLE api_post'}):
+            with self.assertRaises(ValueError):
+                configure_sqlite(sender=None, connection=connection)
+
+
+class FeedPaginationTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('walker', 'walker@example.com', 'pass12345')
+        cls.posts = seed_posts([cls.author], posts_per_author=45, comments_per_post=0)
+
+    def test_pages_follow_cursor_without_overlap(self):
+        seen = []
+        url = reverse('public-posts')
+        while url:
+            response = self.client.get(url)
+            seen.extend(post['id'] for post in response.json()['results'])
+            url = response.json()['next']
+        self.assertEqual(len(seen), 45)
+        self.assertEqual(len(set(seen)), 45)
+        self.assertEqual(seen, [post.id for post in self.posts])
+
+    def test_page_size_parameter(self):
+        response = self.client.get(reverse('post-list'), {'page_size': 5})
+        self.assertEqual(len(response.json()['results']), 5)
+
+    def test_previous_link_returns_the_same_page(self):
+        first = self.client.get(reverse('public-posts'), {'page_size': 10})
+        second = self.client.get(first.json()['next'])
+        back = self.client.get(second.json()['previous'])
+        self.assertEqual(
+            [post['id'] for post in back.json()['results']],
+            [post['id'] for post in first.json()['results']],
+        )
+        self.assertIsNone(back.json()['previous'])
+
+    def test_invalid_cursor_is_rejected(self):
+        cursor = base64.b64encode(b'p=2024-01-01').decode()
+        response = self.client.get(reverse('public-posts'), {'cursor': cursor})
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_values_of_the_wrong_type_are_rejected(self):
+        for position, sort in [
+            (['not-a-date', 1], 'recent'),
+            (['2024-01-01T00:00:00+00:00', 'x'], 'recent'),
+            (['many', '2024-01-01T00:00:00+00:00', 1], 'discussed'),
+            ([{}, 1], 'active'),
+        ]:
+            cursor = base64.b64encode(f'p={json.dumps(position)}'.encode()).decode()
+            response = self.client.get(reverse('post-list'), {'cursor': cursor, 'sort': sort})
+            self.assertEqual(response.status_code, 404, position)
+
+
+class SparseFieldsetTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('reader', 'reader@example.com', 'pass12345')
+        cls.posts = seed_posts([cls.author], posts_per_author=3, comments_per_post=2)
+
+    def test_list_returns_summary(self):
+        response = self.client.get(reverse('public-posts'))
+        post = response.json()['results'][0]
+        self.assertNotIn('content', post)
+        self.assertNotIn('comments', post)
+        self.assertTrue(post['excerpt'].endswith('…'))
+        self.assertLessEqual(len(post['excerpt']), 301)
+        self.assertEqual(post['comments_count'], 2)
+        self.assertEqual(post['author']['username'], 'reader')
+
+    def test_short_content_is_not_truncated(self):
+        Post.objects.filter(pk=self.posts[0].pk).update(content='Short trip')
+        response = self.client.get(reverse('public-posts'))
+        self.assertEqual(response.json()['results'][0]['excerpt'], 'Short trip')
+
+    def test_fields_parameter_limits_output(self):
+        response = self.client.get(reverse('post-list'), {'fields': 'title,location'})
+        self.assertEqual(set(response.json()['results'][0]), {'id', 'title', 'location'})
+
+    def test_fields_parameter_defers_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('public-posts'), {'fields': 'title'})
+        sql = queries.captured_queries[0]['sql']
+        self.assertNotIn('"api_post"."content"', sql)
+        self.assertNotIn('"api_post"."location"', sql)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('auth_user', sql)
+
+    def test_unknown_field_is_rejected(self):
+        response = self.client.get(reverse('public-posts'), {'fields': 'title,password'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_detail_returns_full_post(self):
+        response = self.client.get(reverse('post-detail', args=[self.posts[0].pk]))
+        self.assertIn('content', response.json())
+        self.assertEqual(len(response.json()['comments']), 2)
+
+
+class ResponseCacheTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.authors = [
+            User.objects.create_user(f'cacher{n}', f'cacher{n}@example.com', 'pass12345')
+            for n in range(2)
+        ]
+        cls.posts = seed_posts(cls.authors, posts_per_author=15, comments_per_post=1)
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'pass12345')
+
+    def test_profile_edit_refreshes_cached_posts(self):
+        author = self.authors[0]
+        own = Post.objects.filter(author=author).first()
+        commented = Post.objects.filter(author=self.authors[1]).first()
+        Comment.objects.create(post=commented, author=author, content='Nice')
+        feed_url = reverse('public-posts')
+        params = {'expand': 'comments', 'page_size': 50}
+        detail_urls = [reverse('post-detail', args=[post.pk]) for post in (own, commented)]
+        self.client.get(feed_url, params)
+        etags = [self.client.get(url)['ETag'] for url in detail_urls]
+
+        self.client.force_authenticate(author)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(reverse('profile'), {'username': 'renamed'})
+        self.assertEqual(response.status_code, 200)
+        self.client.force_authenticate(None)
+
+        feed = self.client.get(feed_url, params)
+        self.assertFalse(feed.has_header('X-Cache'))
+        posts = {post['id']: post for post in feed.json()['results']}
+        self.assertEqual(posts[own.pk]['author']['username'], 'renamed')
+        self.assertIn('renamed', [comment['author']['username'] for comment in posts[commented.pk]['comments']])
+        for url, etag in zip(detail_urls, etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('renamed', response.content.decode())
+
+    def test_repeated_feed_request_is_served_from_cache(self):
+        url = reverse('public-posts')
+        first = self.client.get(url)
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(json.loads(second.content), json.loads(first.content))
+
+    def test_miss_is_rendered_once(self):
+        for url in [reverse('public-posts'), reverse('post-list'), reverse('post-detail', args=[self.posts[0].pk])]:
+            with mock.patch.object(JSONRenderer, 'render', autospec=True, side_effect=JSONRenderer.render) as render:
+                response = self.client.get(url)
+            self.assertEqual(render.call_count, 1, url)
+            self.assertEqual(self.client.get(url).content, response.content)
+
+    def test_query_string_is_part_of_the_key(self):
+        self.client.get(reverse('public-posts'))
+        response = self.client.get(reverse('public-posts'), {'fields': 'title'})
+        self.assertFalse(response.has_header('X-Cache'))
+        self.assertEqual(set(response.json()['results'][0]), {'id', 'title'})
+
+    def test_comment_invalidates_only_pages_with_that_post(self):
+        url = reverse('public-posts')
+        first_page = self.client.get(url, {'page_size': 10})
+        second_page_url = first_page.json()['next']
+        self.client.get(second_page_url)
+
+        first_post = Post.objects.get(pk=first_page.json()['results'][0]['id'])
+        Comment.objects.create(post=first_post, author=self.authors[0], content='New')
+
+        refreshed = self.client.get(url, {'page_size': 10})
+        self.assertFalse(refreshed.has_header('X-Cache'))
+        self.assertEqual(refreshed.json()['results'][0]['comments_count'], 2)
+        self.assertEqual(self.client.get(second_page_url)['X-Cache'], 'HIT')
+
+    def test_new_post_invalidates_every_page(self):
+        url = reverse('public-posts')
+        self.client.get(url)
+        post = Post.objects.create(title='Fresh', content='Just landed', author=self.authors[1])
+        response = self.client.get(url)
+        self.assertFalse(response.has_header('X-Cache'))
+        self.assertEqual(response.json()['results'][0]['id'], post.id)
+
+    def test_post_detail_is_cached_and_invalidated(self):
+        post = self.posts[0]
+        url = reverse('post-detail', args=[post.pk])
+        self.client.get(url)
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+        post.title = 'Renamed'
+        post.save()
+        response = self.client.get(url)
+        self.assertEqual(response.json()['title'], 'Renamed')
+
+    def test_stats_count_hits_and_misses(self):
+        url = reverse('public-posts')
+        self.client.get(url)
+        self.client.get(url)
+        self.client.force_authenticate(self.admin)
+        response = self.client.get(reverse('cache-stats'))
+        self.assertEqual(response.data['hits'], 1)
+        self.assertEqual(response.data['misses'], 1)
+        self.assertEqual(response.data['hit_ratio'], 0.5)
+
+    def test_stats_require_admin(self):
+        self.client.force_authenticate(self.authors[0])
+        self.assertEqual(self.client.get(reverse('cache-stats')).status_code, 403)
+
+
+class ConditionalGetTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('poller', 'poller@example.com', 'pass12345')
+        cls.posts = seed_posts([cls.author], posts_per_author=5, comments_per_post=1)
+
+    def test_feed_returns_validators(self):
+        response = self.client.get(reverse('public-posts'))
+        self.assertTrue(response['ETag'].startswith('"'))
+        self.assertIn('Last-Modified', response)
+
+    def test_matching_etag_returns_304_without_queries(self):
+        url = reverse('public-posts')
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_etag_differs_per_page(self):
+        first = self.client.get(reverse('post-list'), {'page_size': 2})
+        second = self.client.get(first.json()['next'])
+        self.assertNotEqual(first['ETag'], second['ETag'])
+
+    def test_new_comment_changes_feed_etag(self):
+        url = reverse('public-posts')
+        etag = self.client.get(url)['ETag']
+        Comment.objects.create(post=self.posts[2], author=self.author, content='Hi')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_evicted_page_keeps_its_etag(self):
+        url = reverse('public-posts')
+        etag = self.client.get(url)['ETag']
+        caches['feeds'].clear()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_deleted_post_changes_feed_etag(self):
+        url = reverse('public-posts')
+        etag = self.client.get(url)['ETag']
+        self.posts[4].delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_post_detail_if_modified_since(self):
+        url = reverse('post-detail', args=[self.posts[0].pk])
+        last_modified = self.client.get(url)['Last-Modified']
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_post_detail_etag_changes_on_update(self):
+        post = self.posts[0]
+        url = reverse('post-detail', args=[post.pk])
+        etag = self.client.get(url)['ETag']
+        post.title = 'Updated title'
+        post.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['title'], 'Updated title')
+
+    def test_post_detail_validators_follow_the_post_version(self):
+        # Rotated for changes the post row does not show, such as its authors' profiles
+        post = self.posts[0]
+        url = reverse('post-detail', args=[post.pk])
+        first = self.client.get(url)
+        with mock.patch('api.cache.time.time', return_value=timezone.now().timestamp() + 3600):
+            response_cache.invalidate_post(post.pk)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified']).status_code, 200)
+
+    def test_missing_post_returns_404(self):
+        self.assertEqual(self.client.get(reverse('post-detail', args=[0])).status_code, 404)
+
+
+class TagTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('tagger', 'tagger@example.com', 'pass12345')
+        cls.posts = seed_posts([cls.author], posts_per_author=4, comments_per_post=0)
+        cls.posts[0].set_tags('Hiking, coast')
+
+    def test_parse_normalizes_names(self):
+        self.assertEqual(Tag.parse(' Food,food , ,Street Art'), ['food', 'street art'])
+
+    def test_set_tags_updates_usage_counts(self):
+        counts = dict(Tag.objects.values_list('name', 'usage_count'))
+        self.assertEqual(counts, {'coast': 4, 'food': 3, 'hiking': 1})
+
+    def test_deleting_post_updates_usage_counts(self):
+        self.posts[0].delete()
+        self.assertEqual(Tag.objects.get(name='hiking').usage_count, 0)
+        self.assertEqual(Tag.objects.get(name='coast').usage_count, 3)
+
+    def test_feed_filters_by_tag(self):
+        response = self.client.get(reverse('public-posts'), {'tag': 'Hiking'})
+        self.assertEqual([post['id'] for post in response.json()['results']], [self.posts[0].id])
+        self.assertEqual(response.json()['results'][0]['tags'], ['coast', 'hiking'])
+
+    def test_cached_tag_feed_follows_tag_changes(self):
+        def ids():
+            response = self.client.get(reverse('public-posts'), {'tag': 'hiking'})
+            return [post['id'] for post in response.json()['results']]
+
+        self.assertEqual(ids(), [self.posts[0].id])
+        self.posts[1].set_tags('hiking')
+        self.assertEqual(ids(), [self.posts[0].id, self.posts[1].id])
+        self.posts[0].set_tags('coast')
+        self.assertEqual(ids(), [self.posts[1].id])
+
+    def test_tag_filter_uses_index(self):
+        plan = Post.objects.with_tag('hiking').explain()
+        self.assertIn('api_posttag_tag_idx', plan)
+
+    def test_tag_list_endpoint(self):
+        response = self.client.get(reverse('tag-list'))
+        self.assertEqual(response.data[0], {'name': 'coast', 'usage_count': 4})
+        self.assertEqual([tag['name'] for tag in response.data], ['coast', 'food', 'hiking'])
+
+    def test_create_accepts_comma_separated_string(self):
+        self.client.force_authenticate(self.author)
+        response = self.client.post(reverse('post-list'), {
+            'title': 'Alps', 'content': 'Snow', 'tags': 'Mountains, snow',
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['tags'], ['mountains', 'snow'])
+        post = Post.objects.get(title='Alps')
+        self.assertEqual(sorted(post.tags.values_list('name', flat=True)), ['mountains', 'snow'])
+
+    def test_update_replaces_tags(self):
+        post = self.posts[1]
+        self.client.force_authenticate(self.author)
+        response = self.client.patch(
+            reverse('post-detail', args=[post.pk]), {'tags': ['desert']}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['tags'], ['desert'])
+        self.assertEqual(Tag.objects.get(name='food').usage_count, 2)
+
+
+class SearchTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('seeker', 'seeker@example.com', 'pass12345')
+        cls.porto = Post.objects.create(
+            title='Port wine in Porto', content='Cellars along the <Douro> river.',
+            location='Porto, Portugal', author=cls.author,
+        )
+        cls.kyoto = Post.objects.create(
+            title='Temples of Kyoto', content='We drank port by accident in a tiny bar.',
+            location='Kyoto, Japan', author=cls.author,
+        )
+        cls.kyoto.set_tags('temples, japan')
+        cls.other = Post.objects.create(
+            title='Fjords', content='Nothing to see here.', location='Norway', author=cls.author,
+        )
+        call_command('rebuild_search_index', stdout=StringIO())
+
+    def test_results_are_ranked_with_title_matches_first(self):
+        response = self.client.get(reverse('post-search'), {'q': 'port'})
+        self.assertEqual(response.status_code, 200)
+        ids = [post['id'] for post in response.data['results']]
+        self.assertEqual(ids, [self.porto.id, self.kyoto.id])
+        ranks = [post['rank'] for post in response.data['results']]
+        self.assertGreater(ranks[0], ranks[1])
+
+    def test_snippet_is_escaped_and_highlighted(self):
+        response = self.client.get(reverse('post-search'), {'q': 'douro'})
+        snippet = response.data['results'][0]['snippet']
+        self.assertIn('&lt;<mark>Douro</mark>&gt;', snippet)
+
+    def test_searches_tags_and_prefixes(self):
+        response = self.client.get(reverse('post-search'), {'q': 'templ'})
+        self.assertEqual([post['id'] for post in response.data['results']], [self.kyoto.id])
+        response = self.client.get(reverse('post-search'), {'q': 'japan'})
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_query_syntax_is_not_interpreted(self):
+        response = self.client.get(reverse('post-search'), {'q': 'port OR "fjords" NEAR('})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [])
+
+    def test_missing_query_is_rejected(self):
+        self.assertEqual(self.client.get(reverse('post-search')).status_code, 400)
+
+    def test_results_use_cursor_pagination(self):
+        first = self.client.get(reverse('post-search'), {'q': 'port', 'page_size': 1})
+        self.assertEqual(first.data['results'][0]['id'], self.porto.id)
+        second = self.client.get(first.data['next'])
+        self.assertEqual(second.data['results'][0]['id'], self.kyoto.id)
+        self.assertIsNone(second.data['next'])
+
+    def test_index_follows_saves_and_deletes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(
+                title='Sahara nights', content='Dunes', author=self.author,
+            )
+        response = self.client.get(reverse('post-search'), {'q': 'sahara'})
+        self.assertEqual([result['id'] for result in response.data['results']], [post.id])
+        post.delete()
+        response = self.client.get(reverse('post-search'), {'q': 'sahara'})
+        self.assertEqual(response.data['results'], [])
+
+
+class GeoTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('nomad', 'nomad@example.com', 'pass12345')
+        dump = (
+            '2735943\tPorto\tPorto\t\t41.14961\t-8.61099\tP\tPPLA\tPT\t\t17\t\t\t\t249633\t\t\t\t\n'
+            '8010554\tVila Nova de Gaia\tVila Nova de Gaia\t\t41.13363\t-8.61742\tP\tPPL\tPT\t\t17\t\t\t\t186502\t\t\t\t\n'
+            '2267057\tLisbon\tLisbon\t\t38.71667\t-9.13333\tP\tPPLC\tPT\t\t14\t\t\t\t517802\t\t\t\t\n'
+            '4691930\tParis\tParis\t\t33.66094\t-95.55551\tP\tPPLA2\tUS\t\t48\t\t\t\t24782\t\t\t\t\n'
+            '2988507\tParis\tParis\t\t48.85341\t2.3488\tP\tPPLC\tFR\t\t11\t\t\t\t2138551\t\t\t\t\n'
+        )
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as handle:
+            handle.write(dump)
+        call_command('load_gazetteer', handle.name, stdout=StringIO())
+        os.unlink(handle.name)
+
+        def create(title, location):
+            return Post.objects.create(title=title, content='...', location=location, author=cls.author)
+
+        cls.porto = create('Ribeira', 'Porto, Portugal')
+        cls.gaia = create('Port cellars', 'Vila Nova de Gaia')
+        cls.lisbon = create('Alfama', 'Lisbon')
+        cls.unknown = create('Somewhere', 'Atlantis')
+
+    def test_geohash_encoding(self):
+        self.assertEqual(encode_geohash(57.64911, 10.40744, 11), 'u4pruydqqvj')
+
+    def test_distance(self):
+        self.assertAlmostEqual(distance_km(41.14961, -8.61099, 38.71667, -9.13333), 274, delta=2)
+
+    def test_locations_are_resolved_on_save(self):
+        self.porto.refresh_from_db()
+        self.assertAlmostEqual(self.porto.latitude, 41.14961)
+        self.assertTrue(self.porto.geohash.startswith('ez3f'))
+        self.unknown.refresh_from_db()
+        self.assertIsNone(self.unknown.latitude)
+        self.assertEqual(self.unknown.geohash, '')
+
+    def test_country_code_disambiguates(self):
+        self.assertEqual(resolve_location('Paris').country_code, 'FR')
+        self.assertEqual(resolve_location('Paris, US').country_code, 'US')
+
+    def test_nearby_ranks_by_distance(self):
+        response = self.client.get(reverse('post-nearby'), {'lat': 41.15, 'lon': -8.61, 'radius': 10})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([post['id'] for post in response.data['results']], [self.porto.id, self.gaia.id])
+        self.assertLess(response.data['results'][0]['distance_km'], 1)
+
+    def test_nearby_radius_includes_farther_posts(self):
+        response = self.client.get(reverse('post-nearby'), {'lat': 41.15, 'lon': -8.61, 'radius': 300})
+        self.assertEqual(response.data['count'], 3)
+        self.assertEqual(response.data['results'][-1]['id'], self.lisbon.id)
+
+    def test_nearby_skips_posts_deleted_after_ranking(self):
+        prepare = PostNearbySerializer.prepare_queryset
+
+        def delete_then_prepare(queryset, *args):
+            Post.objects.filter(pk=self.gaia.pk).delete()
+            return prepare(queryset, *args)
+
+        with mock.patch.object(PostNearbySerializer, 'prepare_queryset', side_effect=delete_then_prepare):
+            response = self.client.get(reverse('post-nearby'), {'lat': 41.15, 'lon': -8.61, 'radius': 10})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([post['id'] for post in response.data['results']], [self.porto.id])
+
+    def test_nearby_prefilters_with_geohash_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('post-nearby'), {'lat': 41.15, 'lon': -8.61, 'radius': 10})
+        candidate_sql = queries.captured_queries[0]['sql']
+        self.assertIn('"api_post"."geohash" >=', candidate_sql)
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + candidate_sql)
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+        self.assertIn('api_post_geohash', plan)
+
+    def test_nearby_validates_parameters(self):
+        response = self.client.get(reverse('post-nearby'), {'lat': 100, 'lon': 0})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('post-nearby'), {'lon': 0})
+        self.assertEqual(response.status_code, 400)
+
+    def test_geocode_posts_command_backfills(self):
+        Post.objects.filter(pk=self.lisbon.pk).update(latitude=None, longitude=None, geohash='')
+        out = StringIO()
+        detail = reverse('post-detail', args=[self.lisbon.pk])
+        self.assertIsNone(self.client.get(detail).json()['latitude'])
+        with mock.patch('api.cache.invalidate_feed') as invalidate_feed:
+            call_command('geocode_posts', '--batch-size=1', stdout=out)
+        invalidate_feed.assert_called_once_with()
+        self.assertIn('Resolved 1 of 2', out.getvalue())
+        self.lisbon.refresh_from_db()
+        self.assertIsNotNone(self.lisbon.latitude)
+        self.assertEqual(self.client.get(detail).json()['latitude'], self.lisbon.latitude)
+
+
+def make_photo(width=1200, height=800, orientation=None):
+    """A JPEG upload, optionally tagged with an EXIF orientation"""
+    image = Image.new('RGB', (width, height), (200, 30, 30))
+    exif = Image.Exif()
+    exif[0x010F] = 'PhoneMaker'
+    if orientation:
+        exif[0x0112] = orientation
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', exif=exif)
+    return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+
+class ImageVariantTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = self.settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.author = User.objects.create_user('shooter', 'shooter@example.com', 'pass12345')
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def create_post(self, photo):
+        self.client.force_authenticate(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('post-list'), {
+                'title': 'Sunset', 'content': 'Red sky', 'image': photo,
+            })
+        self.assertEqual(response.status_code, 201)
+        return Post.objects.get(title='Sunset')
+
+    def test_upload_sizes_are_measured(self):
+        uploads = metrics.REGISTRY.get_sample_value('image_upload_bytes_count') or 0
+        self.create_post(make_photo())
+        self.assertEqual(metrics.REGISTRY.get_sample_value('image_upload_bytes_count'), uploads + 1)
+
+    def open_variant(self, post, variant, fmt):
+        return Image.open(default_storage.open(variant_name(post.image.name, variant, fmt)))
+
+    def test_variants_are_generated_after_upload(self):
+        post = self.create_post(make_photo())
+        card = self.open_variant(post, 'card', 'webp')
+        self.assertEqual(card.format, 'WEBP')
+        self.assertEqual(card.size, (640, 400))
+        full = self.open_variant(post, 'full', 'jpeg')
+        self.assertEqual(full.size, (1200, 800))
+
+    def test_concurrent_generation_leaves_one_file_per_variant(self):
+        post = self.create_post(make_photo())
+        directory = default_storage.path(posixpath.dirname(variant_name(post.image.name, 'any', 'any')))
+        expected = sorted(os.listdir(directory))
+        threads = [threading.Thread(target=generate_variants, args=[post.image.name]) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(os.listdir(directory)), expected)
+        self.assertEqual(len(expected), len(settings.IMAGE_VARIANTS) * len(settings.IMAGE_VARIANT_FORMATS))
+        self.assertEqual(self.open_variant(post, 'card', 'webp').size, (640, 400))
+
+    def test_orientation_is_applied_and_metadata_stripped(self):
+        post = self.create_post(make_photo(orientation=6))
+        full = self.open_variant(post, 'full', 'jpeg')
+        self.assertEqual(full.size, (800, 1200))
+        self.assertEqual(len(full.getexif()), 0)
+
+    def test_serializer_returns_srcset(self):
+        post = self.create_post(make_photo())
+        response = self.client.get(reverse('post-detail', args=[post.pk]))
+        variants = response.json()['image_variants']
+        card_url = variants['sizes']['card']['webp']
+        self.assertTrue(card_url.endswith(variant_name(post.image.name, 'card', 'webp')))
+        self.assertIn(f'{card_url} 640w', variants['srcset']['webp'])
+        summary = self.client.get(reverse('public-posts')).json()['results'][0]
+        self.assertEqual(summary['image_variants']['sizes']['thumb']['width'], 320)
+
+    @override_settings(IMAGE_VARIANTS_EAGER=False)
+    def test_lazy_variants_are_generated_on_first_request(self):
+        post = self.create_post(make_photo())
+        self.assertFalse(default_storage.exists(variant_name(post.image.name, 'thumb', 'webp')))
+        lazy_url = self.client.get(reverse('post-detail', args=[post.pk])).json()[
+            'image_variants']['sizes']['thumb']['webp']
+        response = self.client.get(lazy_url)
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(default_storage.exists(variant_name(post.image.name, 'thumb', 'webp')))
+
+    def test_post_without_image_has_no_variants(self):
+        post = Post.objects.create(title='Text only', content='...', author=self.author)
+        response = self.client.get(reverse('post-detail', args=[post.pk]))
+        self.assertIsNone(response.json()['image_variants'])
+        url = reverse('post-image-variant', args=[post.pk, 'card', 'webp'])
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_regenerate_command_follows_preset_changes(self):
+        post = self.create_post(make_photo())
+        presets = {'card': {'width': 300, 'height': 200, 'crop': True}}
+        with self.settings(IMAGE_VARIANTS=presets):
+            call_command('regenerate_image_variants', '--purge', stdout=StringIO())
+            self.assertEqual(self.open_variant(post, 'card', 'jpeg').size, (300, 200))
+            self.assertEqual(default_storage.listdir('variants')[0], [preset_key()])
+
+
+CALLS = []
+
+
+@jobs.task
+def record_call(value):
+    CALLS.append(value)
+
+
+@jobs.task(max_attempts=2)
+def always_fail():
+    raise RuntimeError('boom')
+
+
+class MediaServingTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = self.settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.data = bytes(range(256)) * 4
+        self.name = default_storage.save('blog_images/harbour.jpg', SimpleUploadedFile('harbour.jpg', self.data))
+        author = User.objects.create_user('shooter', 'shooter@example.com', 'pass12345')
+        self.post = Post.objects.create(title='Harbour', content='Boats', author=author, image=self.name)
+        self.url = default_storage.url(self.name)
+
+    def test_file_is_served_with_validators(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Content-Length'], str(len(self.data)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Cache-Control'], f'public, max-age={settings.MEDIA_CACHE_SECONDS}')
+        self.assertIn('Last-Modified', response)
+
+        cached = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached['ETag'], response['ETag'])
+
+    def test_byte_ranges(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.data[100:200])
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.data)}')
+        self.assertEqual(response['Content-Length'], '100')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(b''.join(response.streaming_content), self.data[-10:])
+        response = self.client.get(self.url, HTTP_RANGE='bytes=1000-')
+        self.assertEqual(b''.join(response.streaming_content), self.data[1000:])
+
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.data)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.data)}')
+
+        # Multiple ranges and a stale If-Range get the whole file
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-1,5-6').status_code, 200)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag).status_code, 206)
+
+    def test_only_files_of_existing_posts_are_served(self):
+        variant = default_storage.save(variant_name(self.name, 'thumb', 'webp'), SimpleUploadedFile('t.webp', b'webp'))
+        orphan = default_storage.save('blog_images/orphan.jpg', SimpleUploadedFile('orphan.jpg', b'jpeg'))
+        self.assertEqual(self.client.get(default_storage.url(variant)).status_code, 200)
+        self.assertEqual(self.client.get(default_storage.url(orphan)).status_code, 404)
+        self.assertEqual(self.client.get('/media/blog_images/missing.jpg').status_code, 404)
+        self.assertEqual(self.client.get('/media/%2E%2E/%2E%2E/manage.py').status_code, 404)
+
+        self.post.delete()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertEqual(self.client.get(default_storage.url(variant)).status_code, 404)
+
+    def test_variants_are_matched_to_their_original_by_index(self):
+        upper = default_storage.save('blog_images/PIER.JPG', SimpleUploadedFile('PIER.JPG', b'jpeg'))
+        Post.objects.create(title='Pier', content='Boats', author=self.post.author, image=upper)
+        for image in [self.name, upper]:
+            variant = default_storage.save(variant_name(image, 'thumb', 'webp'), SimpleUploadedFile('t.webp', b'webp'))
+            with CaptureQueriesContext(connection) as captured:
+                self.assertEqual(self.client.get(default_storage.url(variant)).status_code, 200)
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + captured[-1]['sql'])
+            plan = ' '.join(str(row) for row in cursor.fetchall())
+        self.assertIn('USING COVERING INDEX api_post_image', plan)
+
+    def test_transfer_can_be_handed_to_the_proxy(self):
+        with self.settings(MEDIA_ACCEL='X-Accel-Redirect', MEDIA_ACCEL_PREFIX='/protected-media/'):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.name}')
+        self.assertEqual(response.content, b'')
+        self.assertIn('ETag', response)
+
+        with self.settings(MEDIA_ACCEL='X-Sendfile'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Sendfile'], default_storage.path(self.name))
+        self.assertEqual(self.client.post(self.url).status_code, 405)
+
+
+class ImageStorageTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = self.settings(MEDIA_ROOT=media_root, IMAGE_GC_GRACE_SECONDS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.author = User.objects.create_user('shooter', 'shooter@example.com', 'pass12345')
+        self.client.force_authenticate(self.author)
+
+    def create_post(self, photo, title='Sunset'):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('post-list'), {'title': title, 'content': 'Red sky', 'image': photo})
+        self.assertEqual(response.status_code, 201)
+        return Post.objects.get(title=title)
+
+    def delete_post(self, post):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(reverse('post-detail', args=[post.pk])).status_code, 204)
+
+    def test_identical_uploads_are_stored_once(self):
+        photo = make_photo()
+        first = self.create_post(photo, 'First')
+        second = self.create_post(make_photo(), 'Second')
+        self.assertEqual(first.image.name, second.image.name)
+        digest = hashlib.sha256(photo.file.getvalue()).hexdigest()
+        self.assertEqual(first.image.name, f'blog_images/{digest[:2]}/{digest}.jpg')
+        self.assertEqual(os.listdir(os.path.dirname(first.image.path)), [f'{digest}.jpg'])
+        self.assertEqual(ImageBlob.objects.get(name=first.image.name).ref_count, 2)
+        self.assertNotEqual(self.create_post(make_photo(width=600), 'Third').image.name, first.image.name)
+
+    def test_hash_is_computed_in_chunks(self):
+        class Reader(BytesIO):
+            sizes = []
+
+            def read(self, size=-1):
+                self.sizes.append(size)
+                return super().read(size)
+
+        data = os.urandom(3 * 64 * 1024 + 5)
+        name = image_storage.save('blog_images/big.JPG', File(Reader(data), name='big.JPG'))
+        # Read in bounded chunks, never whole
+        self.assertGreater(len(Reader.sizes), 3)
+        self.assertTrue(all(0 < size <= 64 * 1024 for size in Reader.sizes))
+        digest = hashlib.sha256(data).hexdigest()
+        self.assertEqual(name, f'blog_images/{digest[:2]}/{digest}.jpg')
+        with image_storage.open(name) as stored:
+            self.assertEqual(stored.read(), data)
+
+    def test_images_are_deleted_with_their_last_post(self):
+        first = self.create_post(make_photo(), 'First')
+        second = self.create_post(make_photo(), 'Second')
+        name = first.image.name
+        thumb = variant_name(name, 'thumb', 'webp')
+        self.assertTrue(default_storage.exists(thumb))
+
+        self.delete_post(first)
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(ImageBlob.objects.get(name=name).ref_count, 1)
+
+        self.delete_post(second)
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(default_storage.exists(thumb))
+        self.assertFalse(ImageBlob.objects.filter(name=name).exists())
+
+    def test_replaced_image_is_collected(self):
+        post = self.create_post(make_photo())
+        old = post.image.name
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                reverse('post-detail', args=[post.pk]), {'image': make_photo(width=640)}, format='multipart',
+            )
+        self.assertEqual(response.status_code, 200)
+        post.refresh_from_db()
+        self.assertNotEqual(post.image.name, old)
+        self.assertFalse(default_storage.exists(old))
+        self.assertEqual(ImageBlob.objects.get(name=post.image.name).ref_count, 1)
+
+    def test_recent_images_are_kept_until_the_grace_period_ends(self):
+        post = self.create_post(make_photo())
+        with self.settings(IMAGE_GC_GRACE_SECONDS=3600):
+            self.delete_post(post)
+            self.assertTrue(default_storage.exists(post.image.name))
+        orphan = image_storage.save('blog_images/orphan.jpg', SimpleUploadedFile('orphan.jpg', b'never posted'))
+
+        out = StringIO()
+        call_command('collect_images', stdout=out)
+        self.assertIn('Deleted 2 unused images', out.getvalue())
+        self.assertFalse(default_storage.exists(post.image.name))
+        self.assertFalse(default_storage.exists(orphan))
+        self.assertFalse(ImageBlob.objects.exists())
+
+    def test_recent_images_are_collected_once_the_grace_period_ends(self):
+        post = self.create_post(make_photo())
+        with self.settings(JOBS_INLINE=False, IMAGE_GC_GRACE_SECONDS=3600):
+            self.delete_post(post)
+            self.assertEqual(jobs.work(threading.Event(), burst=True), 1)
+            self.assertTrue(default_storage.exists(post.image.name))
+            retry = Job.objects.get(status=Job.QUEUED, task=tasks.collect_image.task_name)
+            self.assertAlmostEqual(
+                (retry.run_after - timezone.now()).total_seconds(), 3600, delta=60,
+            )
+            self.assertIsNone(jobs.claim('worker'))
+        Job.objects.filter(pk=retry.pk).update(run_after=timezone.now())
+        with self.settings(JOBS_INLINE=False):
+            self.assertEqual(jobs.work(threading.Event(), burst=True), 1)
+        self.assertFalse(default_storage.exists(post.image.name))
+        self.assertFalse(ImageBlob.objects.exists())
+
+    def test_hashed_images_are_cached_forever(self):
+        post = self.create_post(make_photo())
+        for url in [post.image.url, default_storage.url(variant_name(post.image.name, 'card', 'webp'))]:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+            response.close()
+
+
+@override_settings(JOBS_INLINE=False)
+class JobQueueTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        CALLS.clear()
+        self.author = User.objects.create_user('worker', 'worker@example.com', 'pass12345')
+
+    def test_post_writes_queue_jobs_instead_of_running_them(self):
+        self.client.force_authenticate(self.author)
+        self.client.post(reverse('post-list'), {'title': 'Queued', 'content': 'Later'})
+        post = Post.objects.get(title='Queued')
+        self.assertEqual(
+            list(Job.objects.values_list('task', 'args', 'status')),
+            [(tasks.index_post.task_name, [post.pk], Job.QUEUED)],
+        )
+        self.assertEqual(self.client.get(reverse('post-search'), {'q': 'queued'}).data['results'], [])
+
+        call_command('runworker', '--burst', stdout=StringIO())
+        self.assertEqual(Job.objects.get().status, Job.DONE)
+        results = self.client.get(reverse('post-search'), {'q': 'queued'}).data['results']
+        self.assertEqual([result['id'] for result in results], [post.pk])
+
+    def test_jobs_run_in_order_once(self):
+        for value in range(3):
+            record_call.enqueue(value)
+        self.assertEqual(jobs.work(threading.Event(), burst=True), 3)
+        self.assertEqual(CALLS, [0, 1, 2])
+        self.assertEqual(jobs.work(threading.Event(), burst=True), 0)
+
+    def test_claimed_job_is_not_claimed_again(self):
+        record_call.enqueue('once')
+        first = jobs.claim('worker-a')
+        self.assertEqual((first.status, first.attempts, first.locked_by), (Job.RUNNING, 1, 'worker-a'))
+        self.assertIsNone(jobs.claim('worker-b'))
+
+    def test_delayed_job_waits_until_due(self):
+        record_call.enqueue('later', delay=timedelta(minutes=5))
+        self.assertIsNone(jobs.claim('worker'))
+
+    def test_failures_back_off_then_go_dead(self):
+        job = always_fail.enqueue()
+        before = timezone.now()
+        with self.assertLogs('api.jobs', 'WARNING'):
+            jobs.run(jobs.claim('worker'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertIn('RuntimeError: boom', job.last_error)
+        self.assertGreaterEqual(job.run_after, before + timedelta(seconds=10))
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        with self.assertLogs('api.jobs', 'WARNING'):
+            jobs.run(jobs.claim('worker'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.DEAD, 2))
+
+        jobs.retry(Job.objects.filter(pk=job.pk))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 0))
+
+    def test_backoff_doubles_up_to_the_limit(self):
+        with self.settings(JOBS_BACKOFF_SECONDS=10, JOBS_BACKOFF_MAX_SECONDS=60):
+            self.assertAlmostEqual(jobs.backoff(1).total_seconds(), 10, delta=1)
+            self.assertAlmostEqual(jobs.backoff(3).total_seconds(), 40, delta=4)
+            self.assertAlmostEqual(jobs.backoff(10).total_seconds(), 60, delta=6)
+
+    def test_stale_running_jobs_are_requeued(self):
+        record_call.enqueue('lost')
+        jobs.claim('crashed-worker')
+        Job.objects.update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(jobs.requeue_stale(), 1)
+        self.assertEqual(Job.objects.get().status, Job.QUEUED)
+
+    def test_stale_job_without_attempts_left_goes_dead(self):
+        job = record_call.enqueue('crashes its worker')
+        Job.objects.filter(pk=job.pk).update(max_attempts=2)
+        for _ in range(2):
+            jobs.claim('crashed-worker')
+            Job.objects.update(locked_at=timezone.now() - timedelta(hours=1))
+            jobs.requeue_stale()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.DEAD, 2))
+        self.assertIn('stopped responding', job.last_error)
+        self.assertIsNone(jobs.claim('worker'))
+
+    def test_inline_mode_runs_delayed_jobs_on_a_timer(self):
+        with self.settings(JOBS_INLINE=True), mock.patch('api.jobs.threading.Timer') as timer:
+            with self.captureOnCommitCallbacks(execute=True):
+                record_call.enqueue('later', delay=timedelta(minutes=5))
+        self.assertEqual(timer.call_args.args[0], 300)
+        self.assertEqual(CALLS, [])
+        with mock.patch('api.jobs.connection.close'):
+            timer.call_args.args[1]()
+        self.assertEqual(CALLS, ['later'])
+
+    def test_inline_mode_runs_after_commit(self):
+        with self.settings(JOBS_INLINE=True):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertIsNone(record_call.enqueue('now'))
+                self.assertEqual(CALLS, [])
+        self.assertEqual(CALLS, ['now'])
+        self.assertFalse(Job.objects.exists())
+
+
+class CommentCounterTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create_user('talker', 'talker@example.com', 'pass12345')
+        self.post = Post.objects.create(title='Chatty', content='...', author=self.author)
+
+    def comment(self, **kwargs):
+        self.client.force_authenticate(self.author)
+        response = self.client.post(
+            reverse('post-comments', args=[self.post.pk]), {'content': 'Nice'}, **kwargs
+        )
+        self.assertEqual(response.status_code, 201)
+        return Comment.objects.get(pk=response.data['id'])
+
+    def test_creating_and_deleting_comments_updates_counters(self):
+        first = self.comment()
+        second = self.comment()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 2)
+        self.assertEqual(self.post.last_commented_at, second.created_date)
+
+        second.delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 1)
+        self.assertEqual(self.post.last_commented_at, first.created_date)
+
+        first.delete()
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.comments_count, self.post.last_commented_at), (0, None))
+
+    def test_counter_is_read_without_counting(self):
+        self.comment()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('post-detail', args=[self.post.pk]))
+        self.assertEqual(response.json()['comments_count'], 1)
+        comment_counts = [
+            query['sql'] for query in queries.captured_queries
+            if 'COUNT(' in query['sql'] and '"api_comment"' in query['sql']
+        ]
+        self.assertEqual(comment_counts, [])
+
+    def test_reconcile_repairs_drift(self):
+        self.comment()
+        Comment.objects.bulk_create([Comment(post=self.post, author=self.author, content='Bulk')] * 3)
+        Post.objects.create(title='Quiet', content='...', author=self.author)
+
+        out = StringIO()
+        call_command('reconcile_counters', '--dry-run', stdout=out)
+        self.assertIn('Found 1 drifted of 2 posts', out.getvalue())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 1)
+
+        call_command('reconcile_counters', '--batch-size', '1', stdout=out)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 4)
+        latest = self.post.comments.order_by('-created_date')[0].created_date
+        self.assertEqual(self.post.last_commented_at, latest)
+
+
+class FeedSortTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('sorter', 'sorter@example.com', 'pass12345')
+        cls.posts = seed_posts([cls.author], posts_per_author=30, comments_per_post=0)
+        # Spread a few comments so that both orderings have ties
+        for post, count in [(cls.posts[20], 3), (cls.posts[5], 1), (cls.posts[25], 1)]:
+            for _ in range(count):
+                Comment.objects.create(post=post, author=cls.author, content='Hi')
+
+    def walk(self, sort):
+        ids = []
+        url = reverse('public-posts') + f'?sort={sort}&page_size=7'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(post['id'] for post in response.json()['results'])
+            url = response.json()['next']
+        return ids
+
+    def test_most_discussed_first(self):
+        ids = self.walk('discussed')
+        self.assertEqual(len(set(ids)), 30)
+        expected = sorted(
+            Post.objects.all(), key=lambda post: (post.comments_count, post.created_date, post.id), reverse=True
+        )
+        self.assertEqual(ids, [post.id for post in expected])
+        self.assertEqual(ids[:3], [self.posts[20].id, self.posts[5].id, self.posts[25].id])
+
+    def test_recently_active_first(self):
+        ids = self.walk('active')
+        self.assertEqual(len(set(ids)), 30)
+        # The commented posts were active last, the rest follow by creation date
+        self.assertEqual(ids[:3], [self.posts[25].id, self.posts[5].id, self.posts[20].id])
+        rest = [post.id for post in self.posts if post.id not in ids[:3]]
+        self.assertEqual(ids[3:], rest)
+
+    def test_cached_sorts_follow_comment_counts(self):
+        # Off the first page, so no cached page carries its version
+        quiet = Post.objects.get(pk=self.walk('discussed')[-1])
+        self.assertEqual(self.walk('discussed')[0], self.posts[20].id)
+        self.assertEqual(self.walk('active')[0], self.posts[25].id)
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(4):
+                Comment.objects.create(post=quiet, author=self.author, content='Hi')
+        self.assertEqual(self.walk('discussed')[0], quiet.id)
+        self.assertEqual(self.walk('active')[0], quiet.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            quiet.comments.all().delete()
+        self.assertEqual(self.walk('discussed')[0], self.posts[20].id)
+        self.assertEqual(self.walk('active')[0], self.posts[25].id)
+
+    def test_unknown_sort_is_rejected(self):
+        response = self.client.get(reverse('public-posts'), {'sort': 'random'})
+        self.assertEqual(response.status_code, 400)
+
+
+class CommentListTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user('reader', 'reader@example.com', 'pass12345')
+        cls.post = Post.objects.create(title='Viral', content='...', author=cls.author)
+        now = timezone.now()
+        cls.comments = Comment.objects.bulk_create([
+            # Pairs share a timestamp to exercise the id tiebreak
+            Comment(post=cls.post, author=cls.author, content=f'Comment {n}',
+                    created_date=now - timedelta(minutes=n // 2))
+            for n in range(25)
+        ])
+
+    def test_comments_are_paginated_newest_first(self):
+        seen = []
+        url = reverse('post-comments', args=[self.post.pk]) + '?page_size=10'
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        while True:
+            seen.extend(comment['id'] for comment in response.data['results'])
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        expected = sorted(self.comments, key=lambda comment: (comment.created_date, comment.id), reverse=True)
+        self.assertEqual(seen, [comment.id for comment in expected])
+
+    def test_unknown_post_is_404(self):
+        response = self.client.get(reverse('post-comments', args=[self.post.pk + 100]))
+        self.assertEqual(response.status_code, 404)
+
+    def test_embedded_comments_are_the_latest(self):
+        response = self.client.get(reverse('post-detail', args=[self.post.pk]))
+        latest = self.client.get(reverse('post-comments', args=[self.post.pk]), {'page_size': 5})
+        self.assertEqual(response.json()['comments'], latest.json()['results'])
+
+    @override_settings(COMMENTS_EMBED_LIMIT=2)
+    def test_embedded_comments_limit_in_feeds(self):
+        other = Post.objects.create(title='Quiet', content='...', author=self.author)
+        Comment.objects.create(post=other, author=self.author, content='Only one')
+        response = self.client.get(reverse('public-posts'), {'expand': 'comments'})
+        counts = {post['id']: len(post['comments']) for post in response.json()['results']}
+        self.assertEqual(counts, {self.post.pk: 2, other.pk: 1})
+
+    def test_created_comment_is_returned(self):
+        self.client.force_authenticate(self.author)
+        response = self.client.post(reverse('post-comments', args=[self.post.pk]), {'content': 'Fresh'})
+        self.assertEqual(response.status_code, 201)
+        first = self.client.get(reverse('post-comments', args=[self.post.pk])).data['results'][0]
+        self.assertEqual(first['content'], 'Fresh')
+
+
+class BatchWriteTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create_user('importer', 'importer@example.com', 'pass12345')
+        self.client.force_authenticate(self.author)
+        Place.objects.create(
+            geoname_id=1, name='Lisbon', search_name='lisbon', country_code='PT',
+            latitude=38.72, longitude=-9.14, population=500000,
+        )
+
+    def post_batch(self, name, items):
+        return self.client.post(reverse(name), items, format='json')
+
+    def test_posts_are_created_with_tags_and_locations(self):
+        items = [
+            {'title': f'Imported {n}', 'content': 'Old blog', 'location': 'Lisbon', 'tags': 'coast, food'}
+            for n in range(3)
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.post_batch('batch-posts', items)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['count'], 3)
+        posts = Post.objects.filter(pk__in=response.data['ids'])
+        self.assertEqual({post.author_id for post in posts}, {self.author.pk})
+        self.assertEqual({post.latitude for post in posts}, {38.72})
+        self.assertEqual(dict(Tag.objects.values_list('name', 'usage_count')), {'coast': 3, 'food': 3})
+        results = self.client.get(reverse('post-search'), {'q': 'imported'}).data['results']
+        self.assertEqual(len(results), 3)
+
+    def test_query_count_does_not_grow_with_batch_size(self):
+        def run(count):
+            items = [{'title': f'Bulk {n}', 'content': '...', 'tags': ['bulk']} for n in range(count)]
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.post_batch('batch-posts', items).status_code, 201)
+            return len(queries)
+        self.assertEqual(run(5), run(50))
+
+    def test_invalid_items_reject_the_whole_batch(self):
+        response = self.post_batch('batch-posts', [
+            {'title': 'Fine', 'content': 'ok'},
+            {'content': 'no title'},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['errors'][0], {})
+        self.assertIn('title', response.data['errors'][1])
+        self.assertFalse(Post.objects.exists())
+
+    def test_batch_size_is_limited(self):
+        with self.settings(BATCH_MAX_ITEMS=2):
+            response = self.post_batch('batch-posts', [{'title': 't', 'content': 'c'}] * 3)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.post_batch('batch-posts', {'title': 't'}).status_code, 400)
+
+    def test_requires_authentication(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self.post_batch('batch-posts', [{'title': 't', 'content': 'c'}]).status_code, 401)
+
+    def test_comments_update_counters_and_invalidate_posts(self):
+        first = Post.objects.create(title='One', content='...', author=self.author)
+        second = Post.objects.create(title='Two', content='...', author=self.author)
+        self.client.get(reverse('post-detail', args=[first.pk]))
+        response = self.post_batch('batch-comments', [
+            {'post': first.pk, 'content': 'a'},
+            {'post': first.pk, 'content': 'b'},
+            {'post': second.pk, 'content': 'c'},
+        ])
+        self.assertEqual(response.status_code, 201)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.comments_count, second.comments_count), (2, 1))
+        detail = self.client.get(reverse('post-detail', args=[first.pk]))
+        self.assertFalse(detail.has_header('X-Cache'))
+        self.assertEqual(detail.json()['comments_count'], 2)
+
+    def test_comments_on_unknown_posts_are_reported_per_item(self):
+        post = Post.objects.create(title='One', content='...', author=self.author)
+        response = self.post_batch('batch-comments', [
+            {'post': post.pk, 'content': 'a'},
+            {'post': post.pk + 100, 'content': 'b'},
+            {'post': post.pk, 'content': ''},
+        ])
+        self.assertEqual(response.status_code, 400)
+        errors = response.data['errors']
+        self.assertEqual(errors[0], {})
+        self.assertEqual(list(errors[2]), ['content'])
+        self.assertFalse(Comment.objects.exists())
+
+        response = self.post_batch('batch-comments', [
+            {'post': post.pk, 'content': 'a'},
+            {'post': post.pk + 100, 'content': 'b'},
+        ])
+        self.assertEqual(response.data['errors'], [{}, {'post': [f'Post {post.pk + 100} does not exist.']}])
+
+
+class ExportImportTests(APITestCase):
+    maxDiff = None
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.media_root = os.path.join(self.directory, 'media')
+        self.settings_override = self.settings(MEDIA_ROOT=self.media_root, IMAGE_VARIANTS_EAGER=False)
+        self.settings_override.enable()
+        self.export_path = os.path.join(self.directory, 'posts.ndjson')
+        self.images_path = os.path.join(self.directory, 'images.tar')
+
+        self.authors = [
+            User.objects.create_user(f'traveller{n}', f't{n}@example.com', 'pass12345') for n in range(3)
+        ]
+        self.posts = seed_posts(self.authors, posts_per_author=5, comments_per_post=2)
+        self.client.force_authenticate(self.authors[0])
+        self.client.post(reverse('post-list'), {'title': 'Photo', 'content': 'Look', 'image': make_photo()})
+        self.image_name = Post.objects.get(title='Photo').image.name
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.directory)
+
+    def snapshot(self):
+        return {
+            'users': list(User.objects.order_by('pk').values_list('pk', 'username', 'password')),
+            'posts': list(Post.objects.order_by('pk').values_list(
+                'pk', 'author_id', 'title', 'created_date', 'updated_date', 'image', 'comments_count',
+            )),
+            'comments': list(Comment.objects.order_by('pk').values_list('pk', 'post_id', 'author_id', 'content')),
+            'tags': sorted(PostTag.objects.values_list('post_id', 'tag__name')),
+            'usage': dict(Tag.objects.values_list('name', 'usage_count')),
+        }
+
+    def wipe(self):
+        User.objects.all().delete()
+        Tag.objects.all().delete()
+        shutil.rmtree(self.media_root)
+
+    def export(self, *args):
+        out = StringIO()
+        call_command('export_posts', self.export_path, *args, stdout=out, stderr=StringIO())
+        return out.getvalue()
+
+    def import_(self, *args):
+        out = StringIO()
+        call_command('import_posts', self.export_path, *args, stdout=out)
+        return out.getvalue()
+
+    def test_round_trip_with_images(self):
+        before = self.snapshot()
+        output = self.export('--images', self.images_path, '--chunk-size', '4')
+        self.assertIn('3 users, 16 posts, 30 comments', output)
+        self.assertIn('records/s', output)
+        self.wipe()
+
+        self.import_('--images', self.images_path, '--batch-size', '7')
+        self.assertEqual(self.snapshot(), before)
+        self.assertTrue(default_storage.exists(self.image_name))
+        results = self.client.get(reverse('post-search'), {'q': 'photo'}).data['results']
+        self.assertEqual(len(results), 1)
+        self.assertFalse(os.path.exists(self.export_path + '.checkpoint'))
+
+    def test_export_reads_in_chunks(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.export('--chunk-size', '4')
+        # users: 1 + posts: 4 chunks x (posts + tags) + comments: 8 chunks
+        self.assertLess(len(queries), 20)
+
+    def test_export_resumes_from_checkpoint(self):
+        self.export('--images', self.images_path)
+        with open(self.export_path, 'rb') as export:
+            complete = export.read()
+        with tarfile.open(self.images_path) as archive:
+            self.assertEqual(archive.getnames(), [self.image_name])
+
+        # Pretend the export died after the 4th post, with junk after the checkpoint
+        lines = complete.splitlines(keepends=True)
+        post_lines = [n for n, line in enumerate(lines) if b'"type": "post"' in line]
+        cut = post_lines[3] + 1
+        offset = sum(len(line) for line in lines[:cut])
+        with open(self.export_path, 'wb') as export:
+            export.write(b''.join(lines[:cut]) + b'{"type": "po')
+        last_id = json.loads(lines[cut - 1])['id']
+        # The image belongs to the last post, so the archive was still empty
+        with tarfile.open(self.images_path, 'w'):
+            pass
+        checkpoint = {'stage': 'post', 'last_id': last_id, 'offset': offset, 'images_offset': 0}
+        with open(self.export_path + '.checkpoint', 'w') as state:
+            json.dump(checkpoint, state)
+
+        self.export('--resume', '--images', self.images_path)
+        with open(self.export_path, 'rb') as export:
+            self.assertEqual(export.read(), complete)
+        with tarfile.open(self.images_path) as archive:
+            self.assertEqual(archive.getnames(), [self.image_name])
+
+    def test_import_resumes_and_skips_existing_rows(self):
+        self.export()
+        before = self.snapshot()
+        self.wipe()
+        with open(self.export_path, 'rb') as export:
+            lines = export.readlines()
+        # Import everything up to the middle of the posts, then resume from there
+        middle = [n for n, line in enumerate(lines) if b'"type": "post"' in line][8]
+        partial = os.path.join(self.directory, 'partial.ndjson')
+        with open(partial, 'wb') as export:
+            export.writelines(lines[:middle])
+        call_command('import_posts', partial, stdout=StringIO())
+        with open(self.export_path + '.checkpoint', 'w') as state:
+            # An offset a little before the real one: the overlap must be skipped
+            json.dump({'offset': sum(len(line) for line in lines[:middle - 2])}, state)
+
+        self.import_('--resume', '--batch-size', '5')
+        self.assertEqual(self.snapshot(), before)
+
+    def test_existing_posts_keep_their_tags_and_dates(self):
+        self.export()
+        post = Post.objects.get(pk=self.posts[0].pk)
+        post.set_tags('edited')
+        post.title = 'Edited since the export'
+        post.save()
+        before = self.snapshot()
+        self.import_()
+        self.assertEqual(self.snapshot(), before)
+
+    def test_rejects_newer_format(self):
+        with open(self.export_path, 'w') as export:
+            export.write('{"type": "meta", "version": 99}\n')
+        with self.assertRaisesMessage(CommandError, 'version 99'):
+            self.import_()
+
+
+
+class UserPostsTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.authors = [
+            User.objects.create_user(f'traveller{n}', f't{n}@example.com', 'pass12345') for n in range(2)
+        ]
+        seed_posts(self.authors, posts_per_author=25, comments_per_post=1)
+
+    def test_lists_only_the_authors_posts_newest_first(self):
+        url = reverse('user-posts', args=[self.authors[1].pk])
+        first = self.client.get(url).json()
+        second = self.client.get(first['next']).json()
+        posts = first['results'] + second['results']
+        self.assertEqual(len(posts), 25)
+        self.assertEqual({post['author']['username'] for post in posts}, {'traveller1'})
+        dates = [post['created_date'] for post in posts]
+        self.assertEqual(dates, sorted(dates, reverse=True))
+
+    def test_unknown_user(self):
+        self.assertEqual(self.client.get(reverse('user-posts', args=[999])).status_code, 404)
+
+    def test_read_only(self):
+        self.client.force_authenticate(self.authors[0])
+        response = self.client.post(reverse('user-posts', args=[self.authors[0].pk]), {'title': 'x', 'content': 'y'})
+        self.assertEqual(response.status_code, 405)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'checks SQLite query plans')
+class QueryPlanTests(APITestCase):
+    """Feed pages must be read in index order: no table scan, no sort step.
+
+    Only the query that selects and orders the page is checked, for the
+    first page and the page its cursor leads to; the cache is cleared so
+    both are read from the database. Prefetches sort at most a page of rows,
+    and ?tag= feeds sort the posts carrying the tag.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.authors = [
+            User.objects.create_user(f'traveller{n}', f't{n}@example.com', 'pass12345') for n in range(3)
+        ]
+        self.posts = seed_posts(self.authors, posts_per_author=30, comments_per_post=3)
+
+    def page_queries(self, url, params=None):
+        """SQL of the page queries for the first and the following page"""
+        pages = []
+        for _ in range(2):
+            caches['feeds'].clear()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            pages += [
+                query['sql'] for query in queries
+                if query['sql'].startswith('SELECT') and ' ORDER BY ' in query['sql'] and ' LIMIT ' in query['sql']
+                and re.search(r'FROM "api_(post|comment)"', query['sql'])
+            ]
+            url, params = response.json()['next'], None
+        self.assertEqual(len(pages), 2)
+        return pages
+
+    def assertIndexed(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            plan = [row[-1] for row in cursor.fetchall()]
+        for step in plan:
+            self.assertNotIn('TEMP B-TREE', step, f'{sql}\n{plan}')
+            self.assertFalse(step.startswith('SCAN') and 'INDEX' not in step, f'{sql}\n{plan}')
+
+    def test_post_feeds(self):
+        for sort in PostCursorPagination.sort_orderings:
+            with self.subTest(sort=sort):
+                for sql in self.page_queries(reverse('post-list'), {'sort': sort, 'page_size': 10}):
+                    self.assertIndexed(sql)
+
+    def test_public_feed(self):
+        for sql in self.page_queries(reverse('public-posts'), {'page_size': 10}):
+            self.assertIndexed(sql)
+
+    def test_author_timeline(self):
+        for sql in self.page_queries(reverse('user-posts', args=[self.authors[1].pk]), {'page_size': 10}):
+            self.assertIndexed(sql)
+
+    def test_post_comments(self):
+        for sql in self.page_queries(reverse('post-comments', args=[self.posts[0].pk]), {'page_size': 2}):
+            self.assertIndexed(sql)
+
+
+class AsyncReadViewTests(APITestCase):
+    """The async read views return what the DRF views return"""
+
+    def setUp(self):
+        super().setUp()
+        self.factory = AsyncRequestFactory()
+        self.authors = [
+            User.objects.create_user(f'traveller{n}', f't{n}@example.com', 'pass12345') for n in range(2)
+        ]
+        self.posts = seed_posts(self.authors, posts_per_author=15, comments_per_post=3)
+
+    def call(self, view, url, params=None, **kwargs):
+        caches['feeds'].clear()
+        path_kwargs = kwargs.pop('path_kwargs', {})
+        response = async_to_sync(view)(self.factory.get(url, params, **kwargs), **path_kwargs)
+        caches['feeds'].clear()
+        return response
+
+    def test_feeds_match_sync_views(self):
+        cases = [
+            (async_views.public_posts, 'public-posts', {}),
+            (async_views.public_posts, 'public-posts', {'sort': 'active', 'expand': 'comments'}),
+            (async_views.post_list, 'post-list', {'sort': 'discussed', 'fields': 'id,title,comments_count'}),
+            (async_views.post_list, 'post-list', {'tag': 'coast', 'page_size': 5}),
+        ]
+        for view, name, params in cases:
+            with self.subTest(name=name, params=params):
+                response = self.call(view, reverse(name), params)
+                expected = self.client.get(reverse(name), params)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(json.loads(response.content), json.loads(expected.content))
+                self.assertEqual(response['ETag'], expected['ETag'])
+                # The cursor links work on both
+                following = self.call(view, json.loads(response.content)['next'])
+                self.assertEqual(json.loads(following.content), self.client.get(expected.json()['next']).json())
+
+    def test_sparse_fields_with_every_sort(self):
+        # A deferred sort key read while building the cursor would query on the event loop
+        for view, name in [(async_views.public_posts, 'public-posts'), (async_views.post_list, 'post-list')]:
+            for sort in PostCursorPagination.sort_orderings:
+                with self.subTest(name=name, sort=sort):
+                    params = {'sort': sort, 'fields': 'title', 'page_size': 5}
+                    response = self.call(view, reverse(name), params)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(json.loads(response.content), self.client.get(reverse(name), params).json())
+
+    def test_post_detail_matches_sync_view(self):
+        url = reverse('post-detail', args=[self.posts[0].pk])
+        response = self.call(async_views.post_detail, url, path_kwargs={'pk': self.posts[0].pk})
+        self.assertEqual(json.loads(response.content), json.loads(self.client.get(url).content))
+
+        missing = self.call(async_views.post_detail, url, path_kwargs={'pk': 999999})
+        self.assertEqual(missing.status_code, 404)
+
+    def test_not_modified(self):
+        url = reverse('public-posts')
+        etag = self.call(async_views.public_posts, url)['ETag']
+        response = self.call(async_views.public_posts, url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_errors(self):
+        response = self.call(async_views.public_posts, reverse('public-posts'), {'sort': 'oldest'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('sort', json.loads(response.content))
+        cursor = base64.b64encode(b'p=2024-01-01').decode()
+        response = self.call(async_views.public_posts, reverse('public-posts'), {'cursor': cursor})
+        self.assertEqual(response.status_code, 404)
+
+    def test_writes_go_to_drf_views(self):
+        token = RefreshToken.for_user(self.authors[0]).access_token
+        request = self.factory.post(
+            reverse('post-list'), {'title': 'Async', 'content': 'Hello'},
+            content_type='application/json', headers={'Authorization': f'Bearer {token}'},
+        )
+        response = async_to_sync(async_views.post_list)(request)
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Post.objects.filter(title='Async', author=self.authors[0]).exists())
+
+    async def test_middleware_stack_runs_natively_under_asgi(self):
+        # A sync-only middleware would make Django adapt the handler chain
+        self.assertTrue(AsyncWhiteNoiseMiddleware.async_capable)
+        response = await self.async_client.get(reverse('tag-list'))
+        self.assertEqual(response.status_code, 200)
+
+
+class CachedAuthenticationTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('traveller', 't@example.com', 'pass12345', first_name='Tess')
+        response = self.client.post(reverse('login'), {'username': 'traveller', 'password': 'pass12345'})
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {response.data['access']}")
+
+    def user_queries(self, method, url, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data, format='json')
+        return response, [query['sql'] for query in queries if 'FROM "auth_user"' in query['sql']]
+
+    def test_user_is_loaded_once(self):
+        response, queries = self.user_queries('get', reverse('profile'))
+        self.assertEqual(response.data['first_name'], 'Tess')
+        self.assertEqual(len(queries), 1)
+        response, queries = self.user_queries('get', reverse('profile'))
+        self.assertEqual(response.data['first_name'], 'Tess')
+        self.assertEqual(queries, [])
+        response, queries = self.user_queries('post', reverse('post-list'), {'title': 'Cached', 'content': 'Hi'})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(queries, [])
+        self.assertEqual(Post.objects.get(title='Cached').author, self.user)
+
+    def test_saving_the_user_refreshes_the_cache(self):
+        self.client.get(reverse('profile'))
+        response = self.client.put(reverse('profile'), {'first_name': 'Tessa'}, format='json')
+        self.assertEqual(response.data['first_name'], 'Tessa')
+        self.assertEqual(self.client.get(reverse('profile')).data['first_name'], 'Tessa')
+        # The password survives the update of a cached instance
+        self.assertTrue(User.objects.get(pk=self.user.pk).check_password('pass12345'))
+
+    def test_deactivated_and_deleted_users_are_rejected(self):
+        self.client.get(reverse('profile'))
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        # update() sends no signal; the cache entry stays until it expires
+        authentication.forget_user(self.user.pk)
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 401)
+
+        self.user.delete()
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 401)
+
+    @override_settings(AUTH_STATELESS_USERS=True)
+    def test_stateless_users_come_from_the_token(self):
+        response, queries = self.user_queries('get', reverse('profile'))
+        self.assertEqual(queries, [])
+        self.assertEqual(response.data, {
+            'id': self.user.pk, 'username': 'traveller', 'email': 't@example.com', 'first_name': 'Tess', 'last_name': '',
+        })
+        response = self.client.post(reverse('post-list'), {'title': 'Stateless', 'content': 'Hi'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Post.objects.get(title='Stateless').author, self.user)
+
+        self.client.put(reverse('profile'), {'last_name': 'Lee'}, format='json')
+        user = User.objects.get(pk=self.user.pk)
+        self.assertEqual((user.first_name, user.last_name), ('Tess', 'Lee'))
+        self.assertTrue(user.check_password('pass12345'))
+
+    @override_settings(AUTH_STATELESS_USERS=True)
+    def test_stateless_mode_accepts_tokens_without_profile_claims(self):
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        response, queries = self.user_queries('get', reverse('profile'))
+        self.assertEqual(response.data['username'], 'traveller')
+        self.assertEqual(len(queries), 1)
+
+
+def throttle_rates(**rates):
+    return override_settings(REST_FRAMEWORK={
+        **settings.REST_FRAMEWORK,
+        'DEFAULT_THROTTLE_RATES': {'login_ip': None, 'login_username': None, 'register_ip': None, **rates},
+    })
+
+
+class ThrottlingTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('traveller', 't@example.com', 'pass12345')
+
+    def login(self, username='traveller', password='wrong', ip='10.0.0.1'):
+        return self.client.post(reverse('login'), {'username': username, 'password': password}, REMOTE_ADDR=ip)
+
+    @throttle_rates(login_ip='3/min')
+    def test_ip_bucket_allows_a_burst_then_refills(self):
+        clock = [1000.0]
+        with mock.patch.object(TokenBucketThrottle, 'timer', lambda self: clock[0]):
+            for n in range(3):
+                self.assertEqual(self.login(f'nobody{n}').status_code, 401)
+            response = self.login('nobody3')
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response['Retry-After'], '20')
+            # Another address has its own bucket
+            self.assertEqual(self.login('nobody3', ip='10.0.0.2').status_code, 401)
+
+            # One token comes back every 20 seconds
+            clock[0] += 20
+            self.assertEqual(self.login('nobody4').status_code, 401)
+            self.assertEqual(self.login('nobody5').status_code, 429)
+            # Denied attempts cost nothing, and the bucket never holds more than 3
+            clock[0] += 3600
+            for n in range(3):
+                self.assertEqual(self.login(f'later{n}').status_code, 401)
+            self.assertEqual(self.login('later3').status_code, 429)
+
+    @throttle_rates(login_ip='3/min')
+    def test_forwarded_for_is_only_trusted_behind_declared_proxies(self):
+        for n in range(3):
+            self.assertEqual(self.client.post(
+                reverse('login'), {'username': f'nobody{n}', 'password': 'wrong'},
+                REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR=f'203.0.113.{n}',
+            ).status_code, 401)
+        response = self.client.post(
+            reverse('login'), {'username': 'nobody3', 'password': 'wrong'},
+            REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='203.0.113.99',
+        )
+        self.assertEqual(response.status_code, 429)
+
+        # Behind one proxy, the address it appended is the client's
+        with override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'NUM_PROXIES': 1}):
+            response = self.client.post(
+                reverse('login'), {'username': 'nobody4', 'password': 'wrong'},
+                REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='198.51.100.1, 203.0.113.7',
+            )
+        self.assertEqual(response.status_code, 401)
+
+    @throttle_rates(login_username='2/min')
+    def test_username_bucket_applies_across_addresses(self):
+        self.assertEqual(self.login(ip='10.0.0.1').status_code, 401)
+        self.assertEqual(self.login(ip='10.0.0.2').status_code, 401)
+        self.assertEqual(self.login(ip='10.0.0.3').status_code, 429)
+        self.assertEqual(self.login(' TRAVELLER ', ip='10.0.0.4').status_code, 429)
+        self.assertEqual(self.login('someone-else', ip='10.0.0.3').status_code, 401)
+
+    @throttle_rates()
+    @override_settings(LOGIN_FREE_FAILURES=2, LOGIN_COOLDOWN_SECONDS=2)
+    def test_failed_logins_start_a_doubling_cooldown(self):
+        self.login()
+        self.login()
+        self.assertEqual(self.login(password='pass12345').status_code, 200)
+        # Success resets the count
+        self.login()
+        self.login()
+        self.assertEqual(self.login(ip='10.0.0.2', password='pass12345').status_code, 200)
+
+        with mock.patch('api.throttling.time') as fake_time:
+            fake_time.time.return_value = 1000.0
+            self.login()
+            response = self.login(password='pass12345')
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response['Retry-After'], '2')
+            # Other clients are not locked out
+            self.assertEqual(self.login(ip='10.0.0.2', password='pass12345').status_code, 200)
+
+            fake_time.time.return_value = 1003.0
+            self.assertEqual(self.login().status_code, 401)
+            self.assertEqual(self.login(password='pass12345')['Retry-After'], '4')
+            fake_time.time.return_value = 1008.0
+            self.assertEqual(self.login(password='pass12345').status_code, 200)
+
+    @override_settings(PASSWORD_HASHING_SLOTS=0)
+    def test_busy_hashing_slots_return_503(self):
+        response = self.login(password='pass12345')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        response = self.client.post(reverse('register'), {
+            'username': 'new', 'email': 'n@example.com', 'password': 'pass12345', 'password_confirm': 'pass12345',
+        })
+        self.assertEqual(response.status_code, 503)
+        self.assertFalse(User.objects.filter(username='new').exists())
+        # Outside DRF, HashingBusyMiddleware answers the same way
+        response = self.client.post(reverse('admin:login'), {'username': 'traveller', 'password': 'pass12345'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+    @override_settings(PASSWORD_HASHERS=[
+        'django.contrib.auth.hashers.PBKDF2PasswordHasher', 'django.contrib.auth.hashers.MD5PasswordHasher',
+    ])
+    def test_outdated_hashes_are_upgraded_on_login(self):
+        User.objects.filter(pk=self.user.pk).update(password=hashers.make_password('pass12345', hasher='md5'))
+        self.assertEqual(self.login(password='pass12345').status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$'))
+        self.assertEqual(self.login(password='pass12345').status_code, 200)
+
+    @throttle_rates(register_ip='2/hour')
+    def test_registration_is_limited_per_ip(self):
+        for n in range(3):
+            response = self.client.post(reverse('register'), {
+                'username': f'new{n}', 'email': f'n{n}@example.com',
+                'password': 'pass12345', 'password_confirm': 'pass12345',
+            })
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(User.objects.filter(username__startswith='new').count(), 2)
+        self.assertTrue(User.objects.get(username='new0').check_password('pass12345'))
+
+
+class BenchmarkTests(APITestCase):
+    def snapshot(self):
+        return [
+            (post.title, post.content, post.created_date, post.author.username, post.location,
+             sorted(tag.name for tag in post.tags.all()), [comment.content for comment in post.comments.order_by('pk')])
+            for post in Post.objects.order_by('created_date')
+        ]
+
+    def test_seed_is_deterministic(self):
+        counts = bench_seed.seed_dataset(users=3, posts=12, comments=2, log=lambda message: None)
+        first = self.snapshot()
+        self.assertEqual(len(first), 12)
+        self.assertEqual(Comment.objects.count(), counts['comments'])
+        self.assertTrue(self.client.login(username='bench0', password=bench_seed.PASSWORD))
+
+        User.objects.filter(username__startswith='bench').delete()
+        bench_seed.seed_dataset(users=3, posts=12, comments=2, log=lambda message: None)
+        self.assertEqual(self.snapshot(), first)
+
+    def test_compare_flags_regressions(self):
+        def result(p95, throughput, queries, errors=0):
+            return {'p95_ms': p95, 'throughput': throughput, 'queries': queries, 'errors': errors}
+
+        baseline = {'endpoints': {'feed': result(10, 100, 2), 'tags': result(5, 300, 1), 'gone': result(1, 1, 1)}}
+        current = {'endpoints': {'feed': result(11.9, 81, 2), 'tags': result(6.5, 200, 2, errors=3), 'new': result(1, 1, 9)}}
+        regressions = api_load.compare(current, baseline, max_slowdown=0.2)
+        self.assertEqual([message.split(':')[0] for message in regressions], ['tags'] * 4)
+        self.assertEqual(api_load.compare(baseline, baseline, max_slowdown=0), [])
+
+
+@override_settings(PERF_SAMPLE_RATE=1, PERF_SLOW_REQUEST_MS=60000)
+class PerformanceMiddlewareTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        author = User.objects.create_user('traveller', 't@example.com', 'pass12345')
+        self.post = Post.objects.create(title='Timed', content='Hi', author=author)
+        Comment.objects.create(post=self.post, author=author, content='Nice')
+
+    def timings(self, response):
+        return {
+            name: (float(duration), desc)
+            for name, duration, desc in re.findall(r'(\w+);dur=([\d.]+)(?:;desc="([^"]*)")?', response['Server-Timing'])
+        }
+
+    def test_server_timing_header(self):
+        url = reverse('post-detail', args=[self.post.pk])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        timings = self.timings(response)
+        self.assertEqual(set(timings), {'total', 'db', 'render', 'app'})
+        self.assertEqual(timings['db'][1], f'{len(queries)} queries')
+        self.assertGreater(len(queries), 0)
+        self.assertGreaterEqual(timings['total'][0], timings['db'][0])
+
+    def test_async_requests_are_timed(self):
+        async def get():
+            return await self.async_client.get(reverse('post-detail', args=[self.post.pk]))
+        response = async_to_sync(get)()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(self.timings(response)['db'][1], '0 queries')
+
+    @override_settings(PERF_SAMPLE_RATE=0)
+    def test_unsampled_requests_have_no_header(self):
+        response = self.client.get(reverse('post-detail', args=[self.post.pk]))
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(PERF_SLOW_REQUEST_MS=0)
+    def test_slow_requests_are_logged_with_top_queries(self):
+        with self.assertLogs('api.perf', 'WARNING') as logs:
+            response = self.client.get(reverse('post-detail', args=[self.post.pk]))
+        entry = logs.records[0].perf
+        self.assertEqual(json.loads(logs.records[0].getMessage().split(' ', 2)[2]), entry)
+        self.assertEqual((entry['method'], entry['status'], entry['bytes']), ('GET', 200, len(response.content)))
+        self.assertEqual(entry['queries'], sum(query['count'] for query in entry['top_queries']))
+        self.assertTrue(any('"api_post"' in query['sql'] for query in entry['top_queries']))
+
+        with override_settings(PERF_SAMPLE_RATE=0), self.assertLogs('api.perf', 'WARNING') as logs:
+            self.client.get(reverse('post-detail', args=[self.post.pk]))
+        self.assertEqual(logs.records[0].perf['sampled'], False)
+        self.assertGreater(logs.records[0].perf['queries'], 0)
+        self.assertNotIn('top_queries', logs.records[0].perf)
+
+
+class MetricsTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        author = User.objects.create_user('traveller', 't@example.com', 'pass12345')
+        self.post = Post.objects.create(title='Counted', content='Hi', author=author)
+
+    def sample(self, name, **labels):
+        return metrics.REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_requests_are_counted_by_url_name(self):
+        requests = self.sample('http_requests_total', view='post-detail', method='GET', status='200')
+        missing = self.sample('http_requests_total', view='post-detail', method='GET', status='404')
+        observed = self.sample('http_request_duration_seconds_count', view='post-detail', method='GET')
+        hits = self.sample('cache_hits_total', cache='post')
+        queries = self.sample('http_request_db_queries_sum', view='post-detail')
+
+        url = reverse('post-detail', args=[self.post.pk])
+        with CaptureQueriesContext(connection) as captured:
+            self.client.get(url)
+        self.client.get(url)
+        self.client.get(reverse('post-detail', args=[self.post.pk + 1]))
+
+        self.assertEqual(self.sample('http_requests_total', view='post-detail', method='GET', status='200'), requests + 2)
+        self.assertEqual(self.sample('http_requests_total', view='post-detail', method='GET', status='404'), missing + 1)
+        self.assertEqual(self.sample('http_request_duration_seconds_count', view='post-detail', method='GET'), observed + 3)
+        self.assertEqual(self.sample('cache_hits_total', cache='post'), hits + 1)
+        self.assertGreaterEqual(self.sample('http_request_db_queries_sum', view='post-detail'), queries + len(captured))
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'http_requests_total{method="GET",status="200",view="post-detail"}', response.content)
+
+    @override_settings(METRICS_TOKEN='scrape-secret')
+    def test_token_protects_the_endpoint(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-secret').status_code, 200)
+
+    def test_worker_processes_are_added_up(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        script = (
+            'from api import metrics\n'
+            "metrics.REQUESTS.labels('post-list', 'GET', '200').inc(3)\n"
+            "metrics.LATENCY.labels('post-list', 'GET').observe(0.2)\n"
+        )
+        for _ in range(2):
+            subprocess.run(
+                [sys.executable, '-c', script], cwd=settings.BASE_DIR, check=True,
+                env=dict(os.environ, PROMETHEUS_MULTIPROC_DIR=directory),
+            )
+        with mock.patch.dict(os.environ, PROMETHEUS_MULTIPROC_DIR=directory):
+            body, _ = metrics.export()
+        self.assertIn(b'http_requests_total{method="GET",status="200",view="post-list"} 6.0', body)
+        self.assertIn(b'http_request_duration_seconds_count{method="GET",view="post-list"} 2.0', body)
+
+
+class SpaShellTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.build = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.build)
+        os.makedirs(os.path.join(self.build, 'static', 'js'))
+        with open(os.path.join(self.build, 'index.html'), 'w') as index:
+            index.write('<!doctype html><div id="root"></div><script src="/static/js/main.1a2b3c4d.js"></script>')
+        with open(os.path.join(self.build, 'static', 'js', 'main.1a2b3c4d.js'), 'w') as script:
+            script.write('console.log("travel blog");' * 200)
+        with open(os.path.join(self.build, 'static', 'js', '787.1a2b3c4d.chunk.js'), 'w') as chunk:
+            chunk.write('console.log("lazy route");')
+        with open(os.path.join(self.build, 'manifest.json'), 'w') as manifest:
+            manifest.write('{"short_name": "Travel Blog"}')
+        settings_override = override_settings(
+            SPA_INDEX_FILE=os.path.join(self.build, 'index.html'), WHITENOISE_ROOT=self.build,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        spa.clear_shell()
+        self.addCleanup(spa.clear_shell)
+        # WhiteNoise scans WHITENOISE_ROOT when the middleware is created
+        self.client = APIClient()
+
+    def test_client_side_routes_get_the_shell(self):
+        for path in ['/', '/posts/12', '/login']:
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200, path)
+            self.assertIn(b'<div id="root">', response.content)
+            self.assertEqual(response['Cache-Control'], 'no-cache')
+            self.assertTrue(response['ETag'])
+
+    def test_unchanged_shell_is_revalidated(self):
+        etag = self.client.get('/posts/12')['ETag']
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(len(captured), 0)
+
+    def test_template_is_used_without_a_build(self):
+        os.remove(os.path.join(self.build, 'index.html'))
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(b'main.1a2b3c4d.js', response.content)
+
+    def test_missing_files_and_api_routes_are_not_the_shell(self):
+        for path in ['/static/js/missing.js', '/favicon.ico', '/api/unknown/', '/media/none.jpg']:
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 404, path)
+            self.assertNotIn(b'<div id="root">', response.content)
+
+    def test_hashed_assets_are_immutable_and_precompressed(self):
+        from whitenoise.compress import Compressor
+
+        list(Compressor(quiet=True).compress(os.path.join(self.build, 'static', 'js', 'main.1a2b3c4d.js')))
+        client = APIClient()
+        response = client.get('/static/js/main.1a2b3c4d.js', HTTP_ACCEPT_ENCODING='br, gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(response['Content-Encoding'], 'br')
+        response.close()
+
+        response = client.get('/static/js/787.1a2b3c4d.chunk.js')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        response.close()
+
+        response = client.get('/manifest.json')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('immutable', response['Cache-Control'])
+        response.close()
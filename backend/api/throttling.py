@@ -0,0 +1,135 @@
+"""Throttles for the password endpoints (login and registration).
+
+Every attempt at those endpoints costs a full password hash, so they are
+rate limited before any hashing happens:
+
+* token buckets per client IP and per username. A rate of ``10/min``
+  allows a burst of 10 and then one attempt every 6 seconds;
+* an exponential cooldown per username and IP after repeated failed
+  logins.
+
+State lives in the default cache. Counters only change through ``add``,
+``incr`` and ``decr``, which are atomic in the shared backends (Redis,
+Memcached, the database cache), so all workers draw from the same buckets
+when the default cache is shared.
+"""
+import time
+
+from django.conf import settings
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle, SimpleRateThrottle
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """Token bucket holding ``num_requests`` tokens, refilled over ``duration``.
+
+    The bucket is kept as a start time and a counter of tokens taken; the
+    tokens earned are ``(now - start) * rate``. A new bucket starts full,
+    and one left unused until it would be full again simply expires.
+    """
+    cache_format = 'bucket_%(scope)s_%(ident)s'
+
+    def get_rate(self):
+        # Read at call time, so override_settings(REST_FRAMEWORK=...) applies
+        self.THROTTLE_RATES = api_settings.DEFAULT_THROTTLE_RATES
+        return super().get_rate()
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        capacity, refill_rate = self.num_requests, self.num_requests / self.duration
+        now = self.timer()
+        start_key, taken_key = f'{self.key}_start', f'{self.key}_taken'
+        # Slightly longer than a refill, after which the bucket is full anyway
+        timeout = self.duration + 60
+        self.cache.add(start_key, now - self.duration, timeout)
+        self.cache.add(taken_key, 0, timeout)
+        start = self.cache.get(start_key, now - self.duration)
+        try:
+            taken = self.cache.incr(taken_key)
+        except ValueError:
+            # Evicted between add() and incr()
+            self.cache.set(taken_key, 1, timeout)
+            taken = 1
+        self.cache.touch(start_key, timeout)
+        self.cache.touch(taken_key, timeout)
+
+        available = (now - start) * refill_rate - (taken - 1)
+        if available > capacity:
+            # Never hold more than a full bucket: move the start forward
+            available = capacity
+            self.cache.set(start_key, now - (capacity + taken - 1) / refill_rate, timeout)
+        if available >= 1:
+            return True
+        # Denied attempts do not use up tokens
+        self.cache.decr(taken_key)
+        self.wait_seconds = (1 - available) / refill_rate
+        return False
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class LoginIPThrottle(TokenBucketThrottle):
+    scope = 'login_ip'
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class LoginUsernameThrottle(TokenBucketThrottle):
+    """Limits attempts on one account, whichever addresses they come from"""
+    scope = 'login_username'
+
+    def get_cache_key(self, request, view):
+        username = request.data.get('username')
+        if not isinstance(username, str) or not username:
+            return None
+        return self.cache_format % {'scope': self.scope, 'ident': username_key(username)}
+
+
+class RegisterIPThrottle(LoginIPThrottle):
+    scope = 'register_ip'
+
+
+def username_key(username):
+    # Cache keys must be short and free of spaces and control characters
+    return username.strip().lower().encode().hex()[:200]
+
+
+def _cooldown_keys(request, username):
+    ident = f'{username_key(username)}_{BaseThrottle().get_ident(request)}'
+    return f'login_failures_{ident}', f'login_cooldown_{ident}'
+
+
+def login_cooldown(request, username):
+    """Seconds left before ``username`` may try to log in again from this client"""
+    cache = TokenBucketThrottle.cache
+    _, cooldown_key = _cooldown_keys(request, username)
+    until = cache.get(cooldown_key)
+    return max(until - time.time(), 0) if until else 0
+
+
+def login_failed(request, username):
+    """Count a failed login; after LOGIN_FREE_FAILURES, each one doubles the wait"""
+    cache = TokenBucketThrottle.cache
+    failures_key, cooldown_key = _cooldown_keys(request, username)
+    cache.add(failures_key, 0, settings.LOGIN_COOLDOWN_MAX_SECONDS)
+    try:
+        failures = cache.incr(failures_key)
+    except ValueError:
+        cache.set(failures_key, 1, settings.LOGIN_COOLDOWN_MAX_SECONDS)
+        failures = 1
+    cache.touch(failures_key, settings.LOGIN_COOLDOWN_MAX_SECONDS)
+    excess = failures - settings.LOGIN_FREE_FAILURES
+    if excess > 0:
+        delay = min(settings.LOGIN_COOLDOWN_SECONDS * 2 ** (excess - 1), settings.LOGIN_COOLDOWN_MAX_SECONDS)
+        cache.set(cooldown_key, time.time() + delay, delay)
+
+
+def login_succeeded(request, username):
+    TokenBucketThrottle.cache.delete_many(_cooldown_keys(request, username))
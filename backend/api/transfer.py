@@ -0,0 +1,128 @@
+"""NDJSON export and import of users, posts and comments.
+
+An export is one JSON object per line. A ``meta`` header comes first,
+then ``user``, ``post`` and ``comment`` records, each type in primary key
+order. Posts carry their tag names. Primary keys are kept, so an export
+loads into an empty database with every reference intact. Rows whose key
+already exists are skipped, which makes an interrupted import safe to run
+again from its last checkpoint.
+
+Image files can be packed into a tar archive next to the NDJSON file,
+stored under their media storage names.
+"""
+import datetime
+import json
+import os
+import time
+
+from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.dateparse import parse_datetime
+
+from .models import Comment, Post
+
+FORMAT_VERSION = 1
+
+USER_FIELDS = [
+    'id', 'username', 'email', 'first_name', 'last_name', 'password',
+    'is_active', 'is_staff', 'is_superuser', 'date_joined', 'last_login',
+]
+POST_FIELDS = [
+    'id', 'author_id', 'title', 'content', 'image', 'created_date', 'updated_date',
+    'location', 'latitude', 'longitude', 'geohash',
+]
+COMMENT_FIELDS = ['id', 'post_id', 'author_id', 'content', 'created_date']
+DATETIME_FIELDS = {'date_joined', 'last_login', 'created_date', 'updated_date'}
+
+# Record type -> (model, exported fields), in export order
+RECORD_TYPES = {
+    'user': (User, USER_FIELDS),
+    'post': (Post, POST_FIELDS),
+    'comment': (Comment, COMMENT_FIELDS),
+}
+
+
+class ExportEncoder(DjangoJSONEncoder):
+    # DjangoJSONEncoder rounds datetimes to milliseconds; keep them exact
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode(record):
+    return json.dumps(record, cls=ExportEncoder, ensure_ascii=False).encode() + b'\n'
+
+
+def to_record(kind, obj):
+    _, fields = RECORD_TYPES[kind]
+    record = {'type': kind}
+    for name in fields:
+        value = getattr(obj, name)
+        if name == 'image':
+            # FieldFile -> storage name
+            value = value.name or ''
+        record[name] = value
+    if kind == 'post':
+        record['tags'] = [tag.name for tag in obj.tags.all()]
+    return record
+
+
+def from_record(record):
+    """Return an unsaved model instance and, for posts, its tag names"""
+    model, fields = RECORD_TYPES[record['type']]
+    values = {}
+    for name in fields:
+        value = record.get(name)
+        if name in DATETIME_FIELDS and value:
+            value = parse_datetime(value)
+        if value is not None:
+            values[name] = value
+    return model(**values), record.get('tags', [])
+
+
+class Checkpoint:
+    """Progress state kept in a small JSON file so an interrupted run can resume"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as checkpoint:
+                return json.load(checkpoint)
+        except FileNotFoundError:
+            return None
+
+    def save(self, **state):
+        # Write-then-rename, so a crash never leaves a half-written checkpoint
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'w') as checkpoint:
+            json.dump(state, checkpoint)
+        os.replace(temporary, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Progress:
+    """Counts records per type and reports throughput every ``interval`` seconds"""
+
+    def __init__(self, write, interval=5.0):
+        self.write = write
+        self.interval = interval
+        self.counts = {}
+        self.started = self.reported = time.monotonic()
+
+    def add(self, kind, count=1):
+        self.counts[kind] = self.counts.get(kind, 0) + count
+        if time.monotonic() - self.reported >= self.interval:
+            self.report()
+
+    def report(self, prefix=''):
+        self.reported = time.monotonic()
+        elapsed = max(self.reported - self.started, 1e-6)
+        total = sum(self.counts.values())
+        detail = ', '.join(f'{count} {kind}s' for kind, count in self.counts.items())
+        self.write(f'{prefix}{detail or "0 records"} in {elapsed:.1f}s ({total / elapsed:.0f} records/s)')
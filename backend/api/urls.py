@@ -1,9 +1,21 @@
+from django.conf import settings
 from django.urls import path
+from . import async_views
 from .views import (
-    RegisterView, LoginView, UserProfileView, PostListView, 
-    PostDetailView, CommentCreateView, public_posts
+    RegisterView, LoginView, UserProfileView, PostListView, UserPostListView,
+    PostDetailView, CommentListCreateView, PostSearchView, TagListView, public_posts,
+    BatchPostView, BatchCommentView, nearby_posts, post_image_variant, cache_stats
 )
 
+if settings.ASYNC_READ_VIEWS:
+    post_list = async_views.post_list
+    post_detail = async_views.post_detail
+    public_posts_view = async_views.public_posts
+else:
+    post_list = PostListView.as_view()
+    post_detail = PostDetailView.as_view()
+    public_posts_view = public_posts
+
 urlpatterns = [
     # Authentication endpoints
     path('auth/register/', RegisterView.as_view(), name='register'),
@@ -11,10 +23,22 @@ urlpatterns = [
     path('auth/profile/', UserProfileView.as_view(), name='profile'),
     
     # Post endpoints
-    path('posts/', PostListView.as_view(), name='post-list'),
-    path('posts/<int:pk>/', PostDetailView.as_view(), name='post-detail'),
-    path('posts/<int:post_id>/comments/', CommentCreateView.as_view(), name='comment-create'),
+    path('posts/', post_list, name='post-list'),
+    path('posts/<int:pk>/', post_detail, name='post-detail'),
+    path('posts/nearby/', nearby_posts, name='post-nearby'),
+    path('posts/<int:pk>/image/<slug:variant>.<slug:fmt>', post_image_variant, name='post-image-variant'),
+    path('posts/<int:post_id>/comments/', CommentListCreateView.as_view(), name='post-comments'),
+    path('users/<int:user_id>/posts/', UserPostListView.as_view(), name='user-posts'),
+    path('tags/', TagListView.as_view(), name='tag-list'),
+    path('search/', PostSearchView.as_view(), name='post-search'),
+    
+    # Batch endpoints
+    path('batch/posts/', BatchPostView.as_view(), name='batch-posts'),
+    path('batch/comments/', BatchCommentView.as_view(), name='batch-comments'),
     
     # Public endpoints
-    path('public/posts/', public_posts, name='public-posts'),
+    path('public/posts/', public_posts_view, name='public-posts'),
+    
+    # Admin endpoints
+    path('cache/stats/', cache_stats, name='cache-stats'),
 ]
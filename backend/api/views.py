@@ -1,33 +1,68 @@
-from django.shortcuts import render
-from django.http import HttpResponse
-from django.views.generic import TemplateView
+import hmac
+
+from django.conf import settings
+from django.shortcuts import get_object_or_404
+from django.core.files.storage import default_storage
+from django.http import Http404, HttpResponse, HttpResponseRedirect
+from django.views.decorators.http import require_safe
+from django.views.generic import View
 from rest_framework import status, generics, permissions
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import NotFound, Throttled, ValidationError
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
-from .models import Post, Comment
+from django.db.models import Q
+from . import batch, cache as response_cache, media, metrics, spa
+from .authentication import tokens_for_user
+from .conditional import post_validators
+from .geo import covering_cells, distance_km
+from .images import ensure_variants, variant_name
+from .models import Post, Comment, Tag
+from .pagination import CommentCursorPagination, PostCursorPagination, SearchCursorPagination
+from .search import get_backend as get_search_backend
 from .serializers import (
     UserSerializer, UserRegistrationSerializer, PostSerializer, 
-    PostCreateSerializer, CommentSerializer
+    PostSummarySerializer, PostSearchResultSerializer, PostNearbySerializer,
+    PostCreateSerializer, CommentSerializer, BatchCommentSerializer, TagSerializer
+)
+from .throttling import (
+    LoginIPThrottle, LoginUsernameThrottle, RegisterIPThrottle, login_cooldown, login_failed, login_succeeded,
 )
 
-class ReactAppView(TemplateView):
-    template_name = 'index.html'
+
+def get_fieldset(request):
+    """Parse the ?fields= and ?expand= list parameters of a feed request"""
+    def split(name):
+        value = request.query_params.get(name, '')
+        return [item.strip() for item in value.split(',') if item.strip()]
+    return split('fields') or None, split('expand')
+
+
+def filter_feed(queryset, request):
+    """Apply the feed filters in the query string (currently ?tag=)"""
+    tag = request.query_params.get('tag')
+    if tag:
+        queryset = queryset.with_tag(tag)
+    return queryset
+
+class ReactAppView(View):
+    """The React app's shell for client-side routes, served from memory (api/spa.py)"""
+    http_method_names = ['get', 'head']
     
     def get(self, request, *args, **kwargs):
-        return render(request, self.template_name)
+        return spa.shell_response(request)
 
 class RegisterView(APIView):
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [RegisterIPThrottle]
     
     def post(self, request):
         serializer = UserRegistrationSerializer(data=request.data)
         if serializer.is_valid():
             user = serializer.save()
-            refresh = RefreshToken.for_user(user)
+            refresh = tokens_for_user(user)
             return Response({
                 'user': UserSerializer(user).data,
                 'refresh': str(refresh),
@@ -37,21 +72,27 @@ class RegisterView(APIView):
 
 class LoginView(APIView):
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [LoginIPThrottle, LoginUsernameThrottle]
     
     def post(self, request):
         username = request.data.get('username')
         password = request.data.get('password')
         
         if username and password:
+            wait = login_cooldown(request, username)
+            if wait:
+                raise Throttled(wait, 'Too many failed logins.')
             user = authenticate(username=username, password=password)
             if user:
-                refresh = RefreshToken.for_user(user)
+                login_succeeded(request, username)
+                refresh = tokens_for_user(user)
                 return Response({
                     'user': UserSerializer(user).data,
                     'refresh': str(refresh),
                     'access': str(refresh.access_token),
                 })
             else:
+                login_failed(request, username)
                 return Response({'error': 'Invalid credentials'}, status=status.HTTP_401_UNAUTHORIZED)
         else:
             return Response({'error': 'Username and password are required'}, status=status.HTTP_400_BAD_REQUEST)
@@ -64,7 +105,9 @@ class UserProfileView(APIView):
         return Response(serializer.data)
     
     def put(self, request):
-        serializer = UserSerializer(request.user, data=request.data, partial=True)
+        # request.user may come from a cache or the token; save a fresh row
+        user = get_object_or_404(User, pk=request.user.pk)
+        serializer = UserSerializer(user, data=request.data, partial=True)
         if serializer.is_valid():
             serializer.save()
             return Response(serializer.data)
@@ -73,38 +116,273 @@ class UserProfileView(APIView):
 class PostListView(generics.ListCreateAPIView):
     queryset = Post.objects.all()
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = PostCursorPagination
+    
+    def get_feed(self):
+        """Posts in the feed before pagination and field selection"""
+        return filter_feed(Post.objects.all(), self.request)
+    
+    def get_queryset(self):
+        if self.request.method == 'POST':
+            return super().get_queryset()
+        fields, expand = get_fieldset(self.request)
+        ordering = self.paginator.get_ordering(self.request, view=self)
+        return PostSummarySerializer.prepare_queryset(self.get_feed(), fields, expand, ordering)
     
     def get_serializer_class(self):
         if self.request.method == 'POST':
             return PostCreateSerializer
-        return PostSerializer
+        return PostSummarySerializer
+    
+    def get_serializer(self, *args, **kwargs):
+        if self.request.method == 'GET':
+            kwargs['fields'], kwargs['expand'] = get_fieldset(self.request)
+        return super().get_serializer(*args, **kwargs)
+    
+    def list(self, request, *args, **kwargs):
+        # Cached pages carry their own validators, so a 304 needs no query
+        cached, generation = response_cache.lookup_feed(request)
+        if cached is not None:
+            return cached
+        # Rendered once, by store_feed(); the Response itself is never rendered
+        response = super().list(request, *args, **kwargs)
+        return response_cache.store_feed(request, generation, response.data)
     
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
     
 
+class UserPostListView(PostListView):
+    """Posts by one author, with the same parameters as the main feed"""
+    http_method_names = ['get', 'head', 'options']
+    permission_classes = [permissions.AllowAny]
+    
+    def list(self, request, *args, **kwargs):
+        # 404 for unknown authors, also when a page of theirs is cached
+        self.get_feed()
+        return super().list(request, *args, **kwargs)
+    
+    def get_feed(self):
+        if not hasattr(self, '_author'):
+            self._author = get_object_or_404(User.objects.only('id'), pk=self.kwargs['user_id'])
+        return super().get_feed().filter(author=self._author)
+
 
 class PostDetailView(generics.RetrieveUpdateDestroyAPIView):
-    queryset = Post.objects.all()
+    queryset = Post.objects.for_feed()
     serializer_class = PostSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     
+    def retrieve(self, request, *args, **kwargs):
+        validators = post_validators(request, kwargs['pk'])
+        if validators is None:
+            raise NotFound()
+        not_modified = validators.not_modified(request)
+        if not_modified is not None:
+            return not_modified
+        cached, version = response_cache.lookup_post(request, kwargs['pk'])
+        if cached is not None:
+            return validators.apply(cached)
+        response = super().retrieve(request, *args, **kwargs)
+        return validators.apply(response_cache.store_post(request, kwargs['pk'], version, response.data))
+    
     def perform_update(self, serializer):
         serializer.save(author=self.request.user)
 
-class CommentCreateView(generics.CreateAPIView):
+class CommentListCreateView(generics.ListCreateAPIView):
+    """Comments of a post, newest first, and adding a comment"""
     serializer_class = CommentSerializer
-    permission_classes = [permissions.IsAuthenticated]
+    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = CommentCursorPagination
+    
+    def get_post(self):
+        if not hasattr(self, '_post'):
+            self._post = get_object_or_404(Post.objects.only('id'), pk=self.kwargs['post_id'])
+        return self._post
+    
+    def get_queryset(self):
+        return Comment.objects.filter(post=self.get_post()).select_related('author')
     
     def perform_create(self, serializer):
-        post_id = self.kwargs.get('post_id')
-        post = Post.objects.get(id=post_id)
-        serializer.save(author=self.request.user, post=post)
+        serializer.save(author=self.request.user, post=self.get_post())
+
+class BatchCreateView(APIView):
+    """Create many objects from a JSON array in one transaction.
+
+    Items are validated with ``serializer_class(many=True)``; if any item is
+    invalid nothing is stored and ``errors`` lists one entry per item (empty
+    for valid ones). Valid items are passed to ``create_items(user, items)``,
+    which returns the created objects.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = None
+    create_items = None
+
+    def post(self, request):
+        items = request.data
+        if not isinstance(items, list) or not items:
+            return Response({'detail': 'Expected a non-empty JSON array.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > settings.BATCH_MAX_ITEMS:
+            return Response(
+                {'detail': f'A batch may contain at most {settings.BATCH_MAX_ITEMS} items.'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        serializer = self.serializer_class(data=items, many=True, context={'request': request})
+        serializer.is_valid()
+        errors = serializer.errors or self.check_items(serializer.validated_data)
+        if any(errors):
+            return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+        created = self.create_items(request.user, serializer.validated_data)
+        return Response(
+            {'count': len(created), 'ids': [obj.pk for obj in created]},
+            status=status.HTTP_201_CREATED,
+        )
+
+    def check_items(self, items):
+        """Per-item errors that need the database, checked for the whole batch at once"""
+        return []
+
+
+class BatchPostView(BatchCreateView):
+    serializer_class = PostCreateSerializer
+    create_items = staticmethod(batch.create_posts)
+
+
+class BatchCommentView(BatchCreateView):
+    serializer_class = BatchCommentSerializer
+    create_items = staticmethod(batch.create_comments)
+
+    def check_items(self, items):
+        existing = set(Post.objects.filter(pk__in={item['post'] for item in items}).values_list('pk', flat=True))
+        return [
+            {} if item['post'] in existing else {'post': [f'Post {item["post"]} does not exist.']}
+            for item in items
+        ]
+
 
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])
 def public_posts(request):
     """Public endpoint to view posts without authentication"""
-    posts = Post.objects.all()
-    serializer = PostSerializer(posts, many=True)
-    return Response(serializer.data)
+    cached, generation = response_cache.lookup_feed(request)
+    if cached is not None:
+        return cached
+    fields, expand = get_fieldset(request)
+    paginator = PostCursorPagination()
+    queryset = filter_feed(Post.objects.all(), request)
+    queryset = PostSummarySerializer.prepare_queryset(
+        queryset, fields, expand, paginator.get_ordering(request),
+    )
+    page = paginator.paginate_queryset(queryset, request)
+    serializer = PostSummarySerializer(page, many=True, fields=fields, expand=expand)
+    data = paginator.get_paginated_response(serializer.data).data
+    return response_cache.store_feed(request, generation, data)
+
+class PostSearchView(generics.ListAPIView):
+    """Full-text search over post title, content, location and tags"""
+    serializer_class = PostSearchResultSerializer
+    permission_classes = [permissions.AllowAny]
+    pagination_class = SearchCursorPagination
+    
+    def get_queryset(self):
+        text = self.request.query_params.get('q', '').strip()
+        if not text:
+            raise ValidationError({'q': 'A search query is required.'})
+        fields, expand = get_fieldset(self.request)
+        queryset = get_search_backend().search(filter_feed(Post.objects.all(), self.request), text)
+        ordering = self.paginator.get_ordering(self.request, queryset, self)
+        return PostSearchResultSerializer.prepare_queryset(queryset, fields, expand, ordering)
+    
+    def get_serializer(self, *args, **kwargs):
+        kwargs['fields'], kwargs['expand'] = get_fieldset(self.request)
+        return super().get_serializer(*args, **kwargs)
+
+class TagListView(generics.ListAPIView):
+    """Tags in use, most popular first"""
+    queryset = Tag.objects.filter(usage_count__gt=0).order_by('-usage_count', 'name')
+    serializer_class = TagSerializer
+    permission_classes = [permissions.AllowAny]
+    pagination_class = None
+
+def parse_float(request, name, default=None, minimum=None, maximum=None):
+    value = request.query_params.get(name)
+    if value is None:
+        if default is None:
+            raise ValidationError({name: 'This parameter is required.'})
+        return default
+    try:
+        number = float(value)
+    except ValueError:
+        raise ValidationError({name: 'A number is required.'})
+    if (minimum is not None and number < minimum) or (maximum is not None and number > maximum):
+        raise ValidationError({name: f'Must be between {minimum} and {maximum}.'})
+    return number
+
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def nearby_posts(request):
+    """Posts within ?radius= km of ?lat=/?lon=, nearest first"""
+    lat = parse_float(request, 'lat', minimum=-90, maximum=90)
+    lon = parse_float(request, 'lon', minimum=-180, maximum=180)
+    radius = parse_float(request, 'radius', default=settings.NEARBY_DEFAULT_RADIUS_KM,
+                         minimum=0, maximum=settings.NEARBY_MAX_RADIUS_KM)
+    limit = int(parse_float(request, 'limit', default=settings.API_PAGE_SIZE,
+                            minimum=1, maximum=settings.API_MAX_PAGE_SIZE))
+
+    # Prefilter with geohash prefix ranges (index range scans), then rank
+    # the candidates by exact distance.
+    cells = Q()
+    for cell in covering_cells(lat, lon, radius):
+        cells |= Q(geohash__gte=cell, geohash__lt=cell + '~')
+    candidates = filter_feed(Post.objects.all(), request).filter(cells).values_list(
+        'id', 'latitude', 'longitude'
+    )
+    distances = {}
+    for post_id, post_lat, post_lon in candidates.iterator():
+        distance = distance_km(lat, lon, post_lat, post_lon)
+        if distance <= radius:
+            distances[post_id] = distance
+    nearest = sorted(distances, key=lambda post_id: (distances[post_id], post_id))[:limit]
+
+    fields, expand = get_fieldset(request)
+    posts = PostNearbySerializer.prepare_queryset(
+        Post.objects.filter(id__in=nearest), fields, expand
+    ).in_bulk()
+    serializer = PostNearbySerializer(
+        # Posts deleted since the distance query are left out
+        [posts[post_id] for post_id in nearest if post_id in posts], many=True,
+        fields=fields, expand=expand, context={'distances': distances},
+    )
+    return Response({'count': len(distances), 'results': serializer.data})
+
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def post_image_variant(request, pk, variant, fmt):
+    """Generate a post's image variants on first use and redirect to the file"""
+    if variant not in settings.IMAGE_VARIANTS or fmt not in settings.IMAGE_VARIANT_FORMATS:
+        raise Http404
+    post = get_object_or_404(Post.objects.only('id', 'image'), pk=pk)
+    if not post.image:
+        raise Http404
+    ensure_variants(post.image.name)
+    return HttpResponseRedirect(default_storage.url(variant_name(post.image.name, variant, fmt)))
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def cache_stats(request):
+    """Hit/miss counters of the feed response cache"""
+    return Response(response_cache.cache_stats())
+
+@require_safe
+def media_file(request, name):
+    """Uploaded media, for posts that exist; see api/media.py"""
+    return media.serve(request, name)
+
+def metrics_export(request):
+    """Prometheus scrape endpoint; needs ``Authorization: Bearer METRICS_TOKEN`` when that is set"""
+    if settings.METRICS_TOKEN:
+        expected = f'Bearer {settings.METRICS_TOKEN}'
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), expected):
+            return HttpResponse(status=status.HTTP_401_UNAUTHORIZED, headers={'WWW-Authenticate': 'Bearer'})
+    body, content_type = metrics.export()
+    return HttpResponse(body, content_type=content_type)
@@ -0,0 +1,347 @@
+"""Latency, throughput and query counts of the API endpoints.
+
+By default a scratch SQLite database is migrated and filled by
+benchmarks.seed, and concurrent threads call the Django WSGI application
+in this process, so each request also reports the SQL queries it ran.
+With --url the same workload goes to a running server over HTTP instead
+(seed its database with benchmarks.seed first); query counts are not
+available then.
+
+Results can be saved as JSON and compared with an earlier run. A run
+regresses when an endpoint's p95 latency is more than --max-slowdown
+above the baseline, its throughput more than --max-slowdown below it, or
+it runs more queries per request; the exit status is then 1.
+
+Usage, from backend/:
+
+    python -m benchmarks.api_load --output baseline.json
+    python -m benchmarks.api_load --baseline baseline.json --output current.json
+    python -m benchmarks.api_load --url http://127.0.0.1:8000 --endpoints public-feed post-detail
+"""
+import argparse
+import http.client
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from io import BytesIO
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from benchmarks import seed
+from benchmarks.db_throughput import percentile
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+# name: (method, path, needs a token); {post}, {author} and {word} are
+# filled from the seeded data. Writes come last so reads see the seed as is.
+ENDPOINTS = {
+    'public-feed': ('GET', '/api/public/posts/', False),
+    'public-feed-discussed': ('GET', '/api/public/posts/?sort=discussed', False),
+    'post-list': ('GET', '/api/posts/', False),
+    'post-detail': ('GET', '/api/posts/{post}/', False),
+    'post-comments': ('GET', '/api/posts/{post}/comments/', False),
+    'user-posts': ('GET', '/api/users/{author}/posts/', False),
+    'tags': ('GET', '/api/tags/', False),
+    'search': ('GET', '/api/search/?q={word}', False),
+    'nearby': ('GET', '/api/posts/nearby/?lat=38.72&lon=-9.14&radius=100', False),
+    'profile': ('GET', '/api/auth/profile/', True),
+    'comment-create': ('POST', '/api/posts/{post}/comments/', True),
+}
+COMMENT_BODY = json.dumps({'content': 'Benchmark comment'}).encode()
+
+
+class WSGIClient:
+    """Calls the Django WSGI application directly, counting queries per request"""
+
+    def __init__(self, application):
+        from django.db import connection
+
+        self.application = application
+        self.connection = connection
+        self.queries = 0
+
+    def count(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def request(self, method, path, body=b'', headers=None):
+        path, _, query = path.partition('?')
+        environ = {
+            'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': query,
+            'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+            'HTTP_HOST': 'localhost', 'HTTP_ACCEPT': 'application/json', 'REMOTE_ADDR': '127.0.0.1',
+            'CONTENT_TYPE': 'application/json', 'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': BytesIO(body), 'wsgi.errors': sys.stderr, 'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http', 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+        }
+        for name, value in (headers or {}).items():
+            environ['HTTP_' + name.upper().replace('-', '_')] = value
+        status = []
+        self.queries = 0
+        # The connection belongs to this thread and survives reconnects
+        with self.connection.execute_wrapper(self.count):
+            result = self.application(environ, lambda line, response_headers, exc_info=None: status.append(line))
+            try:
+                content = b''.join(result)
+            finally:
+                # Fires request_finished, like a WSGI server
+                result.close()
+        return int(status[0].split()[0]), content, self.queries
+
+    def close(self):
+        from django.db import connections
+
+        connections.close_all()
+
+
+class HTTPClient:
+    """Keep-alive HTTP connection to a running server; one per thread"""
+
+    def __init__(self, url):
+        url = urlsplit(url)
+        self.host, self.port = url.hostname, url.port or 80
+        self.connection = None
+
+    def request(self, method, path, body=b'', headers=None):
+        headers = {'Accept': 'application/json', 'Content-Type': 'application/json', **(headers or {})}
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            try:
+                self.connection.request(method, path, body or None, headers)
+                response = self.connection.getresponse()
+                content = response.read()
+            except (http.client.HTTPException, OSError):
+                # The server closed the kept-alive connection; retry once on a new one
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+            else:
+                if response.getheader('Connection', '').lower() == 'close':
+                    self.connection.close()
+                    self.connection = None
+                return response.status, content, None
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+
+
+def prepare(client):
+    """Log in as a seeded user and pick the posts and authors to request"""
+    status, content, _ = client.request('POST', '/api/auth/login/', json.dumps({
+        'username': 'bench0', 'password': seed.PASSWORD,
+    }).encode())
+    if status != 200:
+        raise SystemExit(f'Could not log in as bench0 ({status}); is the database seeded with benchmarks.seed?')
+    token = json.loads(content)['access']
+    status, content, _ = client.request('GET', '/api/public/posts/?page_size=50')
+    posts = json.loads(content)['results']
+    client.close()
+    return {
+        'token': token,
+        'post': [post['id'] for post in posts],
+        'author': sorted({post['author']['id'] for post in posts}),
+        'word': seed.WORDS[:10],
+    }
+
+
+def run_endpoint(make_client, name, data, options):
+    """Warm up, then time ``options.requests`` requests from ``options.concurrency`` threads"""
+    method, template, needs_token = ENDPOINTS[name]
+    headers = {'Authorization': f"Bearer {data['token']}"} if needs_token else {}
+    body = COMMENT_BODY if method == 'POST' else b''
+    # Every thread warms up (and connects) on its own
+    warmup = max(1, -(-options.warmup // options.concurrency))
+    measured = itertools.count()
+    latencies, queries, sizes, errors = [], [], [], []
+    started = []
+    barrier = threading.Barrier(options.concurrency, action=lambda: started.append(time.perf_counter()))
+
+    def send(client, counter, total, record):
+        while True:
+            n = next(counter)
+            if n >= total:
+                return
+            path = template.format(**{key: data[key][n % len(data[key])] for key in ('post', 'author', 'word')})
+            begin = time.perf_counter()
+            try:
+                status, content, count = client.request(method, path, body, headers)
+            except (http.client.HTTPException, OSError):
+                status, content, count = None, b'', None
+            if not record:
+                continue
+            if status is None or status >= 400:
+                errors.append(status)
+                continue
+            latencies.append(time.perf_counter() - begin)
+            sizes.append(len(content))
+            if count is not None:
+                queries.append(count)
+
+    def worker():
+        client = make_client()
+        try:
+            send(client, itertools.count(), warmup, False)
+            # Measuring starts with all threads at once
+            barrier.wait()
+            send(client, measured, options.requests, True)
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(options.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started[0]
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'throughput': len(latencies) / elapsed,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'queries': sum(queries) / len(queries) if queries else None,
+        'bytes': sum(sizes) // len(sizes) if sizes else 0,
+    }
+
+
+def compare(results, baseline, max_slowdown):
+    """Regressions of ``results`` against ``baseline``, as messages"""
+    regressions = []
+    for name, current in results['endpoints'].items():
+        previous = baseline['endpoints'].get(name)
+        if previous is None:
+            continue
+        if current['p95_ms'] > previous['p95_ms'] * (1 + max_slowdown):
+            regressions.append(f"{name}: p95 {previous['p95_ms']:.1f}ms -> {current['p95_ms']:.1f}ms")
+        if current['throughput'] < previous['throughput'] * (1 - max_slowdown):
+            regressions.append(f"{name}: throughput {previous['throughput']:.0f}/s -> {current['throughput']:.0f}/s")
+        if None not in (current['queries'], previous['queries']) and current['queries'] > previous['queries'] + 0.01:
+            regressions.append(f"{name}: queries per request {previous['queries']:.2f} -> {current['queries']:.2f}")
+        if current['errors'] > previous['errors']:
+            regressions.append(f"{name}: {current['errors']} errors (baseline {previous['errors']})")
+    return regressions
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(results, baseline):
+    print(f"{'endpoint':<22} {'req/s':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'queries':>8} {'errors':>6}  vs baseline p95")
+    for name, result in results['endpoints'].items():
+        queries = '-' if result['queries'] is None else f"{result['queries']:.1f}"
+        line = (
+            f"{name:<22} {result['throughput']:>7.0f} {result['p50_ms']:>6.1f}ms {result['p95_ms']:>6.1f}ms "
+            f"{result['p99_ms']:>6.1f}ms {queries:>8} {result['errors']:>6}"
+        )
+        previous = baseline and baseline['endpoints'].get(name)
+        if previous and previous['p95_ms']:
+            line += f"  {(result['p95_ms'] / previous['p95_ms'] - 1) * 100:+.0f}%"
+        print(line)
+
+
+def setup_django(options, directory):
+    """Point Django at a scratch database and media directory and seed them"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'travel_blog.settings')
+    os.environ.pop('DATABASE_URL', None)
+    os.environ.update(
+        SQLITE_PATH=os.path.join(directory, 'bench.sqlite3'),
+        MEDIA_ROOT=os.path.join(directory, 'media'),
+        DEBUG='False',
+    )
+    if options.no_cache:
+        os.environ['FEED_CACHE_BACKEND'] = 'django.core.cache.backends.dummy.DummyCache'
+
+    import django
+
+    django.setup()
+    from django.core.management import call_command
+
+    call_command('migrate', verbosity=0)
+    return seed.seed_dataset(options.users, options.posts, options.comments, options.images, options.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='Benchmark a running server instead of the in-process application')
+    parser.add_argument('--endpoints', nargs='+', choices=list(ENDPOINTS), default=list(ENDPOINTS))
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent client threads')
+    parser.add_argument('--requests', type=int, default=300, help='Measured requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=20, help='Unmeasured requests per endpoint first, spread over the threads')
+    parser.add_argument('--no-cache', action='store_true', help='Disable the feed cache (in-process only)')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--baseline', help='Compare with the results in this JSON file')
+    parser.add_argument('--max-slowdown', type=float, default=0.2,
+                        help='Allowed p95 increase and throughput decrease, as a fraction (default 0.2)')
+    seed.add_arguments(parser)
+    options = parser.parse_args()
+
+    baseline = None
+    if options.baseline:
+        with open(options.baseline) as source:
+            baseline = json.load(source)
+
+    with tempfile.TemporaryDirectory() as directory:
+        if options.url:
+            dataset = None
+
+            def make_client():
+                return HTTPClient(options.url)
+        else:
+            dataset = setup_django(options, directory)
+            from django.core.wsgi import get_wsgi_application
+
+            application = get_wsgi_application()
+
+            def make_client():
+                return WSGIClient(application)
+
+        data = prepare(make_client())
+        results = {
+            'meta': {
+                'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'target': options.url or 'in-process',
+                'dataset': dataset,
+                **{key: getattr(options, key) for key in ('concurrency', 'requests', 'warmup', 'no_cache')},
+            },
+            'endpoints': {},
+        }
+        print(f"{options.concurrency} threads, {options.requests} requests per endpoint, target {results['meta']['target']}\n")
+        for name in options.endpoints:
+            results['endpoints'][name] = run_endpoint(make_client, name, data, options)
+
+    print_table(results, baseline)
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(results, output, indent=2)
+            output.write('\n')
+    if baseline is not None:
+        regressions = compare(results, baseline, options.max_slowdown)
+        print('\nRegressions:' if regressions else '\nNo regressions against the baseline.')
+        for message in regressions:
+            print(f'  {message}')
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
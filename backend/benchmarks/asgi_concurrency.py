@@ -0,0 +1,149 @@
+"""Concurrent-connection throughput of the sync (WSGI) and ASGI profiles.
+
+Starts gunicorn on a scratch SQLite database in each profile and opens
+many connections at once against the read endpoints. With --slow-ms
+every client pauses halfway through sending its request, like a client
+on a poor mobile connection; a sync worker is blocked for that time,
+an async worker serves other requests meanwhile.
+
+    sync   gunicorn travel_blog.wsgi (sync workers)
+    asgi   gunicorn -c gunicorn_asgi.conf.py travel_blog.asgi
+
+Usage, from backend/ (needs uvicorn for the asgi profile):
+
+    python -m benchmarks.asgi_concurrency --connections 100 --slow-ms 200
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.db_throughput import percentile
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+PROFILES = {
+    'sync': ['gunicorn', 'travel_blog.wsgi:application'],
+    'asgi': ['gunicorn', '-c', 'gunicorn_asgi.conf.py', 'travel_blog.asgi:application'],
+}
+
+
+def prepare_database(env, posts):
+    """Migrate and seed the scratch database in a child process"""
+    script = (
+        'import django; django.setup()\n'
+        'from django.core.management import call_command\n'
+        'from benchmarks.db_throughput import seed\n'
+        "call_command('migrate', verbosity=0)\n"
+        f'seed({posts})\n'
+    )
+    subprocess.run([sys.executable, '-c', script], cwd=BACKEND_DIR, env=env, check=True)
+
+
+async def fetch(port, path, slow):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\n'.encode())
+        await writer.drain()
+        if slow:
+            await asyncio.sleep(slow)
+        writer.write(b'Accept: application/json\r\nConnection: close\r\n\r\n')
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    return response.split(b' ', 2)[1] == b'200'
+
+
+async def load(port, paths, connections, requests, slow):
+    latencies, failures = [], 0
+    queue = asyncio.Queue()
+    for n in range(requests):
+        queue.put_nowait(paths[n % len(paths)])
+
+    async def client():
+        nonlocal failures
+        while not queue.empty():
+            path = queue.get_nowait()
+            started = time.perf_counter()
+            try:
+                ok = await fetch(port, path, slow)
+            except OSError:
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - started)
+            else:
+                failures += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(connections)))
+    return latencies, failures, time.perf_counter() - started
+
+
+def wait_for_server(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if asyncio.run(fetch(port, '/api/public/posts/', 0)):
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f'Server on port {port} did not start')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profiles', nargs='+', choices=list(PROFILES), default=list(PROFILES))
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers per profile')
+    parser.add_argument('--connections', type=int, default=50, help='Concurrent client connections')
+    parser.add_argument('--requests', type=int, default=1000, help='Requests per profile')
+    parser.add_argument('--slow-ms', type=float, default=0, help='Pause in the middle of each request')
+    parser.add_argument('--posts', type=int, default=200, help='Posts in the scratch database')
+    parser.add_argument('--port', type=int, default=8765)
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(
+            os.environ,
+            DJANGO_SETTINGS_MODULE='travel_blog.settings',
+            SQLITE_PATH=os.path.join(directory, 'bench.sqlite3'),
+            DEBUG='False',
+            # Measure rendering, not the feed cache
+            FEED_CACHE_BACKEND='django.core.cache.backends.dummy.DummyCache',
+            WEB_CONCURRENCY=str(options.workers),
+            PORT=str(options.port),
+        )
+        env.pop('DATABASE_URL', None)
+        prepare_database(env, options.posts)
+        paths = ['/api/public/posts/', '/api/posts/', '/api/posts/1/', '/api/public/posts/?sort=discussed']
+
+        print(f'{options.connections} connections, {options.requests} requests, '
+              f'{options.workers} workers, {options.slow_ms:g}ms client pause\n')
+        print(f"{'profile':<8} {'req/s':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'failed':>7}")
+        for profile in options.profiles:
+            command = PROFILES[profile] + ['--workers', str(options.workers), '--bind', f'127.0.0.1:{options.port}']
+            server = subprocess.Popen(
+                command, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            )
+            try:
+                wait_for_server(options.port)
+                latencies, failures, elapsed = asyncio.run(
+                    load(options.port, paths, options.connections, options.requests, options.slow_ms / 1000)
+                )
+            finally:
+                server.terminate()
+                server.wait()
+            print(
+                f'{profile:<8} {len(latencies) / elapsed:>8.0f} '
+                + ' '.join(f'{percentile(latencies, q) * 1000:>7.1f}ms' for q in (0.5, 0.95, 0.99))
+                + f' {failures:>7}'
+            )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""Deterministic data set for the API benchmarks.
+
+The same options always produce the same users, posts, comments, tags and
+images (text, dates and, on an empty database, ids), so results from
+different branches compare like with like. Every user's password is
+``benchmark-password``.
+
+Usage, from backend/, against an empty database:
+
+    SQLITE_PATH=/tmp/bench.sqlite3 python manage.py migrate
+    SQLITE_PATH=/tmp/bench.sqlite3 python -m benchmarks.seed --users 50 --posts 2000 --images 100
+"""
+import argparse
+import os
+import random
+from datetime import datetime, timedelta, timezone
+from io import BytesIO
+
+PASSWORD = 'benchmark-password'
+# Fixed, so created_date does not depend on when the data was seeded
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+CITIES = [
+    ('Lisbon, Portugal', 38.7223, -9.1393),
+    ('Kyoto, Japan', 35.0116, 135.7681),
+    ('Cusco, Peru', -13.5320, -71.9675),
+    ('Reykjavik, Iceland', 64.1466, -21.9426),
+    ('Marrakesh, Morocco', 31.6295, -7.9811),
+    ('Hanoi, Vietnam', 21.0278, 105.8342),
+    ('Cape Town, South Africa', -33.9249, 18.4241),
+    ('Vancouver, Canada', 49.2827, -123.1207),
+    ('Tbilisi, Georgia', 41.7151, 44.8271),
+    ('Queenstown, New Zealand', -45.0312, 168.6626),
+]
+WORDS = (
+    'morning market train harbour mountain trail coffee street food museum old town sunset beach '
+    'ferry temple river bridge night walk local guide hostel rain view lake village festival '
+    'bus ride tea garden castle cliff island boat desert camp snow hike bakery square tower'
+).split()
+TAGS = [
+    'adventure', 'beach', 'budget', 'culture', 'food', 'hiking', 'history', 'islands', 'mountains',
+    'nature', 'nightlife', 'photography', 'roadtrip', 'solo', 'train', 'winter',
+]
+
+
+def sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def make_image(rng, size=(1200, 800)):
+    """A JPEG with a few coloured blocks, so it compresses like a photo more than a flat fill"""
+    from PIL import Image, ImageDraw
+
+    image = Image.new('RGB', size, tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        draw.rectangle(
+            [x, y, x + rng.randrange(50, 400), y + rng.randrange(50, 300)],
+            fill=tuple(rng.randrange(256) for _ in range(3)),
+        )
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', quality=85)
+    return buffer.getvalue()
+
+
+def seed_dataset(users=20, posts=500, comments=3, images=0, seed=0, log=print):
+    """Create the data set; ``comments`` is the average number per post"""
+    from django.contrib.auth.hashers import make_password
+    from django.contrib.auth.models import User
+    from django.core.files.base import ContentFile
+    from django.db import connection, transaction
+    from django.db.models import F
+
+    from api import search
+    from api.geo import encode_geohash
+    from api.models import Comment, ImageBlob, Post, PostTag, Tag
+    from api.storage import image_storage
+
+    rng = random.Random(seed)
+    with transaction.atomic():
+        # One hash for everybody; hashing per user would dominate seeding
+        password = make_password(PASSWORD, salt='benchmarks')
+        authors = User.objects.bulk_create([
+            User(username=f'bench{n}', email=f'bench{n}@example.com', first_name=f'Bench {n}', password=password)
+            for n in range(users)
+        ])
+        tags = Tag.objects.resolve(TAGS)
+
+        rows = []
+        for n in range(posts):
+            city, latitude, longitude = rng.choice(CITIES)
+            image = ''
+            if n < images:
+                # Content-addressed, so seeding again reuses the files
+                image = image_storage.save(f'blog_images/bench_{n}.jpg', ContentFile(make_image(rng)))
+            rows.append(Post(
+                title=f'{sentence(rng, 4)[:-1]} in {city.split(",")[0]}',
+                content='\n\n'.join(sentence(rng, rng.randrange(20, 80)) for _ in range(rng.randrange(2, 8))),
+                author=authors[rng.randrange(users)],
+                created_date=EPOCH + timedelta(minutes=7 * n),
+                location=city, latitude=latitude, longitude=longitude,
+                geohash=encode_geohash(latitude, longitude),
+                image=image,
+            ))
+        created = Post.objects.bulk_create(rows, batch_size=500)
+        seeded = Post.objects.filter(pk__gte=created[0].pk) if created else Post.objects.none()
+        # auto_now stamped the current time
+        seeded.update(updated_date=F('created_date'))
+        PostTag.objects.bulk_create([
+            PostTag(post=post, tag=tag) for post in created for tag in rng.sample(tags, rng.randrange(4))
+        ], batch_size=1000)
+        Tag.objects.refresh_usage([tag.pk for tag in tags])
+        ImageBlob.objects.refresh({post.image.name for post in created if post.image})
+
+        rows = []
+        for post in created:
+            for minute in range(rng.randrange(2 * comments + 1)):
+                rows.append(Comment(
+                    post=post, author=authors[rng.randrange(users)], content=sentence(rng, rng.randrange(5, 30)),
+                    created_date=post.created_date + timedelta(minutes=minute * 13 + 1),
+                ))
+        Comment.objects.bulk_create(rows, batch_size=1000)
+        seeded.refresh_comment_stats()
+
+    if connection.vendor in search.BACKENDS:
+        search.get_backend().rebuild()
+    log(f'Seeded {users} users, {posts} posts ({min(images, posts)} with images) and {len(rows)} comments')
+    return {'users': users, 'posts': posts, 'images': min(images, posts), 'comments': len(rows)}
+
+
+def add_arguments(parser):
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--posts', type=int, default=500)
+    parser.add_argument('--comments', type=int, default=3, help='Average comments per post')
+    parser.add_argument('--images', type=int, default=0, help='Number of posts with an image')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed; other seeds give other data')
+
+
+def main():
+    import django
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    options = parser.parse_args()
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'travel_blog.settings')
+    django.setup()
+    seed_dataset(options.users, options.posts, options.comments, options.images, options.seed)
+
+
+if __name__ == '__main__':
+    main()
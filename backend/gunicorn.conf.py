@@ -0,0 +1,7 @@
+"""gunicorn settings; gunicorn reads this file by itself when started from backend/.
+
+    gunicorn travel_blog.wsgi:application
+"""
+from travel_blog.gunicorn_hooks import on_starting, use_metrics_dir  # noqa: F401
+
+use_metrics_dir()
@@ -0,0 +1,22 @@
+"""gunicorn settings for the ASGI profile: uvicorn workers and async read views.
+
+    gunicorn -c gunicorn_asgi.conf.py travel_blog.asgi:application
+
+Each worker serves many slow clients at once on the read endpoints;
+writes still run in a thread per request.
+"""
+import os
+
+from travel_blog.gunicorn_hooks import on_starting, use_metrics_dir  # noqa: F401
+
+use_metrics_dir()
+
+# Read before the workers import the Django settings
+os.environ.setdefault('ASYNC_READ_VIEWS', 'True')
+# Sync ORM work from async views runs in a thread per request, so a
+# persistent connection would be left open for every request served
+os.environ.setdefault('DATABASE_CONN_MAX_AGE', '0')
+
+worker_class = 'uvicorn.workers.UvicornWorker'
+workers = int(os.environ.get('WEB_CONCURRENCY', '2'))
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'travel_blog.settings')
 
 application = get_asgi_application()
+
+# Load the React app shell now rather than on the first request
+from api import spa  # noqa: E402
+
+spa.get_shell()
@@ -0,0 +1,19 @@
+"""gunicorn settings shared by gunicorn.conf.py and gunicorn_asgi.conf.py."""
+import os
+import shutil
+import tempfile
+
+
+def use_metrics_dir():
+    """Keep Prometheus metrics in files shared by the workers (api/metrics.py).
+
+    Must run in the gunicorn master, before any worker imports prometheus_client.
+    """
+    os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'travel-blog-metrics'))
+
+
+def on_starting(server):
+    # Files left by an earlier server would be added to this one's metrics
+    directory = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
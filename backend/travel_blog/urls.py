@@ -13,24 +13,27 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import re
+
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import include, path, re_path
 from django.conf import settings
-from django.conf.urls.static import static
-from django.views.generic import TemplateView
-from api.views import ReactAppView
+from api.views import ReactAppView, media_file, metrics_export
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('api.urls')),
-    # Serve static files
-    path('static/<path:path>', ReactAppView.as_view()),
-    path('manifest.json', ReactAppView.as_view()),
-    path('favicon.ico', ReactAppView.as_view()),
-    path('logo192.png', ReactAppView.as_view()),
-    # Serve React app for all other routes
-    path('', ReactAppView.as_view()),
+    path('metrics', metrics_export, name='metrics'),
+]
+
+# Uploaded media, in production as well (see api/media.py)
+urlpatterns += [
+    re_path(r'^%s(?P<name>.+)$' % re.escape(settings.MEDIA_URL.lstrip('/')), media_file, name='media'),
 ]
 
-# Serve media files
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# Everything else is a client-side route of the React app. Build assets
+# never get here: WhiteNoise serves them, and paths that look like files
+# (with an extension) are left to 404 rather than answered with HTML.
+urlpatterns += [
+    re_path(r'^(?!(api|admin|static|media)(/|$))(?!.*\.\w+/?$)', ReactAppView.as_view(), name='spa'),
+]
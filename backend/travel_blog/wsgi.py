@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'travel_blog.settings')
 
 application = get_wsgi_application()
+
+# Load the React app shell now rather than on the first request
+from api import spa  # noqa: E402
+
+spa.get_shell()
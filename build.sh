@@ -46,17 +46,17 @@ mkdir -p backend/static
 # Copy build files to Django static directory
 cp -r frontend/build/* backend/static/
 
+# Precompress the build (.br and .gz next to each file) for WhiteNoise
+python -m whitenoise.compress backend/static
+
 # Go to backend directory
 cd backend
 
 # Create staticfiles directory
 mkdir -p staticfiles
 
-# Collect static files
+# Collect static files (the React build is served from backend/static directly)
 python manage.py collectstatic --noinput
 
-# Ensure static files are properly served
-cp -r static/* staticfiles/ 2>/dev/null || true
-
 # Run migrations
 python manage.py migrate
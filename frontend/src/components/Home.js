@@ -26,7 +26,7 @@ import {
   Person as PersonIcon
 } from '@mui/icons-material';
 import { useNavigate } from 'react-router-dom';
-import { postsAPI } from '../services/api';
+import { postsAPI, cursorFromUrl } from '../services/api';
 
 // Get backend URL from environment or use current domain
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL || window.location.origin;
@@ -34,6 +34,8 @@ const BACKEND_URL = process.env.REACT_APP_BACKEND_URL || window.location.origin;
 const Home = () => {
   const [posts, setPosts] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [user, setUser] = useState(null);
   const navigate = useNavigate();
 
@@ -48,7 +50,8 @@ const Home = () => {
   const fetchPosts = async () => {
     try {
       const response = await postsAPI.getPublicPosts();
-      setPosts(response.data);
+      setPosts(response.data.results);
+      setNextCursor(cursorFromUrl(response.data.next));
     } catch (error) {
       console.error('Error fetching posts:', error);
     } finally {
@@ -56,6 +59,19 @@ const Home = () => {
     }
   };
 
+  const fetchMorePosts = async () => {
+    setLoadingMore(true);
+    try {
+      const response = await postsAPI.getPublicPosts({ cursor: nextCursor });
+      setPosts((current) => [...current, ...response.data.results]);
+      setNextCursor(cursorFromUrl(response.data.next));
+    } catch (error) {
+      console.error('Error fetching posts:', error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleLogout = () => {
     localStorage.removeItem('access_token');
     localStorage.removeItem('refresh_token');
@@ -307,7 +323,10 @@ const Home = () => {
                                      <CardMedia
                      component="img"
                      height="200"
-                     image={`${BACKEND_URL}${post.image}`}
+                     image={post.image_variants ? post.image_variants.sizes.card.jpeg : `${BACKEND_URL}${post.image}`}
+                     srcSet={post.image_variants ? post.image_variants.srcset.webp : undefined}
+                     sizes="(max-width: 600px) 100vw, 400px"
+                     loading="lazy"
                      alt={post.title}
                     sx={{
                       objectFit: 'cover',
@@ -344,7 +363,7 @@ const Home = () => {
                       overflow: 'hidden',
                     }}
                   >
-                    {post.content}
+                    {post.excerpt}
                   </Typography>
 
                   {/* Post metadata */}
@@ -393,12 +412,12 @@ const Home = () => {
                   </Box>
 
                   {/* Tags */}
-                  {post.tags && (
+                  {post.tags?.length > 0 && (
                     <Box sx={{ display: 'flex', flexWrap: 'wrap', gap: 0.5, mb: 2 }}>
-                      {post.tags.split(',').map((tag, index) => (
+                      {post.tags.map((tag) => (
                         <Chip
-                          key={index}
-                          label={tag.trim()}
+                          key={tag}
+                          label={tag}
                           size="small"
                           icon={<TagIcon />}
                           sx={{
@@ -429,6 +448,27 @@ const Home = () => {
           ))}
         </Grid>
 
+        {nextCursor && (
+          <Box textAlign="center" mt={4}>
+            <Button
+              variant="outlined"
+              onClick={fetchMorePosts}
+              disabled={loadingMore}
+              sx={{
+                borderColor: '#8B5CF6',
+                color: '#8B5CF6',
+                '&:hover': {
+                  borderColor: '#EC4899',
+                  color: '#EC4899',
+                  backgroundColor: 'rgba(139, 92, 246, 0.1)',
+                }
+              }}
+            >
+              {loadingMore ? 'Loading...' : 'Load More Stories'}
+            </Button>
+          </Box>
+        )}
+
         {posts.length === 0 && (
           <Box textAlign="center" py={8}>
             <Typography 
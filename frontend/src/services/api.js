@@ -76,9 +76,29 @@ export const authAPI = {
   profile: () => api.get('/api/profile/'),
 };
 
+// Feeds are cursor-paginated: pass the opaque `cursor` from a previous
+// response's `next`/`previous` link to move between pages.
+// `sort` is 'recent' (default), 'discussed' or 'active'
+const feedParams = ({ cursor, pageSize, sort } = {}) => ({
+  params: {
+    ...(cursor && { cursor }),
+    ...(pageSize && { page_size: pageSize }),
+    ...(sort && { sort }),
+  },
+});
+
+// Extract the cursor token from a `next`/`previous` URL returned by the API
+export const cursorFromUrl = (url) => (url ? new URL(url).searchParams.get('cursor') : null);
+
 export const postsAPI = {
-  getPosts: () => api.get('/api/posts/'),
-  getPublicPosts: () => api.get('/api/public/posts/'),
+  getPosts: (options) => api.get('/api/posts/', feedParams(options)),
+  getPublicPosts: (options) => api.get('/api/public/posts/', feedParams(options)),
+  getUserPosts: (userId, options) => api.get(`/api/users/${userId}/posts/`, feedParams(options)),
+  searchPosts: (query, options) => {
+    const config = feedParams(options);
+    config.params.q = query;
+    return api.get('/api/search/', config);
+  },
   createPost: (data) => api.post('/api/posts/', data),
   getPost: (id) => api.get(`/api/posts/${id}/`),
   updatePost: (id, data) => api.put(`/api/posts/${id}/`, data),
@@ -86,6 +106,8 @@ export const postsAPI = {
 };
 
 export const commentsAPI = {
+  // Newest first; pass the cursor from `next` for older comments
+  getComments: (postId, options) => api.get(`/api/posts/${postId}/comments/`, feedParams(options)),
   createComment: (postId, data) => api.post(`/api/posts/${postId}/comments/`, data),
 };
 
@@ -101,7 +101,7 @@ def test_api():
     try:
         response = requests.get(f"{BASE_URL}/public/posts/")
         if response.status_code == 200:
-            posts = response.json()
+            posts = response.json()['results']
             print(f"✅ Retrieved {len(posts)} posts")
             for post in posts:
                 print(f"   - {post['title']} by {post['author']['username']}")